@@ -1,5 +1,5 @@
 import os
-import zipfile
+import argparse
 import xml.etree.ElementTree as ET
 from collections import defaultdict
 import shutil
@@ -7,6 +7,10 @@ from pathlib import Path
 import json
 from datetime import datetime
 from tqdm import tqdm
+from repack_zstd import open_archive, prefer_repacked
+from xml_records import find_archives
+import profiling
+from metrics import timed
 
 def create_temp_dir():
     """Создает временную директорию для распаковки архивов"""
@@ -16,11 +20,13 @@ def create_temp_dir():
     temp_dir.mkdir()
     return temp_dir
 
+@timed('extract')
 def extract_archive(archive_path, temp_dir):
-    """Распаковывает архив во временную директорию"""
-    with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+    """Распаковывает архив (ZIP или перепакованный zstd) во временную директорию"""
+    with open_archive(str(archive_path)) as zip_ref:
         zip_ref.extractall(temp_dir)
 
+@timed('analyze')
 def analyze_xml_structure(xml_file):
     """Анализирует структуру XML файла и возвращает информацию о связях"""
     tree = ET.parse(xml_file)
@@ -89,7 +95,16 @@ def save_results(total_structure, output_file):
         json.dump(result, f, ensure_ascii=False, indent=2)
 
 def main():
-    xml_dir = Path("xml")
+    parser = argparse.ArgumentParser(description='Анализ структуры XML файлов из скачанных архивов')
+    parser.add_argument('--data-dir', default='xml', help='Директория с архивами')
+    parser.add_argument('--prefer-repacked', action='store_true',
+                        help='Читать актуальные перепакованные копии (repack_zstd.py) вместо ZIP')
+    parser.add_argument('--repacked-dir', default='repacked', help='Директория перепакованных архивов')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.start_from_args(args)
+
+    xml_dir = Path(args.data_dir)
     temp_dir = create_temp_dir()
     output_file = f"xml_structure_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
     
@@ -106,13 +121,15 @@ def main():
         
         print("Сбор архивов для анализа...")
         
-        # Добавляем архивы из директории 248
-        xml_248_dir = xml_dir / "248"
-        if xml_248_dir.exists():
-            archives.extend(xml_248_dir.glob("*.zip"))
-        
-        # Добавляем архивы из корневой директории
-        archives.extend(xml_dir.glob("*.zip"))
+        # Добавляем архивы из всех поддиректорий xml (включая data/YYYY-MM с архивами одинаковых имен)
+        found = find_archives(xml_dir)
+        if args.prefer_repacked:
+            found = prefer_repacked(found, xml_dir, args.repacked_dir)
+        else:
+            # ZIP, перепакованный в ту же директорию, анализируем один раз - в исходном виде
+            zip_sources = {os.path.splitext(path)[0] for path in found if path.endswith('.zip')}
+            found = [path for path in found if path.endswith('.zip') or os.path.splitext(path)[0] not in zip_sources]
+        archives.extend(Path(archive) for archive in found)
         
         # Сортируем архивы по размеру
         archives.sort(key=get_file_size)
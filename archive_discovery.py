@@ -0,0 +1,166 @@
+import time
+import argparse
+from datetime import datetime
+from urllib.parse import urljoin
+import requests
+from state_store import StateStore, DEFAULT_STATE_DB
+from url_resolver import canonicalize_url
+from metrics import CACHE_LOOKUPS, record_cache
+
+API_URL = "https://proverki.gov.ru/api/portal/public-open-data/check/{year}/{month}"
+BLOB_BASE_URL = "https://proverki.gov.ru/blob/opendata/{year}/{month}/"
+DISCOVERY_NAMESPACE = 'api_discovery'
+
+# Ответ за текущий и прошлый месяц еще может меняться, более старые месяцы - нет
+RECENT_TTL = 6 * 3600
+HISTORICAL_TTL = 30 * 24 * 3600
+RECENT_MONTHS = 2
+# Пустой список мог прийти из-за незнакомой структуры ответа или временного сбоя, его перепроверяем скоро
+EMPTY_TTL = 3600
+
+# Ключи JSON, в которых API может отдавать ссылку, имя и размер файла
+URL_KEYS = ('url', 'link', 'href', 'fileUrl', 'downloadUrl', 'path')
+NAME_KEYS = ('fileName', 'filename', 'name', 'title')
+SIZE_KEYS = ('size', 'fileSize', 'length', 'contentLength')
+
+def get_api_headers(year, month, is_federal_law_248=False):
+    """Заголовки запроса к API портала"""
+    return {
+        'Accept': 'application/json, text/plain, */*',
+        'Accept-Encoding': 'gzip, deflate, br, zstd',
+        'Accept-Language': 'ru,ru-RU;q=0.9,en-US;q=0.8,en;q=0.7',
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36',
+        'sec-ch-ua': '"Chromium";v="136", "Google Chrome";v="136", "Not.A/Brand";v="99"',
+        'sec-ch-ua-mobile': '?0',
+        'sec-ch-ua-platform': '"Windows"',
+        'Referer': f'https://proverki.gov.ru/portal/public-open-data/check/{year}/{month}?isFederalLaw248={"true" if is_federal_law_248 else "false"}',
+        'Origin': 'https://proverki.gov.ru'
+    }
+
+def get_ttl(year, month):
+    """Срок кэша ответа: короткий для свежих месяцев, длинный для исторических"""
+    now = datetime.now()
+    months_ago = (now.year - year) * 12 + (now.month - month)
+    return RECENT_TTL if months_ago < RECENT_MONTHS else HISTORICAL_TTL
+
+def parse_size(value):
+    """Преобразует размер из ответа API в число байт"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def extract_archives(data, year, month):
+    """Находит в ответе API ссылки на архивы и их размеры
+
+    Структура ответа не зафиксирована, поэтому обходим JSON целиком и берем
+    любые строки, оканчивающиеся на .zip, вместе с размером из того же объекта.
+
+    Returns:
+        list: [{'url', 'name', 'size'}] без повторов URL
+    """
+    base_url = BLOB_BASE_URL.format(year=year, month=month)
+    archives = {}
+
+    def add(link, size=0):
+        url = canonicalize_url(urljoin(base_url, link.strip()))
+        if url not in archives or (size and not archives[url]['size']):
+            archives[url] = {'url': url, 'name': url.rsplit('/', 1)[-1], 'size': size}
+
+    def walk(node):
+        if isinstance(node, dict):
+            size = next((parse_size(node[key]) for key in SIZE_KEYS if key in node), 0)
+            for key in URL_KEYS + NAME_KEYS:
+                value = node.get(key)
+                if isinstance(value, str) and value.strip().lower().endswith('.zip'):
+                    add(value, size)
+                    break
+            for value in node.values():
+                if isinstance(value, (dict, list)):
+                    walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+        elif isinstance(node, str) and node.strip().lower().endswith('.zip'):
+            add(node)
+
+    walk(data)
+    return list(archives.values())
+
+def fetch_listing(year, month, is_federal_law_248, session, cached=None):
+    """Запрашивает список файлов за месяц, используя валидаторы из кэша
+
+    Returns:
+        tuple: (статус, данные или None, ETag, Last-Modified)
+    """
+    headers = get_api_headers(year, month, is_federal_law_248)
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+    params = {'isFederalLaw248': 'true' if is_federal_law_248 else 'false'}
+    response = session.get(API_URL.format(year=year, month=month), headers=headers, params=params, timeout=30)
+    if response.status_code == 304:
+        return 304, None, cached.get('etag'), cached.get('last_modified')
+    response.raise_for_status()
+    return response.status_code, response.json(), response.headers.get('etag'), response.headers.get('last-modified')
+
+def discover_archives(year, month, is_federal_law_248=False, store=None, session=None, refresh=False):
+    """Возвращает реальные архивы за месяц по данным API с кэшированием ответа
+
+    Ответ хранится в хранилище состояния вместе с ETag/Last-Modified. Пока
+    срок не истек, API не запрашивается. После истечения отправляется условный
+    запрос, и при 304 продлевается срок старого ответа. Пустой список
+    кэшируется только на EMPTY_TTL.
+
+    Returns:
+        list: [{'url', 'name', 'size'}] или None, если API недоступен и кэша нет
+    """
+    key = f"{year}/{month:02d}/{'248' if is_federal_law_248 else 'no248'}"
+    cached = store.get(DISCOVERY_NAMESPACE, key) if store is not None else None
+    if cached and not refresh and cached['expires'] > time.time():
+        record_cache('discovery', True)
+        return cached['archives']
+
+    session = session or requests.Session()
+    try:
+        status, data, etag, last_modified = fetch_listing(year, month, is_federal_law_248, session, cached)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Ошибка при получении данных API для {year}/{month}: {str(e)}")
+        # Устаревший ответ лучше, чем угадывание имени файла
+        return cached['archives'] if cached else None
+
+    CACHE_LOOKUPS.inc(cache='discovery', result='revalidated' if status == 304 else 'miss')
+    archives = cached['archives'] if status == 304 else extract_archives(data, year, month)
+    if store is not None:
+        # Без валидаторов пустой ответ не продлевается по 304, а запрашивается заново
+        store.set(DISCOVERY_NAMESPACE, key, {
+            'archives': archives,
+            'etag': etag if archives else None,
+            'last_modified': last_modified if archives else None,
+            'fetched_at': datetime.now().isoformat(),
+            'expires': time.time() + (get_ttl(year, month) if archives else EMPTY_TTL),
+        })
+    return archives
+
+def main():
+    parser = argparse.ArgumentParser(description='Поиск архивов за месяц через API открытых данных')
+    parser.add_argument('year', type=int, help='Год')
+    parser.add_argument('month', type=int, help='Месяц')
+    parser.add_argument('--federal-law-248', action='store_true', help='Данные по 248-ФЗ')
+    parser.add_argument('--state-db', default=DEFAULT_STATE_DB, help='Файл хранилища состояния')
+    parser.add_argument('--refresh', action='store_true', help='Запросить API, даже если ответ в кэше')
+    args = parser.parse_args()
+
+    with StateStore(args.state_db) as store:
+        archives = discover_archives(args.year, args.month, args.federal_law_248, store, refresh=args.refresh)
+    if archives is None:
+        print("API недоступен, кэшированного ответа нет")
+        return
+    print(f"Архивов за {args.year}/{args.month:02d}: {len(archives)}")
+    for archive in archives:
+        print(f"  - {archive['url']} ({archive['size']} байт)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+from datetime import datetime
+from mock_portal import MockPortal
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_FILE = os.path.join(SCRIPT_DIR, "benchmark_results.jsonl")
+
+# Сценарии портала: параметры MockPortal
+SCENARIOS = {
+    'clean': {'latency': 0.02},
+    'flaky': {'latency': 0.02, 'error_rate': 0.1, 'throttle_rate': 0.1, 'retry_after': 1},
+    'slow': {'latency': 0.2, 'bandwidth': 2 * 1024 * 1024},
+}
+
+# Пути скачивания, которые можно замерить (см. get_commands)
+PATHS = ('download_xml_data', 'legacy', 'scheduler', 'crawl', 'download_data')
+
+# Скрипт запуска download_data.py с адресами API и архивов, подмененными на локальный портал
+DOWNLOAD_DATA_RUNNER = """import sys, runpy
+sys.path.insert(0, {script_dir!r})
+import archive_discovery
+archive_discovery.API_URL = {base_url!r} + "/api/portal/public-open-data/check/{{year}}/{{month}}"
+archive_discovery.BLOB_BASE_URL = {base_url!r} + "/blob/opendata/{{year}}/{{month}}/"
+sys.argv = ["download_data.py"] + {args!r}
+runpy.run_path({script!r}, run_name="__main__")
+"""
+
+def script(name):
+    return os.path.join(SCRIPT_DIR, name)
+
+def get_commands(path, portal):
+    """Команды одного прохода скачивания и виды файлов, которые он должен получить
+
+    Returns:
+        tuple: (список команд, виды файлов)
+    """
+    python = sys.executable
+    if path == 'download_xml_data':
+        return [[python, script('download_xml_data.py'), '--quiet', '--metrics-json', 'metrics-1.json']], \
+            ('xml', 'zip', 'xsd')
+    if path == 'legacy':
+        return [
+            [python, script('download_xml_files.py'), '--metrics-json', 'metrics-1.json'],
+            [python, script('process_xml_files.py'), '--quiet', '--metrics-json', 'metrics-2.json'],
+        ], ('xml', 'zip', 'xsd')
+    if path == 'scheduler':
+        return [[python, script('scheduler.py'), '--base-dir', 'xml', '--metrics-json', 'metrics-1.json']], \
+            ('xml', 'zip', 'xsd')
+    if path == 'crawl':
+        crawl = [python, script('crawl_worker.py'), '--cas', 'cas']
+        return [
+            crawl + ['seed', '--lists', '--base-dir', 'xml'],
+            crawl + ['worker', '--threads', '4', '--poll-interval', '1', '--exit-when-idle',
+                     '--metrics-json', 'metrics-1.json'],
+            crawl + ['checkout'],
+        ], ('xml', 'zip', 'xsd')
+    if path == 'download_data':
+        months = list(portal.iter_months())
+        (start_year, start_month), (end_year, end_month) = months[0], months[-1]
+        args = ['--start-year', str(start_year), '--start-month', str(start_month),
+                '--end-year', str(end_year), '--end-month', str(end_month), '--metrics-json', 'metrics-1.json']
+        runner = DOWNLOAD_DATA_RUNNER.format(script_dir=SCRIPT_DIR, base_url=portal.base_url, args=args,
+                                             script=script('download_data.py'))
+        return [[python, '-c', runner]], ('zip',)
+    raise ValueError(f"Неизвестный путь скачивания: {path}")
+
+def get_version():
+    """Версия кода для сравнения результатов: короткий хеш коммита (+dirty при незакоммиченных изменениях)"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=SCRIPT_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return f"{commit}+dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def load_client_retries(run_dir):
+    """Повторы на стороне клиента из --metrics-json всех команд прохода"""
+    retries = 0
+    for name in os.listdir(run_dir):
+        if name.startswith('metrics-') and name.endswith('.json'):
+            with open(os.path.join(run_dir, name), 'r', encoding='utf-8') as f:
+                retries += sum(json.load(f)['metrics'].get('knm_retries_total', {}).values())
+    return retries
+
+def run_path(path, portal, scenario, timeout, keep_dir=False):
+    """Один проход скачивания в чистом каталоге против локального портала
+
+    Returns:
+        dict: Результат замера
+    """
+    run_dir = tempfile.mkdtemp(prefix=f"bench-{path}-")
+    portal.write_lists(run_dir)
+    commands, kinds = get_commands(path, portal)
+    expected = portal.get_expected(kinds)
+    portal.reset_stats()
+    started = time.monotonic()
+    status = 'ok'
+    with open(os.path.join(run_dir, 'output.log'), 'w', encoding='utf-8') as log:
+        for command in commands:
+            deadline = timeout - (time.monotonic() - started)
+            try:
+                result = subprocess.run(command, cwd=run_dir, stdout=log, stderr=subprocess.STDOUT,
+                                        timeout=max(deadline, 1))
+            except subprocess.TimeoutExpired:
+                status = 'timeout'
+                break
+            if result.returncode != 0:
+                status = f"exit {result.returncode}"
+                break
+    wall = time.monotonic() - started
+
+    stats = portal.get_stats()
+    completed = set(stats['completed']) & expected
+    full_downloads = sum(count for file_path, count in stats['completed'].items() if file_path in expected)
+    # Запросы к API и list.xml не относятся к файлам, их не учитываем в накладных расходах
+    requests = sum(stats['by_kind'].get(kind, 0) for kind in kinds)
+    faults = sum(stats['faults_by_kind'].get(kind, 0) for kind in kinds)
+    record = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'version': get_version(),
+        'path': path,
+        'scenario': scenario,
+        'portal': {'months': portal.months, 'archives': portal.archives, 'archive_size': portal.archive_size,
+                   **SCENARIOS[scenario]},
+        'status': status,
+        'wall_seconds': round(wall, 3),
+        'bytes': stats['bytes_sent'],
+        'throughput_bps': round(stats['bytes_sent'] / wall) if wall else None,
+        'time_to_first_archive': round(stats['time_to_first_archive'], 3)
+                                 if stats['time_to_first_archive'] is not None else None,
+        'files_expected': len(expected),
+        'files_completed': len(completed),
+        'completeness': round(len(completed) / len(expected), 3) if expected else None,
+        'requests': requests,
+        'faults': faults,
+        'duplicate_downloads': full_downloads - len(completed),
+        # Лишние запросы сверх одного на файл в пересчете на один сбой (идеал - 1.0)
+        'retry_overhead': round((requests - len(completed)) / faults, 2) if faults else None,
+        'client_retries': load_client_retries(run_dir),
+    }
+    if keep_dir or status != 'ok':
+        record['run_dir'] = run_dir
+    else:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return record
+
+def load_results(results_file):
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_results(records, results_file):
+    with open(results_file, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def find_baseline(history, record):
+    """Последний результат того же пути и сценария с другой версией кода и тем же объемом портала"""
+    for previous in reversed(history):
+        if (previous['path'] == record['path'] and previous['scenario'] == record['scenario']
+                and previous['portal'] == record['portal'] and previous['version'] != record['version']
+                and previous['status'] == 'ok'):
+            return previous
+    return None
+
+def compare(record, baseline, threshold):
+    """Сравнивает замер с базовым
+
+    Returns:
+        list: Описания регрессий (пустой список - регрессий нет)
+    """
+    regressions = []
+    checks = (
+        ('throughput_bps', 'пропускная способность', -1),
+        ('time_to_first_archive', 'время до первого архива', 1),
+        ('requests', 'запросов', 1),
+    )
+    for key, label, direction in checks:
+        old, new = baseline.get(key), record.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        if change * direction > threshold:
+            regressions.append(f"{label}: {old} → {new} ({change:+.1f}%)")
+    if record['completeness'] is not None and record['completeness'] < (baseline['completeness'] or 0):
+        regressions.append(f"полнота: {baseline['completeness']} → {record['completeness']}")
+    return regressions
+
+def print_record(record):
+    ttfa = f"{record['time_to_first_archive']:.2f} с" if record['time_to_first_archive'] is not None else '-'
+    overhead = record['retry_overhead'] if record['retry_overhead'] is not None else '-'
+    mark = '✓' if record['status'] == 'ok' and record['completeness'] == 1 else '✗'
+    print(f"{mark} {record['path']} [{record['scenario']}]: {record['wall_seconds']:.2f} с, "
+          f"{record['throughput_bps'] / 1024:.0f} КБ/с, первый архив {ttfa}, "
+          f"файлов {record['files_completed']}/{record['files_expected']}, запросов {record['requests']}, "
+          f"сбоев {record['faults']}, накладные расходы на сбой {overhead}, "
+          f"повторных скачиваний {record['duplicate_downloads']}")
+    if record['status'] != 'ok':
+        print(f"  Статус: {record['status']}, каталог прохода: {record.get('run_dir')}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры скачивания против локального портала (mock_portal.py)')
+    parser.add_argument('--paths', nargs='+', choices=PATHS, default=list(PATHS), help='Какие пути скачивания замерять')
+    parser.add_argument('--scenario', nargs='+', choices=list(SCENARIOS), default=['clean'], help='Сценарии портала')
+    parser.add_argument('--months', type=int, default=3, help='Месяцев в каждом наборе')
+    parser.add_argument('--archives', type=int, default=2, help='Архивов в месяце')
+    parser.add_argument('--archive-kb', type=int, default=256, help='Примерный размер архива, КБ')
+    parser.add_argument('--seed', type=int, default=0, help='Seed содержимого и сбоев')
+    parser.add_argument('--timeout', type=float, default=600, help='Ограничение времени одного прохода, с')
+    parser.add_argument('--results-file', default=DEFAULT_RESULTS_FILE, help='Файл истории результатов (JSONL)')
+    parser.add_argument('--no-save', action='store_true', help='Не сохранять результаты в историю')
+    parser.add_argument('--threshold', type=float, default=10, help='Порог регрессии, %%')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Код выхода 1 при регрессиях')
+    parser.add_argument('--keep-dirs', action='store_true', help='Не удалять каталоги проходов')
+    args = parser.parse_args()
+
+    history = load_results(args.results_file)
+    records = []
+    regressions = {}
+    for scenario in args.scenario:
+        portal = MockPortal(args.months, args.archives, args.archive_kb * 1024, seed=args.seed, **SCENARIOS[scenario])
+        portal.start()
+        print(f"\nСценарий {scenario}: {portal.base_url}, файлов {len(portal.get_expected())}")
+        try:
+            for path in args.paths:
+                record = run_path(path, portal, scenario, args.timeout, args.keep_dirs)
+                records.append(record)
+                print_record(record)
+                baseline = find_baseline(history, record)
+                if baseline is not None:
+                    found = compare(record, baseline, args.threshold)
+                    if found:
+                        regressions[(path, scenario)] = (baseline['version'], found)
+        finally:
+            portal.stop()
+
+    if not args.no_save:
+        save_results(records, args.results_file)
+        print(f"\nРезультаты добавлены в {args.results_file}")
+
+    if regressions:
+        print(f"\n✗ Регрессии относительно прошлых версий (порог {args.threshold:.0f}%):")
+        for (path, scenario), (version, found) in regressions.items():
+            print(f"- {path} [{scenario}] относительно {version}:")
+            for line in found:
+                print(f"    {line}")
+        if args.fail_on_regression:
+            sys.exit(1)
+    elif history:
+        print("✓ Регрессий относительно прошлых версий нет")
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
 import zipfile
 import os
-import hashlib
+import argparse
 from collections import defaultdict
+from file_hashes import calculate_files_hashes, get_available_algorithms, DEFAULT_ALGORITHM
+from file_hashes import calculate_file_hash as _calculate_file_hash
+import metrics
+import profiling
+from metrics import StageTimer
 
-def calculate_file_hash(filename):
-    """Вычисляет MD5 хеш файла"""
-    hash_md5 = hashlib.md5()
-    with open(filename, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+def calculate_file_hash(filename, algorithm=DEFAULT_ALGORITHM):
+    """Вычисляет хеш файла выбранным алгоритмом"""
+    return _calculate_file_hash(filename, algorithm)
 
 def check_zip_contents(zip_path):
     """Проверяет содержимое zip-файла и возвращает информацию о файлах внутри"""
@@ -27,8 +28,21 @@ def check_zip_contents(zip_path):
     return contents
 
 def main():
+    # Парсим аргументы командной строки
+    parser = argparse.ArgumentParser(description='Проверка и сравнение архивов')
+    parser.add_argument('files', nargs='*', help='Архивы для проверки')
+    parser.add_argument('--algorithm', choices=get_available_algorithms(), default=DEFAULT_ALGORITHM,
+                        help='Алгоритм хеширования')
+    parser.add_argument('--workers', type=int, default=None, help='Количество потоков хеширования')
+    parser.add_argument('--hash-cache', default='hash_cache.json', help='Файл кэша хешей')
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_from_args(args)
+    profiling.start_from_args(args)
+
     # Список файлов для проверки
-    files = [
+    files = args.files or [
         'data/248/data-20210126-structure-20220125.zip',
         'data/248/data-20210226-structure-20220125.zip',
         'data/248/data-20210326-structure-20220125.zip'
@@ -40,6 +54,10 @@ def main():
         print("Файлы не найдены!")
         return
     
+    # Хешируем все файлы параллельно, неизмененные файлы берем из кэша
+    with StageTimer('hash'):
+        file_hashes = calculate_files_hashes(existing_files, args.algorithm, args.hash_cache, args.workers)
+    
     print("Проверка файлов:")
     print("-" * 50)
     
@@ -48,7 +66,7 @@ def main():
     for filename in existing_files:
         print(f"\nПроверка файла: {filename}")
         print(f"Размер файла: {os.path.getsize(filename):,} байт")
-        print(f"MD5 хеш: {calculate_file_hash(filename)}")
+        print(f"{args.algorithm.upper()} хеш: {file_hashes.get(filename, 'ошибка')}")
         
         contents = check_zip_contents(filename)
         if contents:
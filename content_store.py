@@ -0,0 +1,120 @@
+import os
+import shutil
+import argparse
+from file_hashes import calculate_file_hash, DEFAULT_ALGORITHM
+
+class ContentStore:
+    """Хранилище файлов по хешу содержимого (content-addressed)
+
+    Файл лежит в <корень>/objects/<2 символа>/<2 символа>/<хеш>, поэтому одинаковые
+    архивы, скачанные разными узлами или из разных месяцев, хранятся один раз,
+    а запись атомарна: объект появляется только после os.replace. Если задано
+    несколько корней (например, разные диски или сетевые ресурсы), объект
+    попадает в корень, выбранный по хешу.
+
+    Args:
+        roots (list): Корневые директории (общие для всех узлов или шарды)
+        algorithm (str): Алгоритм хеширования из file_hashes
+    """
+
+    def __init__(self, roots, algorithm=DEFAULT_ALGORITHM):
+        self.roots = [roots] if isinstance(roots, str) else list(roots)
+        self.algorithm = algorithm
+
+    def get_root(self, digest):
+        """Корень шарда, в котором хранится объект"""
+        return self.roots[int(digest[:8], 16) % len(self.roots)]
+
+    def get_path(self, digest):
+        """Путь к объекту по его хешу"""
+        return os.path.join(self.get_root(digest), "objects", digest[:2], digest[2:4], digest)
+
+    def get_tmp_dir(self):
+        """Директория для недокачанных файлов (в первом корне, чтобы os.replace не копировал между дисками)"""
+        tmp_dir = os.path.join(self.roots[0], "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        return tmp_dir
+
+    def exists(self, digest):
+        return os.path.exists(self.get_path(digest))
+
+    def put(self, filename):
+        """Переносит файл в хранилище
+
+        Returns:
+            tuple: (хеш, размер, True если такого объекта еще не было)
+        """
+        digest = calculate_file_hash(filename, self.algorithm)
+        size = os.path.getsize(filename)
+        path = self.get_path(digest)
+        if os.path.exists(path):
+            os.remove(filename)
+            return digest, size, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(filename, path)
+        except OSError:
+            # Шард на другом диске: копируем во временный файл рядом с объектом и переименовываем
+            tmp_path = f"{path}.part"
+            shutil.copyfile(filename, tmp_path)
+            os.replace(tmp_path, path)
+            os.remove(filename)
+        return digest, size, True
+
+    def checkout(self, digest, target_path):
+        """Размещает объект по обычному пути (жесткой ссылкой или копией)
+
+        Returns:
+            bool: True, если файл создан или обновлен
+        """
+        path = self.get_path(digest)
+        if os.path.exists(target_path):
+            if os.path.samefile(path, target_path):
+                return False
+            os.remove(target_path)
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+        try:
+            os.link(path, target_path)
+        except OSError:
+            shutil.copy2(path, target_path)
+        return True
+
+    def iter_objects(self):
+        """Перечисляет (хеш, путь) всех объектов"""
+        for root in self.roots:
+            for dirpath, _, filenames in os.walk(os.path.join(root, "objects")):
+                for filename in filenames:
+                    if not filename.endswith('.part'):
+                        yield filename, os.path.join(dirpath, filename)
+
+    def verify(self):
+        """Пересчитывает хеши объектов
+
+        Returns:
+            list: Пути объектов, содержимое которых не совпадает с хешем
+        """
+        return [path for digest, path in self.iter_objects()
+                if calculate_file_hash(path, self.algorithm) != digest]
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка хранилища файлов по хешу содержимого')
+    parser.add_argument('--cas', action='append', required=True, help='Корень хранилища (можно указать несколько шардов)')
+    parser.add_argument('--algorithm', default=DEFAULT_ALGORITHM, help='Алгоритм хеширования')
+    parser.add_argument('--verify', action='store_true', help='Пересчитать хеши всех объектов')
+    args = parser.parse_args()
+
+    store = ContentStore(args.cas, args.algorithm)
+    objects = list(store.iter_objects())
+    total_size = sum(os.path.getsize(path) for _, path in objects)
+    print(f"Объектов: {len(objects)}, общий размер: {total_size} байт")
+    if args.verify:
+        corrupted = store.verify()
+        if corrupted:
+            print(f"✗ Поврежденных объектов: {len(corrupted)}")
+            for path in corrupted:
+                print(f"  - {path}")
+        else:
+            print("✓ Все объекты соответствуют своим хешам")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import os
+import json
+import argparse
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from tqdm import tqdm
+from file_hashes import get_stat_signature
+from xml_records import find_archives, get_archive_partition, extract_snapshot_date, iter_archive_records
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Служебные колонки, которые добавляются к каждой записи
+SERVICE_COLUMNS = ['_archive', '_member', '_offset', '_snapshot']
+
+class PartitionWriter:
+    """Пишет записи одного файла архива в Parquet батчами ограниченного размера"""
+
+    def __init__(self, output_dir, file_prefix, compression='zstd'):
+        self.output_dir = output_dir
+        self.file_prefix = file_prefix
+        self.compression = compression
+        self.writer = None
+        self.schema = None
+        self.part = 0
+        self.rows_written = 0
+        self.files_written = []
+
+    def _open_writer(self, schema):
+        """Открывает новый файл Parquet под указанную схему"""
+        self.close()
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{self.file_prefix}-{self.part:05d}.parquet")
+        self.part += 1
+        self.schema = schema
+        self.writer = pq.ParquetWriter(path, schema, compression=self.compression)
+        self.files_written.append(path)
+
+    def write_batch(self, records):
+        """Записывает батч записей как Arrow RecordBatch"""
+        if not records:
+            return
+        columns = list(SERVICE_COLUMNS)
+        seen = set(columns)
+        for record in records:
+            for key in record:
+                if key not in seen:
+                    seen.add(key)
+                    columns.append(key)
+
+        # Если в батче появились новые колонки, начинаем новый файл с расширенной схемой
+        if self.schema is None or not seen.issubset(self.schema.names):
+            if self.schema is not None:
+                columns = self.schema.names + [c for c in columns if c not in self.schema.names]
+            schema = pa.schema([
+                pa.field(name, pa.int64() if name == '_offset' else pa.string())
+                for name in columns
+            ])
+            self._open_writer(schema)
+
+        arrays = [
+            pa.array([record.get(name) for record in records], type=field.type)
+            for name, field in zip(self.schema.names, self.schema)
+        ]
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.rows_written += len(records)
+
+    def close(self):
+        """Закрывает текущий файл Parquet"""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+def convert_archive(archive_path, output_base_dir, batch_size=10000, record_tag=None):
+    """Потоково конвертирует один архив в Parquet, разбитый по 248/no248, типу и месяцу
+
+    Returns:
+        dict: Статистика конвертации (записей, файлов)
+    """
+    return convert_records(archive_path, iter_archive_records(archive_path, record_tag), output_base_dir, batch_size)
+
+def convert_records(archive_path, records, output_base_dir, batch_size=10000):
+    """Конвертирует в Parquet записи архива, уже разобранные вызывающим (см. iter_archive_records)
+
+    Returns:
+        dict: Статистика конвертации (записей, файлов) или None, если раздел архива не определен
+    """
+    partition = get_archive_partition(archive_path)
+    if partition is None:
+        print(f"\nНе удалось определить раздел для архива: {archive_path}")
+        return None
+
+    output_dir = os.path.join(output_base_dir, *partition)
+    archive_name = os.path.basename(archive_path)
+    snapshot = extract_snapshot_date(archive_path)
+    stats = {'records': 0, 'files': []}
+
+    # Записи идут подряд по файлам архива; на каждый файл - свой набор Parquet файлов
+    for member_index, (member_name, member_records) in enumerate(groupby(records, key=itemgetter(0))):
+        file_prefix = f"{os.path.splitext(archive_name)[0]}-{member_index:04d}"
+        writer = PartitionWriter(output_dir, file_prefix)
+        batch = []
+        try:
+            for _, offset, record in member_records:
+                record['_archive'] = archive_name
+                record['_member'] = member_name
+                record['_offset'] = offset
+                record['_snapshot'] = snapshot
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    writer.write_batch(batch)
+                    batch = []
+            writer.write_batch(batch)
+        finally:
+            writer.close()
+        stats['records'] += writer.rows_written
+        stats['files'].extend(writer.files_written)
+
+    return stats
+
+def load_conversion_status(status_file):
+    """Загружает статус ранее сконвертированных архивов"""
+    if os.path.exists(status_file):
+        try:
+            with open(status_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            print("Ошибка при чтении статуса конвертации, создаем новый")
+    return {}
+
+def convert_archives(data_dir="data", output_dir="parquet", batch_size=10000, record_tag=None, force_update=False):
+    """Конвертирует все архивы из data_dir в Parquet, пропуская неизмененные"""
+    if pa is None:
+        print("Для конвертации в Parquet требуется пакет pyarrow")
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    status_file = os.path.join(output_dir, "conversion_status.json")
+    conversion_status = load_conversion_status(status_file)
+
+    archives = find_archives(data_dir)
+    print(f"\nНайдено архивов: {len(archives)}")
+
+    converted = 0
+    skipped = 0
+    total_records = 0
+    for archive_path in tqdm(archives, desc="Конвертация архивов", unit="архив"):
+        signature = get_stat_signature(archive_path)
+        cached = conversion_status.get(archive_path)
+        if not force_update and cached and cached.get('signature') == signature:
+            skipped += 1
+            continue
+
+        try:
+            stats = convert_archive(archive_path, output_dir, batch_size, record_tag)
+        except Exception as e:
+            print(f"\nОшибка при конвертации {archive_path}: {str(e)}")
+            continue
+        if stats is None:
+            continue
+
+        converted += 1
+        total_records += stats['records']
+        conversion_status[archive_path] = {
+            'signature': signature,
+            'records': stats['records'],
+            'files': stats['files'],
+            'converted_at': datetime.now().isoformat()
+        }
+        # Сохраняем статус после каждого архива, чтобы не потерять прогресс
+        with open(status_file, 'w', encoding='utf-8') as f:
+            json.dump(conversion_status, f, indent=2, ensure_ascii=False)
+
+    print(f"\nКонвертация завершена:")
+    print(f"- Сконвертировано архивов: {converted}")
+    print(f"- Пропущено (без изменений): {skipped}")
+    print(f"- Всего записей: {total_records}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Конвертация архивов проверок в Parquet')
+    parser.add_argument('--data-dir', default='data', help='Директория с архивами')
+    parser.add_argument('--output-dir', default='parquet', help='Директория для файлов Parquet')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Количество записей в батче')
+    parser.add_argument('--record-tag', default=None, help='Имя тега записи (по умолчанию - элементы первого уровня)')
+    parser.add_argument('--force', action='store_true', help='Конвертировать заново все архивы')
+    args = parser.parse_args()
+
+    convert_archives(args.data_dir, args.output_dir, args.batch_size, args.record_tag, args.force)
+
+if __name__ == "__main__":
+    main()
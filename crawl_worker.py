@@ -0,0 +1,387 @@
+import os
+import time
+import signal
+import socket
+import hashlib
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from urllib.parse import urljoin
+from download_xml_data import (create_session, download_file, extract_links_from_xml,
+                               extract_date_from_filename, normalize_filename)
+from download_data import get_archive_filename, iter_months
+from process_xml_files import check_file_integrity, get_current_year_month
+from archive_discovery import discover_archives
+from manifest_storage import open_manifest, get_checkpoint_path
+from url_resolver import canonicalize_url
+from scheduler import KIND_PRIORITY, DATASETS
+from lease_queue import LeaseQueue, DEFAULT_QUEUE_DB
+from content_store import ContentStore
+from retry_queue import RetryQueue
+from negative_cache import NegativeCache
+from state_store import StateStore, DEFAULT_STATE_DB
+import metrics
+import profiling
+from metrics import QUEUE_DEPTH, StageTimer
+
+def get_priority(kind, date):
+    """Приоритет задачи: XML и месяцы раньше архивов, свежие месяцы раньше старых"""
+    return KIND_PRIORITY[kind] * 1_000_000 - (date.toordinal() if date > datetime.min else 0)
+
+def get_file_key(url):
+    return f"file {url}"
+
+def seed_lists(queue, base_dir="xml"):
+    """Ставит в очередь месячные XML из list.xml обоих наборов"""
+    added = 0
+    for dataset in DATASETS:
+        list_xml_path = os.path.join(base_dir, dataset, "list.xml")
+        if not os.path.exists(list_xml_path):
+            continue
+        for item in ET.parse(list_xml_path).getroot().findall(".//item"):
+            link = item.get('link')
+            if not link or not link.endswith('.xml'):
+                continue
+            xml_basename = normalize_filename(os.path.basename(link))
+            added += queue.enqueue(f"manifest {dataset} {link}", 'manifest', {
+                'url': link,
+                'dataset': dataset,
+                'target': os.path.join(base_dir, dataset, "data", xml_basename),
+                'base_dir': base_dir,
+            }, get_priority('xml', extract_date_from_filename(xml_basename)))
+    return added
+
+def seed_months(queue, start, end, flags):
+    """Ставит в очередь месяцы, архивы которых нужно найти через API и скачать"""
+    added = 0
+    for year, month in iter_months(*start, *end):
+        for is_248 in flags:
+            added += queue.enqueue(f"month {year}/{month:02d}/{'248' if is_248 else 'no248'}", 'month', {
+                'year': year,
+                'month': month,
+                'is_248': is_248,
+            }, get_priority('xml', datetime(year, month, 1)))
+    return added
+
+class CrawlWorker:
+    """Узел распределенного скачивания
+
+    Берет задачи из общей LeaseQueue, продлевает аренду, пока работает, и
+    кладет скачанные файлы в общее ContentStore. Месячный XML и месяц из API
+    сами ничего не размещают на диске узла: они ставят в очередь свои ZIP/XSD
+    и записывают в результат, куда их положить, а команда checkout потом
+    раскладывает объекты по привычным путям.
+
+    Args:
+        queue (LeaseQueue): Общая очередь
+        content_store (ContentStore): Общее хранилище объектов
+        owner (str): Имя узла
+        store (StateStore): Локальное хранилище состояния (негативный кэш, кэш API)
+    """
+
+    def __init__(self, queue, content_store, owner, store=None):
+        self.queue = queue
+        self.content_store = content_store
+        self.owner = owner
+        self.store = store
+        self.negative_cache = NegativeCache(store) if store is not None else None
+        self.backoff = RetryQueue(base_delay=30, max_delay=600)
+        self.stop_event = threading.Event()
+        self.local = threading.local()
+        self.stats = {'done': 0, 'failed': 0, 'retried': 0, 'lost': 0, 'released': 0}
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def get_session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = create_session()
+        return self.local.session
+
+    def get_tmp_filename(self, url, token=None):
+        """Временный файл URL в общем хранилище
+
+        С токеном аренды - файл, в который пишет только эта аренда; без токена -
+        .part, оставленный узлом при остановке и ожидающий следующую аренду.
+        """
+        basename = os.path.basename(url.split('?')[0]) or "file"
+        prefix = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        name = f"{prefix}-{token}-{basename}" if token else f"{prefix}-{basename}"
+        return os.path.join(self.content_store.get_tmp_dir(), name)
+
+    def adopt_checkpoint(self, url, tmp_filename):
+        """Забирает .part, оставленный при остановке, во временный файл текущей аренды
+
+        Первым переименовывается файл валидаторов: его получит только один узел,
+        и только он перенесет .part.
+        """
+        shared = self.get_tmp_filename(url)
+        try:
+            os.rename(get_checkpoint_path(shared), get_checkpoint_path(tmp_filename))
+        except OSError:
+            return
+        try:
+            os.rename(f"{shared}.part", f"{tmp_filename}.part")
+        except OSError:
+            pass
+
+    def publish_checkpoint(self, lease):
+        """Оставляет .part аренды, возвращенной при остановке, для докачки следующей арендой"""
+        url = lease['payload'].get('url')
+        if url is None:
+            return
+        tmp_filename = self.get_tmp_filename(url, lease['token'])
+        if not (os.path.exists(f"{tmp_filename}.part") and os.path.exists(get_checkpoint_path(tmp_filename))):
+            self.discard_tmp(lease)
+            return
+        shared = self.get_tmp_filename(url)
+        os.replace(f"{tmp_filename}.part", f"{shared}.part")
+        os.replace(get_checkpoint_path(tmp_filename), get_checkpoint_path(shared))
+
+    def discard_tmp(self, lease):
+        """Удаляет временные файлы аренды, которую забрал другой узел или которая закончилась ошибкой"""
+        url = lease['payload'].get('url')
+        if url is None:
+            return
+        tmp_filename = self.get_tmp_filename(url, lease['token'])
+        for path in (tmp_filename, f"{tmp_filename}.part", get_checkpoint_path(tmp_filename)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def fetch(self, url, token, abort_event):
+        """Скачивает URL во временный файл общего хранилища и переносит в хранилище
+
+        Временный файл принадлежит аренде (в имени токен), так что узел, у которого
+        аренда истекла, не пишет в один файл с узлом, забравшим задачу. Докачивается
+        только .part, который узел явно вернул при остановке (publish_checkpoint).
+
+        Returns:
+            dict: {'digest', 'size'}, "skip" при временной ошибке или False, если файла нет
+        """
+        tmp_filename = self.get_tmp_filename(url, token)
+        self.adopt_checkpoint(url, tmp_filename)
+        result = download_file(url, tmp_filename, self.get_session(), negative_cache=self.negative_cache,
+                               stop_event=abort_event)
+        if result is not True:
+            return result
+        if not check_file_integrity(tmp_filename):
+            os.remove(tmp_filename)
+            return "skip"
+        digest, size, _ = self.content_store.put(tmp_filename)
+        return {'digest': digest, 'size': size}
+
+    def expand_manifest(self, payload, manifest_path):
+        """Ставит в очередь ZIP/XSD месячного XML и возвращает, куда их разместить"""
+        with StageTimer('parse'), open_manifest(manifest_path) as xml_stream:
+            xml_root = ET.parse(xml_stream).getroot()
+        zip_links, xsd_links = extract_links_from_xml(xml_root)
+        date = extract_date_from_filename(os.path.basename(payload['target']))
+        xml_dir = os.path.join(payload['base_dir'], payload['dataset'])
+        files = []
+        for link in sorted(zip_links | xsd_links):
+            url = canonicalize_url(urljoin(payload['url'], link.strip()))
+            filename = os.path.basename(url)
+            kind = 'xsd' if filename.lower().endswith('.xsd') else 'zip'
+            file_date = extract_date_from_filename(filename)
+            self.queue.enqueue(get_file_key(url), 'file', {'url': url},
+                               get_priority(kind, file_date if file_date > datetime.min else date))
+            files.append({'url': url, 'target': os.path.join(xml_dir, "xsd" if kind == 'xsd' else "data", filename)})
+        return files
+
+    def process(self, lease, abort_event):
+        """Выполняет задачу
+
+        Returns:
+            tuple: (результат или None, ошибка, True если ошибка постоянная)
+        """
+        payload = lease['payload']
+        if lease['kind'] == 'month':
+            archives = discover_archives(payload['year'], payload['month'], payload['is_248'], self.store,
+                                         self.get_session())
+            if archives is None:
+                return None, "API недоступен", False
+            files = []
+            for archive in archives:
+                self.queue.enqueue(get_file_key(archive['url']), 'file', {'url': archive['url']},
+                                   get_priority('zip', datetime(payload['year'], payload['month'], 1)))
+                files.append({'url': archive['url'], 'target': get_archive_filename(
+                    payload['year'], payload['month'], payload['is_248'], archive['name'])})
+            return {'files': files}, None, False
+
+        result = self.fetch(payload['url'], lease['token'], abort_event)
+        if result == "skip":
+            return None, "сетевая ошибка или поврежденный файл", False
+        if not result:
+            return None, "файла нет на сервере", True
+        if lease['kind'] == 'manifest':
+            try:
+                result['files'] = self.expand_manifest(payload, self.content_store.get_path(result['digest']))
+            except ET.ParseError as e:
+                return None, f"ошибка парсинга XML: {str(e)}", True
+        return result, None, False
+
+    def run_lease(self, lease):
+        """Выполняет одну задачу, продлевая аренду в отдельном потоке"""
+        done = threading.Event()
+        lost = threading.Event()
+        abort_event = threading.Event()
+
+        def heartbeat():
+            interval = self.queue.lease_seconds / 3
+            next_beat = time.monotonic() + interval
+            while not done.wait(min(1, interval)):
+                if self.stop_event.is_set():
+                    abort_event.set()
+                if time.monotonic() < next_beat:
+                    continue
+                next_beat += interval
+                if not self.queue.heartbeat(lease):
+                    print(f"✗ Аренда потеряна, задача прервана: {lease['key']}")
+                    lost.set()
+                    abort_event.set()
+                    return
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            result, error, permanent = self.process(lease, abort_event)
+        except Exception as e:
+            result, error, permanent = None, f"неожиданная ошибка: {str(e)}", False
+        finally:
+            done.set()
+            thread.join()
+
+        if lost.is_set():
+            # Задачу уже выполняет другой узел, недокачанная часть этой аренды ему не нужна
+            self.discard_tmp(lease)
+            self.count('lost')
+        elif result is None and (abort_event.is_set() or self.stop_event.is_set()):
+            # Узел останавливается: задача возвращается в очередь без траты попытки
+            self.publish_checkpoint(lease)
+            self.queue.release(lease)
+            self.count('released')
+        elif result is not None:
+            self.queue.complete(lease, result)
+            self.count('done')
+            print(f"✓ {lease['key']}")
+        else:
+            self.discard_tmp(lease)
+            self.queue.fail(lease, error, self.backoff.get_delay(lease['attempts']), permanent)
+            self.count('failed' if permanent or lease['attempts'] >= self.queue.max_attempts else 'retried')
+            print(f"✗ {lease['key']}: {error}")
+
+    def loop(self, poll_interval, exit_when_idle):
+        while not self.stop_event.is_set():
+            lease = self.queue.claim(self.owner)
+            if lease is None:
+                stats = self.queue.get_stats()['by_status']
+                if exit_when_idle and not stats.get('pending') and not stats.get('leased'):
+                    return
+                self.stop_event.wait(poll_interval)
+                continue
+            self.run_lease(lease)
+
+    def run(self, threads=1, poll_interval=10, exit_when_idle=False):
+        workers = [threading.Thread(target=self.loop, args=(poll_interval, exit_when_idle), daemon=True)
+                   for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(timeout=1)
+
+    def stop(self, signum=None, frame=None):
+        """Обработчик SIGTERM/SIGINT: текущие скачивания сохраняются в .part, аренды возвращаются"""
+        if not self.stop_event.is_set():
+            print("\nПолучен сигнал остановки, возвращаем задачи в очередь...")
+        self.stop_event.set()
+
+def checkout(queue, content_store):
+    """Раскладывает скачанные объекты по обычным путям (xml/<набор>/..., data/...)"""
+    digests = {payload['url']: result['digest'] for _, _, payload, result in queue.iter_done('file')}
+    placed = missing = 0
+    for _, kind, payload, result in queue.iter_done():
+        if kind == 'file':
+            continue
+        if kind == 'manifest':
+            placed += content_store.checkout(result['digest'], payload['target'])
+        for file in result.get('files', []):
+            if file['url'] in digests:
+                placed += content_store.checkout(digests[file['url']], file['target'])
+            else:
+                missing += 1
+    print(f"Размещено файлов: {placed}")
+    print(f"Еще не скачано: {missing}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Распределенное скачивание: общая очередь с арендой задач')
+    parser.add_argument('--queue-db', default=DEFAULT_QUEUE_DB, help='Файл общей очереди')
+    parser.add_argument('--cas', action='append', help='Корень общего хранилища объектов (можно несколько шардов)')
+    parser.add_argument('--lease-seconds', type=float, default=300, help='Срок аренды задачи, с')
+    parser.add_argument('--max-attempts', type=int, default=5, help='Попыток на задачу')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = subparsers.add_parser('seed', help='Поставить работу в очередь')
+    seed_parser.add_argument('--base-dir', default='xml', help='Каталог с 248/list.xml и no248/list.xml')
+    seed_parser.add_argument('--lists', action='store_true', help='Месячные XML из list.xml')
+    seed_parser.add_argument('--months', action='store_true', help='Месяцы из API открытых данных')
+    seed_parser.add_argument('--dataset', choices=['248', 'no248', 'both'], default='both', help='Наборы для --months')
+    seed_parser.add_argument('--start-year', type=int, default=2021, help='Год начала для --months')
+    seed_parser.add_argument('--start-month', type=int, default=1, help='Месяц начала для --months')
+    seed_parser.add_argument('--end-year', type=int, help='Год окончания (по умолчанию текущий)')
+    seed_parser.add_argument('--end-month', type=int, help='Месяц окончания (по умолчанию текущий)')
+
+    worker_parser = subparsers.add_parser('worker', help='Запустить узел')
+    worker_parser.add_argument('--worker-id', default=f"{socket.gethostname()}-{os.getpid()}", help='Имя узла')
+    worker_parser.add_argument('--threads', type=int, default=2, help='Параллельных задач на узле')
+    worker_parser.add_argument('--poll-interval', type=float, default=10, help='Пауза, когда свободных задач нет, с')
+    worker_parser.add_argument('--exit-when-idle', action='store_true', help='Завершиться, когда вся работа сделана')
+    worker_parser.add_argument('--state-db', default=DEFAULT_STATE_DB, help='Локальное хранилище состояния')
+    metrics.add_arguments(worker_parser)
+    profiling.add_arguments(worker_parser)
+
+    subparsers.add_parser('checkout', help='Разложить скачанные объекты по обычным путям')
+    args = parser.parse_args()
+
+    if args.command != 'seed' and not args.cas:
+        parser.error("для worker и checkout нужен --cas")
+
+    with LeaseQueue(args.queue_db, args.lease_seconds, args.max_attempts) as queue:
+        if args.command == 'seed':
+            added = 0
+            if args.lists:
+                added += seed_lists(queue, args.base_dir)
+            if args.months:
+                current_year, current_month = get_current_year_month()
+                end_year = args.end_year or current_year
+                end_month = args.end_month or (current_month if end_year == current_year else 12)
+                flags = {'248': [True], 'no248': [False], 'both': [True, False]}[args.dataset]
+                added += seed_months(queue, (args.start_year, args.start_month), (end_year, end_month), flags)
+            print(f"Добавлено задач: {added}")
+            return
+
+        content_store = ContentStore(args.cas)
+        if args.command == 'checkout':
+            checkout(queue, content_store)
+            return
+
+        metrics.start_from_args(args)
+        profiling.start_from_args(args)
+        QUEUE_DEPTH.set_function(lambda: queue.get_stats()['by_status'].get('pending', 0), queue='lease')
+        with StateStore(args.state_db) as store:
+            worker = CrawlWorker(queue, content_store, args.worker_id, store)
+            signal.signal(signal.SIGTERM, worker.stop)
+            signal.signal(signal.SIGINT, worker.stop)
+            print(f"Узел {args.worker_id}: потоков {args.threads}, аренда {args.lease_seconds:.0f} с")
+            worker.run(args.threads, args.poll_interval, args.exit_when_idle)
+            print(f"\nИтоги узла {args.worker_id}:")
+            for name, value in worker.stats.items():
+                print(f"- {name}: {value}")
+
+if __name__ == "__main__":
+    main()
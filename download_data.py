@@ -1,19 +1,27 @@
 import requests
 import os
+import shutil
 from datetime import datetime
 import time
 import re
-import json
 import zipfile
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from tqdm import tqdm
+from process_xml_files import get_current_year_month
+from archive_discovery import discover_archives
+from state_store import StateStore, DEFAULT_STATE_DB
+from validate_xml import IntegrityCache
+import metrics
+from metrics import DownloadTracker, CountingRetry, RETRIES, timed
+import profiling
 
 def create_session():
     """Создает сессию с настройками повторных попыток"""
     session = requests.Session()
-    retry_strategy = Retry(
+    retry_strategy = CountingRetry(
         total=3,  # количество повторных попыток
         backoff_factor=1,  # время ожидания между попытками
         status_forcelist=[500, 502, 503, 504]  # коды ошибок для повторных попыток
@@ -23,6 +31,7 @@ def create_session():
     session.mount("https://", adapter)
     return session
 
+@timed('verify')
 def check_zip_integrity(filename):
     """Проверяет целостность zip-архива"""
     try:
@@ -39,72 +48,146 @@ def check_zip_integrity(filename):
         print(f"Ошибка при проверке архива: {str(e)}")
         return False
 
-def get_data_url(year, month, is_federal_law_248=False):
-    # Формируем URL API
-    api_url = f"https://proverki.gov.ru/api/portal/public-open-data/check/{year}/{month}"
-    
-    headers = {
-        'Accept': 'application/json, text/plain, */*',
-        'Accept-Encoding': 'gzip, deflate, br, zstd',
-        'Accept-Language': 'ru,ru-RU;q=0.9,en-US;q=0.8,en;q=0.7',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36',
-        'sec-ch-ua': '"Chromium";v="136", "Google Chrome";v="136", "Not.A/Brand";v="99"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"Windows"',
-        'Referer': f'https://proverki.gov.ru/portal/public-open-data/check/{year}/{month}?isFederalLaw248={"true" if is_federal_law_248 else "false"}',
-        'Origin': 'https://proverki.gov.ru'
-    }
+def get_data_url(year, month, is_federal_law_248=False, store=None, session=None):
+    """Возвращает реальные архивы за месяц по данным API (с кэшем в хранилище состояния)
 
-    try:
-        response = requests.get(api_url, headers=headers)
-        response.raise_for_status()
-        
-        # Выводим ответ API для анализа
-        print(f"\nОтвет API для {year}/{month} (248-ФЗ: {is_federal_law_248}):")
-        print(response.text[:1000])  # Выводим первые 1000 символов для анализа
-        
-        # Пробуем распарсить JSON
-        try:
-            data = response.json()
-            print(f"Данные API: {json.dumps(data, indent=2, ensure_ascii=False)[:1000]}")
-            return data
-        except json.JSONDecodeError:
-            print("Не удалось распарсить JSON")
-            return None
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка при получении данных API для {year}/{month}: {str(e)}")
-        return None
-
-def download_file(year, month, is_federal_law_248=False):
+    Returns:
+        list: [{'url', 'name', 'size'}] или None, если API недоступен
+    """
+    return discover_archives(year, month, is_federal_law_248, store, session)
+
+def get_archive_filename(year, month, is_federal_law_248=False, name=None):
+    """Путь, по которому сохраняется архив за месяц"""
     # Определяем папку для сохранения
     folder = 'data/248' if is_federal_law_248 else 'data'
-    
-    # Формируем имя файла для сохранения
-    if is_federal_law_248:
-        # Для 248-ФЗ сохраняем информацию о годе и месяце в имени файла
-        filename = f"{folder}/data-{year}{month:02d}26-structure-20220125.zip"
-    else:
-        filename = f"{folder}/data-{year}{month:02d}26-structure-20220125.zip"
-    
+    if name:
+        return f"{folder}/{name}"
+    return f"{folder}/data-{year}{month:02d}26-structure-20220125.zip"
+
+def get_archive_url(year, month):
+    """URL архива за месяц, если API не вернул список файлов"""
+    return f"https://proverki.gov.ru/blob/opendata/{year}/{month}/data-20250522-structure-20210222.zip"
+
+class SharedDownloads:
+    """Каждый URL скачивается один раз за запуск
+
+    Наборы 248 и no248 могут ссылаться на один и тот же архив (в том числе
+    резервный URL из get_archive_url одинаков для обоих). Первый поток, которому
+    нужен URL, скачивает его; остальные ждут и получают жесткую ссылку на
+    скачанный файл (или копию, если ссылки не поддерживаются).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}  # URL -> {'done': Event, 'filename': путь скачанного файла или None}
+
+    def fetch(self, url, filename, download):
+        """Сохраняет url в filename, вызывая download() только для первого обращения к URL"""
+        with self.lock:
+            entry = self.entries.get(url)
+            owner = entry is None
+            if owner:
+                entry = self.entries[url] = {'done': threading.Event(), 'filename': None}
+        if owner:
+            ok = False
+            try:
+                ok = download()
+            finally:
+                entry['filename'] = filename if ok else None
+                entry['done'].set()
+            return ok
+
+        entry['done'].wait()
+        source = entry['filename']
+        if source is None:
+            return False
+        if os.path.abspath(source) == os.path.abspath(filename):
+            return True
+        if os.path.exists(filename) and os.path.getsize(filename) == os.path.getsize(source):
+            return True
+        link_or_copy(source, filename)
+        print(f"Архив уже скачан для другого набора, связан: {filename}")
+        return True
+
+def link_or_copy(source, filename):
+    """Создает жесткую ссылку filename на source, а если это невозможно - копию"""
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    tmp_filename = f"{filename}.part"
+    if os.path.exists(tmp_filename):
+        os.remove(tmp_filename)
+    try:
+        os.link(source, tmp_filename)
+    except OSError:
+        shutil.copy2(source, tmp_filename)
+    os.replace(tmp_filename, filename)
+
+def download_file(year, month, is_federal_law_248=False, session=None, max_attempts=3, store=None, integrity=None,
+                  shared=None, stop_event=None):
+    """Скачивает и проверяет все архивы за месяц
+
+    Имена и размеры архивов берутся из API портала (ответ кэшируется); если
+    API недоступен или не вернул архивов, используется прежний предполагаемый URL.
+    Вердикты проверки архивов сохраняются в integrity (IntegrityCache).
+    URL, уже скачанные в этом запуске для другого набора, через shared
+    (SharedDownloads) не скачиваются повторно. stop_event прерывает скачивание.
+    """
+    # Создаем сессию с настройками повторных попыток, если ее не передали
+    if session is None:
+        session = create_session()
+
+    archives = get_data_url(year, month, is_federal_law_248, store, session)
+    if not archives:
+        if archives is not None:
+            print(f"API не вернул архивов за {year}/{month:02d}, пробуем резервный URL")
+        archives = [{'url': get_archive_url(year, month), 'name': None, 'size': 0}]
+
+    results = []
+    for archive in archives:
+        if stop_event is not None and stop_event.is_set():
+            return False
+        filename = get_archive_filename(year, month, is_federal_law_248, archive['name'])
+
+        def download(archive=archive, filename=filename):
+            return download_archive(archive['url'], filename, year, month, is_federal_law_248, session,
+                                    max_attempts, archive['size'], integrity, stop_event)
+        if shared is not None:
+            results.append(shared.fetch(archive['url'], filename, download))
+        else:
+            results.append(download())
+    return all(results)
+
+@timed('download')
+def download_archive(data_url, filename, year, month, is_federal_law_248, session, max_attempts=3, expected_size=0,
+                     integrity=None, stop_event=None):
+    """Скачивает и проверяет один архив, делая не больше max_attempts попыток
+
+    Если установлен stop_event, скачивание прерывается и недокачанный файл удаляется.
+    """
+    folder = os.path.dirname(filename)
+
     # Проверяем существование файла
     if os.path.exists(filename):
         print(f"Файл существует: {filename}")
+        if expected_size and os.path.getsize(filename) != expected_size:
+            print("Размер файла не совпадает с данными API! Удаляем и скачиваем заново")
+            os.remove(filename)
+        elif integrity is not None and integrity.is_verified(filename):
+            print("Файл цел (по кэшу проверки целостности)")
+            return True
         # Проверяем целостность существующего файла
-        if check_zip_integrity(filename):
+        elif check_zip_integrity(filename):
             print("Файл цел (проверка zip-архива)")
+            if integrity is not None:
+                integrity.record(filename, True)
             return True
         else:
             print("Файл поврежден! Удаляем и скачиваем заново")
             os.remove(filename)
-            return download_file(year, month, is_federal_law_248)  # Рекурсивно скачиваем заново
 
     # Если файл не существует, скачиваем его
-    # Используем текущий месяц в URL
-    data_url = f"https://proverki.gov.ru/blob/opendata/{year}/{month}/data-20250522-structure-20210222.zip"
-    
     # Формируем referer с учетом типа данных
     referer = f"https://proverki.gov.ru/portal/public-open-data/check/{year}/{month}?isFederalLaw248={'true' if is_federal_law_248 else 'false'}"
-    
+
     # Заголовки запроса
     headers = {
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
@@ -123,115 +206,190 @@ def download_file(year, month, is_federal_law_248=False):
     }
 
     # Создаем директорию для сохранения файлов, если она не существует
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+    os.makedirs(folder, exist_ok=True)
 
-    # Создаем сессию с настройками повторных попыток
-    session = create_session()
+    tmp_filename = f"{filename}.part"
+    for attempt in range(1, max_attempts + 1):
+        tracker = None
+        try:
+            # Скачиваем файл
+            print(f"Начинаем скачивание файла: {filename} (попытка {attempt} из {max_attempts})")
+            print(f"URL для скачивания: {data_url}")
+            print(f"Referer: {referer}")
 
-    try:
-        # Скачиваем файл
-        print(f"Начинаем скачивание файла: {filename}")
-        print(f"URL для скачивания: {data_url}")
-        print(f"Referer: {referer}")
-        
-        response = session.get(data_url, headers=headers, stream=True)
-        response.raise_for_status()
-        
-        # Получаем размер файла
-        total_size = int(response.headers.get('content-length', 0))
-        
-        # Создаем прогресс-бар
-        progress_bar = tqdm(
-            total=total_size,
-            unit='iB',
-            unit_scale=True,
-            desc=f"Скачивание {os.path.basename(filename)}"
-        )
-
-        # Сохраняем файл с отображением прогресса
-        with open(filename, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    size = f.write(chunk)
-                    progress_bar.update(size)
-        
-        progress_bar.close()
-        
-        # Проверяем целостность скачанного файла
-        if check_zip_integrity(filename):
-            print("Файл успешно скачан и проверен (zip-архив цел)")
-            return True
-        else:
+            tracker = DownloadTracker(data_url)
+            response = session.get(data_url, headers=headers, stream=True)
+            tracker.response(response)
+            response.raise_for_status()
+
+            # Получаем размер файла
+            total_size = int(response.headers.get('content-length', 0)) or expected_size
+
+            # Создаем прогресс-бар
+            progress_bar = tqdm(
+                total=total_size,
+                unit='iB',
+                unit_scale=True,
+                desc=f"Скачивание {os.path.basename(filename)}",
+                leave=False
+            )
+
+            # Сохраняем файл с отображением прогресса во временный файл,
+            # чтобы прерванное скачивание не оставляло битый архив под основным именем
+            with open(tmp_filename, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    if stop_event is not None and stop_event.is_set():
+                        break
+                    if chunk:
+                        size = f.write(chunk)
+                        progress_bar.update(size)
+
+            progress_bar.close()
+            if stop_event is not None and stop_event.is_set():
+                response.close()
+                return False
+            tracker.finish(progress_bar.n)
+
+            # Проверяем целостность скачанного файла
+            if check_zip_integrity(tmp_filename):
+                os.replace(tmp_filename, filename)
+                if integrity is not None:
+                    integrity.record(filename, True)
+                print("Файл успешно скачан и проверен (zip-архив цел)")
+                return True
             print("Скачанный файл поврежден! Удаляем и пробуем снова")
-            os.remove(filename)
-            return download_file(year, month, is_federal_law_248)  # Рекурсивно скачиваем заново
 
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка при скачивании файла для {year}/{month}: {str(e)}")
-        return False
+        except requests.exceptions.RequestException as e:
+            print(f"Ошибка при скачивании файла для {year}/{month}: {str(e)}")
+        finally:
+            # Код ответа не учитываем: он уже учтен в response() или в CountingRetry.increment
+            if tracker is not None:
+                tracker.fail()
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+        if attempt < max_attempts:
+            RETRIES.inc(source='attempt')
+            # Пауза перед следующей попыткой (прерывается остановкой)
+            if stop_event is not None:
+                if stop_event.wait(5 * attempt):
+                    return False
+            else:
+                time.sleep(5 * attempt)
+
+    print(f"Попытки исчерпаны для {year}/{month:02d}")
+    return False
+
+def iter_months(start_year, start_month, end_year, end_month):
+    """Перечисляет (год, месяц) от начального до конечного включительно"""
+    year, month = start_year, start_month
+    while (year, month) <= (end_year, end_month):
+        yield year, month
+        month += 1
+        if month > 12:
+            month = 1
+            year += 1
 
 def main():
     # Парсим аргументы командной строки
     parser = argparse.ArgumentParser(description='Скачивание данных с proverki.gov.ru')
-    parser.add_argument('--federal-law-248', action='store_true', help='Скачивать данные по 248-ФЗ')
+    parser.add_argument('--federal-law-248', action='store_true', help='Скачивать только данные по 248-ФЗ')
+    parser.add_argument('--dataset', choices=['248', 'no248', 'both'], default=None,
+                        help='Какие данные скачивать (по умолчанию both, с --federal-law-248 - только 248)')
     parser.add_argument('--start-year', type=int, help='Год начала скачивания')
     parser.add_argument('--start-month', type=int, help='Месяц начала скачивания')
+    parser.add_argument('--end-year', type=int, help='Год окончания (по умолчанию текущий)')
+    parser.add_argument('--end-month', type=int, help='Месяц окончания (по умолчанию текущий)')
+    parser.add_argument('--workers', type=int, default=4, help='Количество параллельных скачиваний')
+    parser.add_argument('--max-attempts', type=int, default=3, help='Попыток на один архив')
+    parser.add_argument('--state-db', default=DEFAULT_STATE_DB, help='Файл хранилища состояния (кэш ответов API)')
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    metrics.start_from_args(args)
+    profiling.start_from_args(args)
+
+    dataset = args.dataset or ('248' if args.federal_law_248 else 'both')
+    flags = {'248': [True], 'no248': [False], 'both': [True, False]}[dataset]
 
-    # Задаем начальную и конечную даты
+    # Задаем начальную и конечную даты; конец по умолчанию - текущий месяц
+    current_year, current_month = get_current_year_month()
     start_year = args.start_year if args.start_year is not None else 2021
     start_month = args.start_month if args.start_month is not None else 1
-    end_year = 2025
-    end_month = 5
+    end_year = args.end_year if args.end_year is not None else current_year
+    end_month = args.end_month if args.end_month is not None else (current_month if end_year == current_year else 12)
 
-    # Скачиваем файлы за указанный период
-    current_year = start_year
-    current_month = start_month
+    tasks = [(year, month, is_248) for year, month in iter_months(start_year, start_month, end_year, end_month)
+             for is_248 in flags]
     successful_downloads = 0
-    failed_downloads = 0
-    total_files = (end_year - start_year) * 12 + (end_month - start_month + 1)
-    current_file = 0
+    failed = []
 
-    print(f"\nВсего файлов для скачивания: {total_files}")
+    print(f"\nВсего файлов для скачивания: {len(tasks)}")
     print(f"Период: {start_year}/{start_month:02d} - {end_year}/{end_month:02d}")
-    print(f"Режим: {'248-ФЗ' if args.federal_law_248 else 'Обычный'}")
+    print(f"Режим: {'248-ФЗ и обычный' if len(flags) > 1 else ('248-ФЗ' if flags[0] else 'Обычный')}")
+    print(f"Параллельных скачиваний: {args.workers}")
     print("-" * 50)
 
+    # У каждого потока своя сессия, чтобы соединения переиспользовались между месяцами
+    local = threading.local()
+
+    def run(year, month, is_248):
+        if not hasattr(local, 'session'):
+            local.session = create_session()
+        return download_file(year, month, is_248, local.session, args.max_attempts, store, integrity, shared,
+                             stop_event)
+
+    store = StateStore(args.state_db)
+    integrity = IntegrityCache()
+    shared = SharedDownloads()
+    stop_event = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    future_to_task = {executor.submit(run, *task): task for task in tasks}
+    pending = set(future_to_task.values())
     try:
-        while (current_year < end_year) or (current_year == end_year and current_month <= end_month):
-            current_file += 1
-            print(f"\nФайл {current_file} из {total_files}")
-            print(f"Скачивание файла за {current_year}/{current_month:02d}")
-            
-            if download_file(current_year, current_month, args.federal_law_248):
-                successful_downloads += 1
-                print(f"✓ Успешно скачан файл за {current_year}/{current_month:02d}")
-            else:
-                failed_downloads += 1
-                print(f"✗ Не удалось скачать файл за {current_year}/{current_month:02d}")
-            
-            # Переходим к следующему месяцу
-            current_month += 1
-            if current_month > 12:
-                current_month = 1
-                current_year += 1
-                
-            time.sleep(5)  # Пауза между запросами
-                
+        with tqdm(total=len(tasks), desc="Месяцы") as pbar:
+            for future in as_completed(future_to_task):
+                year, month, is_248 = task = future_to_task[future]
+                pending.discard(task)
+                label = f"{year}/{month:02d}{' (248-ФЗ)' if is_248 else ''}"
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    print(f"Ошибка при скачивании за {label}: {str(e)}")
+                    ok = False
+                if ok:
+                    successful_downloads += 1
+                    pbar.write(f"✓ Успешно скачан файл за {label}")
+                else:
+                    failed.append(task)
+                    pbar.write(f"✗ Не удалось скачать файл за {label}")
+                pbar.update(1)
+        executor.shutdown()
+        store.close()
+        integrity.save()
+
     except KeyboardInterrupt:
+        # Останавливаем и текущие скачивания: иначе выход ждет завершения потоков пула
+        stop_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        integrity.save()
         print("\n\nСкачивание прервано пользователем")
-        print(f"Последний обработанный файл: {current_year}/{current_month:02d}")
-        print(f"Для продолжения используйте команду:")
-        print(f"python download_data.py {'--federal-law-248 ' if args.federal_law_248 else ''}--start-year {current_year} --start-month {current_month}")
+        if pending:
+            year, month, _ = min(pending)
+            print(f"Первый необработанный месяц: {year}/{month:02d}")
+            print(f"Для продолжения используйте команду:")
+            print(f"python download_data.py --dataset {dataset} --start-year {year} --start-month {month} "
+                  f"--end-year {end_year} --end-month {end_month}")
         return
 
     print("\n" + "=" * 50)
     print("Скачивание завершено!")
     print(f"Успешно скачано: {successful_downloads} файлов")
-    print(f"Не удалось скачать: {failed_downloads} файлов")
-    print(f"Всего обработано: {current_file} файлов")
+    print(f"Не удалось скачать: {len(failed)} файлов")
+    for year, month, is_248 in sorted(failed):
+        print(f"  - {year}/{month:02d}{' (248-ФЗ)' if is_248 else ''}")
+    print(f"Всего обработано: {successful_downloads + len(failed)} файлов")
     print("=" * 50)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -6,18 +6,29 @@ import xml.etree.ElementTree as ET
 from pathlib import Path
 from tqdm import tqdm
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import zipfile
 import json
 import random
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
 import signal
+import argparse
+from manifest_storage import (get_manifest_path, get_accept_encoding, save_response,
+                              open_manifest, strip_compression_suffix, load_checkpoint,
+                              discard_partial, DownloadInterrupted)
+from retry_queue import RetryQueue
+from state_store import StateStore, DEFAULT_STATE_DB
+from negative_cache import NegativeCache, get_error_status
+from url_resolver import UrlResolver
+from events import events, LEVELS, add_arguments as add_event_arguments, configure_from_args
+import metrics
+from metrics import DownloadTracker, CountingRetry, StageTimer, record_cache, timed
+import profiling
 
 def create_session():
     """Создает сессию с настройками повторных попыток"""
     session = requests.Session()
-    retry_strategy = Retry(
+    retry_strategy = CountingRetry(
         total=5,  # увеличиваем количество попыток
         backoff_factor=2,  # увеличиваем время ожидания между попытками
         status_forcelist=[500, 502, 503, 504, 429],  # добавляем 429 (Too Many Requests)
@@ -29,27 +40,24 @@ def create_session():
     session.mount("https://", adapter)
     return session
 
+@timed('verify')
 def check_zip_integrity(filename, verbose=True, timeout=30):
     """Проверяет целостность zip-архива"""
     if not filename.endswith('.zip'):
         return True  # Для не-ZIP файлов считаем, что они целы
-        
+    
+    basename = os.path.basename(filename)
+    # Без verbose ошибки только считаются и пишутся в журнал, в терминал не выводятся
+    error_level = 'error' if verbose else 'debug'
     try:
         # Добавляем таймаут для открытия файла
         with zipfile.ZipFile(filename, 'r') as zip_ref:
-            # Проверяем целостность архива
-            if verbose:
-                print(f"\nПроверка архива: {os.path.basename(filename)}")
-                print(f"Размер файла: {os.path.getsize(filename)} байт")
-                
-                # Получаем список файлов в архиве
-                file_list = zip_ref.namelist()
-                print(f"Файлов в архиве: {len(file_list)}")
-                if file_list:
-                    print("Содержимое архива:")
-                    for file in file_list:
-                        info = zip_ref.getinfo(file)
-                        print(f"- {file} ({info.file_size} байт)")
+            # Содержимое архива собираем, только если событие кто-то увидит
+            if verbose and events.enabled('debug'):
+                members = zip_ref.infolist()
+                events.emit('verify', 'archive', 'debug', "Проверка архива: {file} ({size} байт, файлов: {count})",
+                            file=basename, size=os.path.getsize(filename), count=len(members),
+                            members=[{'name': info.filename, 'size': info.file_size} for info in members])
             
             # Проверяем целостность с таймаутом
             def timeout_handler(signum, frame):
@@ -65,28 +73,26 @@ def check_zip_integrity(filename, verbose=True, timeout=30):
                 signal.alarm(0)
                 
                 if test_result is None:
-                    if verbose:
-                        print("✓ Архив цел")
+                    events.emit('verify', 'ok', 'debug', "✓ Архив цел: {file}", file=basename)
                     return True
                 else:
-                    if verbose:
-                        print(f"✗ Архив поврежден. Первый поврежденный файл: {test_result}")
+                    events.emit('verify', 'corrupted', error_level, "Архив {file} поврежден. Первый поврежденный файл: {member}",
+                                file=basename, member=test_result)
                     return False
             except TimeoutError as e:
-                if verbose:
-                    print(f"✗ {str(e)}")
+                events.emit('verify', 'timeout', error_level, "{error}", file=basename, error=str(e))
                 return False
             finally:
                 # Гарантируем отключение таймаута
                 signal.alarm(0)
                 
     except zipfile.BadZipFile as e:
-        if verbose:
-            print(f"✗ Ошибка при открытии архива: {str(e)}")
+        events.emit('verify', 'bad_zip', error_level, "Ошибка при открытии архива {file}: {error}",
+                    file=basename, error=str(e))
         return False
     except Exception as e:
-        if verbose:
-            print(f"✗ Неожиданная ошибка при проверке архива: {str(e)}")
+        events.emit('verify', 'error', error_level, "Неожиданная ошибка при проверке архива {file}: {error}",
+                    file=basename, error=str(e))
         return False
 
 def check_files_integrity(files_to_check, integrity_cache_file):
@@ -118,12 +124,15 @@ def check_files_integrity(files_to_check, integrity_cache_file):
             
             if file in integrity_cache:
                 cached_info = integrity_cache[file]
-                if (cached_info['size'] == file_info['size'] and 
-                    cached_info['mtime'] == file_info['mtime']):
+                if ('is_valid' in cached_info and
+                    cached_info.get('size') == file_info['size'] and 
+                    cached_info.get('mtime') == file_info['mtime']):
                     results[file] = cached_info['is_valid']
                     skipped_files += 1
+                    record_cache('integrity', True)
                     continue
             
+            record_cache('integrity', False)
             files_to_check_now.append(file)
         except Exception as e:
             print(f"\nОшибка при анализе файла {file}: {str(e)}")
@@ -165,13 +174,13 @@ def check_files_integrity(files_to_check, integrity_cache_file):
                         result = future.result(timeout=60)  # 60 секунд на получение результата
                         results[file] = result
                         
-                        # Сохраняем информацию о файле и результате проверки
+                        # Сохраняем информацию о файле и результате проверки (не затирая проверку по XSD)
                         file_stat = os.stat(file)
-                        integrity_cache[file] = {
+                        integrity_cache.setdefault(file, {}).update({
                             'size': file_stat.st_size,
                             'mtime': file_stat.st_mtime,
                             'is_valid': result
-                        }
+                        })
                     except TimeoutError:
                         print(f"\nТаймаут при проверке файла {file}")
                         results[file] = False
@@ -198,8 +207,19 @@ def check_files_integrity(files_to_check, integrity_cache_file):
     
     return results
 
-def download_file(url, filename, session):
-    """Скачивает файл с отображением прогресса"""
+@timed('download')
+def download_file(url, filename, session, compression=None, negative_cache=None, stop_event=None):
+    """Скачивает файл с отображением прогресса
+
+    Args:
+        compression (str): Хранить файл сжатым (gzip или zstd); None - без сжатия
+        negative_cache (NegativeCache): Куда записывать 404/410 и повторяющиеся 5xx
+        stop_event (threading.Event): При установке скачивание останавливается,
+            а недокачанная часть сохраняется для докачки
+
+    Returns:
+        True при успехе, "skip" при временной ошибке, False если файла нет на сервере
+    """
     headers = {
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
         'Accept-Encoding': 'gzip, deflate, br, zstd',
@@ -216,6 +236,7 @@ def download_file(url, filename, session):
         'Connection': 'keep-alive'
     }
 
+    tracker = progress_bar = None
     try:
         # Убираем дублирование расширения в имени файла
         basename = os.path.basename(filename)
@@ -225,51 +246,97 @@ def download_file(url, filename, session):
         # Убираем дублирующиеся расширения .xml
         while basename.endswith('.xml.xml'):
             basename = basename[:-4]
-        filename = os.path.join(os.path.dirname(filename), basename)
+        filename = get_manifest_path(os.path.join(os.path.dirname(filename), basename), compression)
+        if compression:
+            # Просим сервер сжать тело так же, как мы храним файл, чтобы не распаковывать его при записи
+            headers['Accept-Encoding'] = get_accept_encoding(compression)
+        
+        # Докачиваем файл, остановленный при прошлом завершении работы
+        resume_from, validator = (0, None) if compression else load_checkpoint(filename)
+        if resume_from:
+            headers['Range'] = f'bytes={resume_from}-'
+            headers['If-Range'] = validator
+            headers['Accept-Encoding'] = 'identity'
+            events.emit('download', 'resume', 'debug', "Докачка {file} с {offset} байт", file=basename, offset=resume_from)
         
         # Скачиваем файл
-        print(f"\nСкачивание файла: {basename}")
-        print(f"URL: {url}")
+        events.emit('download', 'start', 'debug', "Скачивание файла: {file} ({url})", file=basename, url=url)
         
+        tracker = DownloadTracker(url)
         response = session.get(url, headers=headers, stream=True, timeout=30)
+        tracker.response(response)
+        if response.status_code == 416 and resume_from:
+            # Сервер не может отдать сохраненный диапазон (например, .part длиннее файла на сервере):
+            # без сброса каждый следующий запуск повторял бы тот же Range и снова получал 416
+            events.emit('download', 'range_rejected', 'debug', "Докачка {file} невозможна (416), скачиваем заново",
+                        file=basename)
+            response.close()
+            discard_partial(filename)
+            del headers['Range'], headers['If-Range']
+            resume_from = 0
+            response = session.get(url, headers=headers, stream=True, timeout=30)
+            tracker.response(response)
         response.raise_for_status()
         
         # Получаем размер файла
         total_size = int(response.headers.get('content-length', 0))
+        initial = resume_from if response.status_code == 206 else 0
         
-        # Создаем прогресс-бар
+        # Прогресс-бар файла показываем, только если отладочные события выводятся в терминал;
+        # иначе остается один общий прогресс-бар вызывающего кода
         progress_bar = tqdm(
-            total=total_size,
+            total=total_size + initial,
+            initial=initial,
             unit='iB',
             unit_scale=True,
             desc=f"Скачивание {basename}",
-            leave=False
+            leave=False,
+            disable=events.tty_level > LEVELS['debug']
         )
 
         # Создаем директорию для сохранения, если она не существует
         os.makedirs(os.path.dirname(filename), exist_ok=True)
 
         # Сохраняем файл с отображением прогресса
-        with open(filename, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    size = f.write(chunk)
-                    progress_bar.update(size)
+        received = save_response(response, filename, compression, progress_bar, stop_event=stop_event)
         
         progress_bar.close()
-        print(f"✓ Файл успешно скачан: {basename}")
+        tracker.finish(received)
+        events.emit('download', 'ok', 'debug', "✓ Файл успешно скачан: {file}", file=basename)
+        if negative_cache is not None:
+            negative_cache.record_success(url)
         return True
 
+    except DownloadInterrupted:
+        events.emit('download', 'interrupted', 'debug', "Скачивание остановлено: {file}", file=basename)
+        return "skip"
+
     except requests.exceptions.RequestException as e:
-        print(f"✗ Ошибка при скачивании: {str(e)}")
+        events.emit('download', 'error', 'error', "Ошибка при скачивании {file}: {error}", file=basename, error=str(e))
+        
+        # 404/410 и повторяющиеся 5xx не повторяем, пока не истечет срок в негативном кэше
+        if negative_cache is not None and negative_cache.record_failure(url, get_error_status(e)):
+            events.emit('download', 'negative_cached', 'debug', "URL добавлен в негативный кэш, повторных попыток не будет: {url}",
+                        url=url)
+            return False
         
         # Проверяем, является ли ошибка 502
         if "502" in str(e):
-            print("Получена ошибка 502 (Bad Gateway). Пропускаем файл для повторной попытки позже.")
+            events.emit('download', 'bad_gateway', 'debug',
+                        "Получена ошибка 502 (Bad Gateway). Пропускаем файл {file} для повторной попытки позже.", file=basename)
             return "skip"  # Возвращаем специальный статус для пропуска
         
         return "skip"
 
+    finally:
+        if progress_bar is not None:
+            progress_bar.close()
+        # Закрываем замер при любой ошибке, в том числе при записи на диск. Код ответа не учитываем:
+        # ответ с ошибкой учтен в response(), а ответ, на котором urllib3 исчерпал повторы, -
+        # в CountingRetry.increment. После finish() вызов fail() ничего не делает
+        if tracker is not None:
+            tracker.fail()
+
 def extract_date_from_filename(filename):
     """Извлекает дату из имени файла"""
     # Ищем паттерн YYYYMMDD в имени файла
@@ -322,16 +389,7 @@ def sort_files_by_date(files):
     # Сортируем по дате
     return sorted(unique_files, key=lambda x: extract_date_from_filename(os.path.basename(x)), reverse=True)
 
-def extract_year_month_from_url(url):
-    """Извлекает год и месяц из URL"""
-    # Проверяем оба формата URL: /erknm-plan/YYYY/MM/ и /erknm-opendata/YYYY/MM/
-    match = re.search(r'/erknm-(?:plan|opendata)/(\d{4})/(\d{1,2})/', url)
-    if match:
-        year = match.group(1)
-        month = match.group(2).zfill(2)  # Добавляем ведущий ноль для месяцев < 10
-        return year, month
-    return None, None
-
+@timed('extract_links')
 def extract_links_from_xml(xml_root):
     """Извлекает все ссылки на ZIP и XSD файлы из XML"""
     zip_links = set()
@@ -367,8 +425,16 @@ def normalize_filename(filename):
         return filename[:-4]
     return filename
 
-def process_list_xml(list_xml_path, session, pbar=None):
-    """Обрабатывает list.xml файл и скачивает связанные файлы"""
+def process_list_xml(list_xml_path, session, pbar=None, compression=None, retry_queue=None, negative_cache=None):
+    """Обрабатывает list.xml файл и скачивает связанные файлы
+
+    Файлы, пропущенные из-за сетевых ошибок, повторяются через retry_queue
+    в конце каждого этапа, пока сессия еще открыта. URL из negative_cache
+    не запрашиваются, пока не истечет срок их записи.
+    """
+    if retry_queue is None:
+        retry_queue = RetryQueue()
+
     print(f"\n{'='*80}")
     print(f"Обработка файла: {list_xml_path}")
     print(f"{'='*80}")
@@ -424,65 +490,71 @@ def process_list_xml(list_xml_path, session, pbar=None):
         # Скачиваем все XML файлы
         print("\nСкачивание XML файлов...")
         downloaded_xml_files = []
+        manifest_urls = {}  # Локальный путь к XML -> адрес, с которого он скачан
         with tqdm(total=len(xml_links), desc="XML файлы") as pbar:
             for xml_url in xml_links:
                 xml_filename = os.path.join(data_dir, normalize_filename(os.path.basename(xml_url)))
                 xml_basename = os.path.basename(xml_filename)
                 
+                if negative_cache is not None and negative_cache.is_blocked(xml_url):
+                    pbar.update(1)
+                    continue
+                
                 # Скачиваем XML файл
                 pbar.set_description(f"XML файлы (скачивание: {xml_basename})")
-                result = download_file(xml_url, xml_filename, session)
+                result = download_file(xml_url, xml_filename, session, compression, negative_cache)
                 if result == "skip":
-                    print(f"Пропущен XML файл из-за ошибки 502: {xml_basename}")
+                    print(f"Пропущен XML файл, будет повторен в конце этапа: {xml_basename}")
+                    retry_queue.add(xml_url, (xml_url, xml_filename))
                 elif not result:
                     print(f"Ошибка при скачивании XML файла: {xml_basename}")
                 else:
-                    downloaded_xml_files.append(xml_filename)
+                    retry_queue.resolve(xml_url)
+                    downloaded_xml_files.append(get_manifest_path(xml_filename, compression))
+                    manifest_urls[downloaded_xml_files[-1]] = xml_url
                 
                 pbar.update(1)
                 time.sleep(0.5)
         
+        def retry_xml(payload):
+            xml_url, xml_filename = payload
+            result = download_file(xml_url, xml_filename, session, compression, negative_cache)
+            if result is True:
+                downloaded_xml_files.append(get_manifest_path(xml_filename, compression))
+                manifest_urls[downloaded_xml_files[-1]] = xml_url
+            return result
+        
+        retry_queue.drain(retry_xml)
+        
         if not downloaded_xml_files:
             print("\nНе удалось скачать ни одного XML файла")
             return
         
-        # Собираем все ссылки на ZIP и XSD файлы из всех XML
-        all_zip_links = set()
-        all_xsd_links = set()
-        latest_zip_urls = {}  # Словарь для хранения самых свежих URL для каждого файла
-        latest_xsd_urls = {}  # Словарь для хранения самых свежих URL для каждого файла
+        # Собираем все ссылки на ZIP и XSD файлы из всех XML; каждая ссылка
+        # разрешается относительно адреса своего XML, а не первого в списке
+        resolver = UrlResolver()
         
         print("\nАнализ XML файлов для поиска актуальных ссылок...")
         for xml_file in downloaded_xml_files:
             try:
-                xml_tree = ET.parse(xml_file)
-                xml_root = xml_tree.getroot()
+                with StageTimer('parse'), open_manifest(xml_file) as xml_stream:
+                    xml_root = ET.parse(xml_stream).getroot()
                 zip_links, xsd_links = extract_links_from_xml(xml_root)
-                
-                # Получаем базовый путь для URL
-                xml_dir_path = os.path.dirname(xml_file)
-                xml_url_base = os.path.dirname(xml_links[0]) if xml_links else ""
-                
-                # Обрабатываем ZIP ссылки
-                for zip_link in zip_links:
-                    zip_basename = os.path.basename(zip_link)
-                    if zip_basename not in latest_zip_urls:
-                        latest_zip_urls[zip_basename] = os.path.join(xml_url_base, zip_basename)
-                    all_zip_links.add(zip_basename)
-                
-                # Обрабатываем XSD ссылки
-                for xsd_link in xsd_links:
-                    xsd_basename = os.path.basename(xsd_link)
-                    if xsd_basename not in latest_xsd_urls:
-                        latest_xsd_urls[xsd_basename] = os.path.join(xml_url_base, xsd_basename)
-                    all_xsd_links.add(xsd_basename)
+                resolver.add_manifest(xml_file, manifest_urls[xml_file], zip_links | xsd_links)
                 
             except ET.ParseError as e:
                 print(f"\n✗ Ошибка при парсинге XML файла {os.path.basename(xml_file)}: {str(e)}")
                 continue
         
+        # Имя файла на диске -> URL, с которого его нужно скачать
+        latest_zip_urls = {name: link.url for name, link in resolver.get_links('.zip').items()}
+        latest_xsd_urls = {name: link.url for name, link in resolver.get_links('.xsd').items()}
+        all_zip_links = set(latest_zip_urls)
+        all_xsd_links = set(latest_xsd_urls)
+        
         print(f"\nНайдено {len(all_zip_links)} уникальных ZIP файлов")
         print(f"Найдено {len(all_xsd_links)} уникальных XSD файлов")
+        print(f"Повторных ссылок на те же файлы: {resolver.duplicates}")
         
         # Проверяем существующие файлы
         existing_zip_files = [os.path.join(data_dir, basename) for basename in all_zip_links if os.path.exists(os.path.join(data_dir, basename))]
@@ -517,14 +589,20 @@ def process_list_xml(list_xml_path, session, pbar=None):
                         print(f"\nФайл поврежден, будет перескачан: {zip_basename}")
                         os.remove(zip_filename)
                 
+                if negative_cache is not None and negative_cache.is_blocked(zip_url):
+                    pbar.update(1)
+                    continue
+                
                 # Скачиваем ZIP файл
                 pbar.set_description(f"ZIP файлы (скачивание: {zip_basename})")
-                result = download_file(zip_url, zip_filename, session)
+                result = download_file(zip_url, zip_filename, session, negative_cache=negative_cache)
                 if result == "skip":
-                    print(f"Пропущен ZIP файл из-за ошибки 502: {zip_basename}")
+                    print(f"Пропущен ZIP файл, будет повторен в конце этапа: {zip_basename}")
+                    retry_queue.add(zip_url, (zip_url, zip_filename))
                 elif not result:
                     print(f"Ошибка при скачивании ZIP файла: {zip_basename}")
                 else:
+                    retry_queue.resolve(zip_url)
                     # Проверяем целостность только что скачанного файла
                     if not check_zip_integrity(zip_filename, verbose=True):
                         print(f"✗ Скачанный файл поврежден: {zip_basename}")
@@ -533,6 +611,17 @@ def process_list_xml(list_xml_path, session, pbar=None):
                 pbar.update(1)
                 time.sleep(0.5)
         
+        def retry_zip(payload):
+            zip_url, zip_filename = payload
+            result = download_file(zip_url, zip_filename, session, negative_cache=negative_cache)
+            if result is True and not check_zip_integrity(zip_filename, verbose=True):
+                print(f"✗ Скачанный файл поврежден: {os.path.basename(zip_filename)}")
+                os.remove(zip_filename)
+                return "skip"
+            return result
+        
+        retry_queue.drain(retry_zip)
+        
         # Скачиваем XSD файлы
         print("\nОбработка XSD файлов...")
         with tqdm(total=len(all_xsd_links), desc="XSD файлы") as pbar:
@@ -550,20 +639,30 @@ def process_list_xml(list_xml_path, session, pbar=None):
                         print(f"\nФайл поврежден, будет перескачан: {xsd_basename}")
                         os.remove(xsd_filename)
                 
+                if negative_cache is not None and negative_cache.is_blocked(xsd_url):
+                    pbar.update(1)
+                    continue
+                
                 # Скачиваем XSD файл
                 pbar.set_description(f"XSD файлы (скачивание: {xsd_basename})")
-                result = download_file(xsd_url, xsd_filename, session)
+                result = download_file(xsd_url, xsd_filename, session, negative_cache=negative_cache)
                 if result == "skip":
-                    print(f"Пропущен XSD файл из-за ошибки 502: {xsd_basename}")
+                    print(f"Пропущен XSD файл, будет повторен в конце этапа: {xsd_basename}")
+                    retry_queue.add(xsd_url, (xsd_url, xsd_filename))
                 elif not result:
                     print(f"Ошибка при скачивании XSD файла: {xsd_basename}")
+                else:
+                    retry_queue.resolve(xsd_url)
                 
                 pbar.update(1)
                 time.sleep(0.5)
         
+        retry_queue.drain(lambda payload: download_file(payload[0], payload[1], session,
+                                                        negative_cache=negative_cache))
+        
         # Обновляем статус обработки
         for xml_file in downloaded_xml_files:
-            xml_basename = os.path.basename(xml_file)
+            xml_basename = strip_compression_suffix(os.path.basename(xml_file))
             if xml_basename not in processing_status:
                 processing_status[xml_basename] = {
                     'status': 'in_progress',
@@ -649,9 +748,29 @@ def process_list_xml(list_xml_path, session, pbar=None):
         traceback.print_exc()
 
 def main():
+    parser = argparse.ArgumentParser(description='Скачивание XML, ZIP и XSD файлов по list.xml')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'], default=None,
+                        help='Хранить месячные XML файлы сжатыми')
+    parser.add_argument('--max-attempts', type=int, default=4, help='Попыток на файл при сетевых ошибках')
+    parser.add_argument('--state-db', default=DEFAULT_STATE_DB, help='Файл хранилища состояния')
+    parser.add_argument('--negative-ttl-hours', type=float, default=7 * 24,
+                        help='Сколько не запрашивать URL, ответившие 404/410, ч')
+    parser.add_argument('--server-error-ttl-hours', type=float, default=1,
+                        help='Сколько не запрашивать URL, несколько раз подряд ответившие 5xx, ч')
+    add_event_arguments(parser)
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    metrics.start_from_args(args)
+    profiling.start_from_args(args)
+
     try:
         # Создаем сессию
         session = create_session()
+        store = StateStore(args.state_db)
+        retry_queue = RetryQueue(args.max_attempts, store=store)
+        negative_cache = NegativeCache(store, args.negative_ttl_hours * 3600, args.server_error_ttl_hours * 3600)
         
         # Подсчитываем общее количество файлов для скачивания
         total_files = 0
@@ -686,7 +805,7 @@ def main():
             if os.path.exists(list_xml_248):
                 print(f"\nНайден файл: {list_xml_248}")
                 try:
-                    process_list_xml(list_xml_248, session, pbar)
+                    process_list_xml(list_xml_248, session, pbar, args.compress, retry_queue, negative_cache)
                 except Exception as e:
                     print(f"\n✗ Ошибка при обработке {list_xml_248}: {str(e)}")
                     import traceback
@@ -696,11 +815,16 @@ def main():
             if os.path.exists(list_xml_no248):
                 print(f"\nНайден файл: {list_xml_no248}")
                 try:
-                    process_list_xml(list_xml_no248, session, pbar)
+                    process_list_xml(list_xml_no248, session, pbar, args.compress, retry_queue, negative_cache)
                 except Exception as e:
                     print(f"\n✗ Ошибка при обработке {list_xml_no248}: {str(e)}")
                     import traceback
                     traceback.print_exc()
+        
+        retry_queue.print_summary()
+        events.print_summary()
+        negative_cache.print_summary()
+        store.close()
     
     except Exception as e:
         print(f"\n✗ Неожиданная ошибка в main(): {str(e)}")
@@ -6,14 +6,20 @@ import xml.etree.ElementTree as ET
 from pathlib import Path
 from tqdm import tqdm
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import json
 import re
+import argparse
+from manifest_storage import get_manifest_path, get_accept_encoding, save_response
+from retry_queue import RetryQueue
+from state_store import StateStore, DEFAULT_STATE_DB
+import metrics
+from metrics import DownloadTracker, CountingRetry, timed
+import profiling
 
 def create_session():
     """Создает сессию с настройками повторных попыток"""
     session = requests.Session()
-    retry_strategy = Retry(
+    retry_strategy = CountingRetry(
         total=5,
         backoff_factor=2,
         status_forcelist=[500, 502, 503, 504, 429],
@@ -60,8 +66,13 @@ def sort_files_by_date(files):
     """Сортирует файлы по дате в имени в порядке убывания"""
     return sorted(files, key=lambda x: extract_date_from_filename(os.path.basename(x)), reverse=True)
 
-def download_file(url, filename, session, verbose=True):
-    """Скачивает файл с отображением прогресса"""
+@timed('download')
+def download_file(url, filename, session, verbose=True, compression=None):
+    """Скачивает файл с отображением прогресса
+
+    Args:
+        compression (str): Хранить файл сжатым (gzip или zstd); None - без сжатия
+    """
     headers = {
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
         'Accept-Encoding': 'gzip, deflate, br, zstd',
@@ -78,18 +89,24 @@ def download_file(url, filename, session, verbose=True):
         'Connection': 'keep-alive'
     }
 
+    tracker = None
     try:
         # Убираем дублирование расширения в имени файла
         basename = os.path.basename(filename)
         basename = normalize_filename(basename)
-        filename = os.path.join(os.path.dirname(filename), basename)
+        filename = get_manifest_path(os.path.join(os.path.dirname(filename), basename), compression)
+        if compression:
+            # Просим сервер сжать тело так же, как мы храним файл, чтобы не распаковывать его при записи
+            headers['Accept-Encoding'] = get_accept_encoding(compression)
         
         # Скачиваем файл
         if verbose:
             print(f"\nСкачивание файла: {basename}")
             print(f"URL: {url}")
         
+        tracker = DownloadTracker(url)
         response = session.get(url, headers=headers, stream=True, timeout=30)
+        tracker.response(response)
         response.raise_for_status()
         
         # Получаем размер файла
@@ -108,13 +125,10 @@ def download_file(url, filename, session, verbose=True):
         os.makedirs(os.path.dirname(filename), exist_ok=True)
 
         # Сохраняем файл с отображением прогресса
-        with open(filename, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    size = f.write(chunk)
-                    progress_bar.update(size)
+        save_response(response, filename, compression, progress_bar)
         
         progress_bar.close()
+        tracker.finish(progress_bar.n)
         if verbose:
             print(f"✓ Файл успешно скачан: {basename}")
         return True
@@ -128,8 +142,20 @@ def download_file(url, filename, session, verbose=True):
                 print("Получена ошибка 502 (Bad Gateway). Пропускаем файл для повторной попытки позже.")
         return "skip"
 
-def process_list_xml(list_xml_path, session):
-    """Обрабатывает list.xml файл и скачивает XML файлы"""
+    finally:
+        # Код ответа не учитываем: он уже учтен в response() или в CountingRetry.increment
+        if tracker is not None:
+            tracker.fail()
+
+def process_list_xml(list_xml_path, session, compression=None, retry_queue=None):
+    """Обрабатывает list.xml файл и скачивает XML файлы
+
+    Файлы, пропущенные из-за сетевых ошибок, повторяются через retry_queue
+    в конце обработки, пока сессия еще открыта.
+    """
+    if retry_queue is None:
+        retry_queue = RetryQueue()
+
     print(f"\n{'='*80}")
     print(f"Обработка файла: {list_xml_path}")
     print(f"{'='*80}")
@@ -180,6 +206,18 @@ def process_list_xml(list_xml_path, session):
         # Скачиваем XML файлы
         print("\nСкачивание XML файлов...")
         downloaded_xml_files = []
+        
+        def mark_downloaded(xml_url, xml_filename):
+            xml_basename = os.path.basename(xml_filename)
+            downloaded_xml_files.append(xml_filename)
+            # Обновляем статус обработки
+            if xml_basename not in processing_status:
+                processing_status[xml_basename] = {
+                    'status': 'completed',
+                    'downloaded_at': datetime.now().isoformat(),
+                    'url': xml_url
+                }
+        
         with tqdm(total=len(xml_links), desc="XML файлы") as pbar:
             for xml_url in xml_links:
                 xml_filename = os.path.join(data_dir, normalize_filename(os.path.basename(xml_url)))
@@ -187,24 +225,28 @@ def process_list_xml(list_xml_path, session):
                 
                 # Скачиваем XML файл
                 pbar.set_description(f"XML файлы (скачивание: {xml_basename})")
-                result = download_file(xml_url, xml_filename, session)
+                result = download_file(xml_url, xml_filename, session, compression=compression)
                 if result == "skip":
-                    print(f"Пропущен XML файл из-за ошибки 502: {xml_basename}")
+                    print(f"Пропущен XML файл, будет повторен в конце обработки: {xml_basename}")
+                    retry_queue.add(xml_url, (xml_url, xml_filename))
                 elif not result:
                     print(f"Ошибка при скачивании XML файла: {xml_basename}")
                 else:
-                    downloaded_xml_files.append(xml_filename)
-                    # Обновляем статус обработки
-                    if xml_basename not in processing_status:
-                        processing_status[xml_basename] = {
-                            'status': 'completed',
-                            'downloaded_at': datetime.now().isoformat(),
-                            'url': xml_url
-                        }
+                    retry_queue.resolve(xml_url)
+                    mark_downloaded(xml_url, xml_filename)
                 
                 pbar.update(1)
                 time.sleep(0.5)
         
+        def retry_xml(payload):
+            xml_url, xml_filename = payload
+            result = download_file(xml_url, xml_filename, session, compression=compression)
+            if result is True:
+                mark_downloaded(xml_url, xml_filename)
+            return result
+        
+        retry_queue.drain(retry_xml)
+        
         # Сохраняем статус обработки
         with open(status_file, 'w', encoding='utf-8') as f:
             json.dump(processing_status, f, indent=2, ensure_ascii=False)
@@ -225,16 +267,29 @@ def process_list_xml(list_xml_path, session):
         traceback.print_exc()
 
 def main():
+    parser = argparse.ArgumentParser(description='Скачивание месячных XML файлов из list.xml')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'], default=None,
+                        help='Хранить XML файлы сжатыми')
+    parser.add_argument('--max-attempts', type=int, default=4, help='Попыток на файл при сетевых ошибках')
+    parser.add_argument('--state-db', default=DEFAULT_STATE_DB, help='Файл хранилища состояния')
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_from_args(args)
+    profiling.start_from_args(args)
+
     try:
         # Создаем сессию
         session = create_session()
+        store = StateStore(args.state_db)
+        retry_queue = RetryQueue(args.max_attempts, store=store)
         
         # Обрабатываем list.xml в директории 248
         list_xml_248 = "xml/248/list.xml"
         if os.path.exists(list_xml_248):
             print(f"\nНайден файл: {list_xml_248}")
             try:
-                process_list_xml(list_xml_248, session)
+                process_list_xml(list_xml_248, session, args.compress, retry_queue)
             except Exception as e:
                 print(f"\n✗ Ошибка при обработке {list_xml_248}: {str(e)}")
                 import traceback
@@ -245,11 +300,14 @@ def main():
         if os.path.exists(list_xml_no248):
             print(f"\nНайден файл: {list_xml_no248}")
             try:
-                process_list_xml(list_xml_no248, session)
+                process_list_xml(list_xml_no248, session, args.compress, retry_queue)
             except Exception as e:
                 print(f"\n✗ Ошибка при обработке {list_xml_no248}: {str(e)}")
                 import traceback
                 traceback.print_exc()
+        
+        retry_queue.print_summary()
+        store.close()
     
     except Exception as e:
         print(f"\n✗ Неожиданная ошибка в main(): {str(e)}")
@@ -0,0 +1,116 @@
+import json
+import time
+import threading
+from collections import defaultdict
+from tqdm import tqdm
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+class EventLog:
+    """Структурированный журнал событий вместо построчного вывода по каждому файлу
+
+    Каждое событие - стадия (download, verify, process...), имя события, уровень
+    и поля. В файл журнала события пишутся строками JSON (JSONL), в терминал -
+    одной строкой и только начиная с tty_level, через tqdm.write, чтобы не
+    ломать прогресс-бары. Для каждой стадии ведутся счетчики событий, которые
+    выводятся в постфиксе прогресс-бара и в итоговой сводке.
+
+    Текст сообщения - шаблон str.format, который заполняется полями события
+    только если событие действительно куда-то выводится, поэтому отфильтрованные
+    события стоят одного сравнения уровня и увеличения счетчика.
+
+    Args:
+        path (str): Файл JSONL; None - не писать журнал в файл
+        tty_level (str): Минимальный уровень для вывода в терминал
+        file_level (str): Минимальный уровень для записи в файл
+    """
+
+    def __init__(self, path=None, tty_level='info', file_level='debug'):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.file = None
+        self.configure(path, tty_level, file_level)
+
+    def configure(self, path=None, tty_level='info', file_level='debug'):
+        """Меняет файл журнала и уровни (для глобального журнала из main())"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+            self.file = open(path, 'a', encoding='utf-8', buffering=1024 * 1024) if path else None
+        self.tty_level = LEVELS[tty_level]
+        self.file_level = LEVELS[file_level] if path else float('inf')
+        self.min_level = min(self.tty_level, self.file_level)
+
+    def enabled(self, level):
+        """Выводится ли куда-нибудь событие этого уровня (чтобы не готовить дорогие поля зря)"""
+        return LEVELS[level] >= self.min_level
+
+    def emit(self, stage, event, level='info', message=None, **fields):
+        """Записывает событие
+
+        Args:
+            stage (str): Стадия обработки
+            event (str): Имя события (оно же имя счетчика стадии)
+            level (str): debug, info, warning или error
+            message (str): Шаблон строки для терминала, заполняется полями события
+        """
+        self.counters[stage][event] += 1
+        value = LEVELS[level]
+        if value < self.min_level:
+            return
+        if value >= self.file_level:
+            record = {'ts': round(time.time(), 3), 'stage': stage, 'event': event, 'level': level, **fields}
+            line = json.dumps(record, ensure_ascii=False, default=str)
+            with self.lock:
+                if self.file is not None:
+                    self.file.write(line + '\n')
+        if value >= self.tty_level:
+            text = message.format(**fields) if message else f"{stage}: {event}"
+            prefix = '✗ ' if value >= LEVELS['error'] else ''
+            tqdm.write(f"{prefix}{text}")
+
+    def count(self, stage, event, amount=1):
+        """Увеличивает счетчик без записи события"""
+        self.counters[stage][event] += amount
+
+    def format_counters(self, stage, names=None):
+        """Счетчики стадии одной строкой для постфикса прогресс-бара
+
+        Args:
+            names (tuple): Какие счетчики показать (по умолчанию все)
+        """
+        counters = self.counters[stage]
+        names = sorted(counters) if names is None else [name for name in names if counters.get(name)]
+        return ' '.join(f"{name}={counters[name]}" for name in names)
+
+    def print_summary(self):
+        """Выводит счетчики всех стадий"""
+        if not self.counters:
+            return
+        print("\nСобытия по стадиям:")
+        for stage, counters in sorted(self.counters.items()):
+            print(f"- {stage}: {self.format_counters(stage)}")
+
+    def close(self):
+        self.file_level = float('inf')
+        self.min_level = self.tty_level
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+# Общий журнал процесса; main() скриптов настраивает его через configure_from_args
+events = EventLog()
+
+def add_arguments(parser):
+    """Добавляет в argparse параметры журнала событий"""
+    parser.add_argument('--log-file', default=None, help='Писать события в файл JSONL')
+    parser.add_argument('--log-level', choices=list(LEVELS), default='info',
+                        help='Минимальный уровень событий в терминале')
+    parser.add_argument('--quiet', action='store_true',
+                        help='В терминале только общий прогресс и ошибки')
+
+def configure_from_args(args):
+    """Настраивает общий журнал по параметрам из add_arguments"""
+    events.configure(args.log_file, 'error' if args.quiet else args.log_level)
+    return events
@@ -0,0 +1,153 @@
+import os
+import json
+import mmap
+import hashlib
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from metrics import timed
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Размер блока чтения: крупный и кратный странице памяти, чтобы уменьшить число системных вызовов
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Файлы больше этого размера хешируются через mmap
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+DEFAULT_ALGORITHM = 'blake2b'
+
+def get_available_algorithms():
+    """Возвращает список поддерживаемых алгоритмов хеширования"""
+    algorithms = ['blake2b', 'sha256', 'md5']
+    if xxhash is not None:
+        algorithms.insert(0, 'xxh3')
+    return algorithms
+
+def create_hasher(algorithm=DEFAULT_ALGORITHM):
+    """Создает объект хеширования для указанного алгоритма"""
+    if algorithm == 'xxh3':
+        if xxhash is None:
+            raise ValueError("Алгоритм xxh3 недоступен: не установлен пакет xxhash")
+        return xxhash.xxh3_128()
+    if algorithm not in ('blake2b', 'sha256', 'md5'):
+        raise ValueError(f"Неподдерживаемый алгоритм хеширования: {algorithm}")
+    return hashlib.new(algorithm)
+
+@timed('hash')
+def calculate_file_hash(filename, algorithm=DEFAULT_ALGORITHM, use_mmap=None):
+    """Вычисляет хеш файла крупными блоками или через mmap"""
+    hasher = create_hasher(algorithm)
+    size = os.path.getsize(filename)
+    if use_mmap is None:
+        use_mmap = size >= MMAP_THRESHOLD
+
+    with open(filename, "rb") as f:
+        if use_mmap and size > 0:
+            # hashlib отпускает GIL на больших буферах, поэтому отдаем весь файл целиком
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
+        else:
+            # Читаем в заранее выделенный буфер, чтобы не создавать новый объект на каждый блок
+            buffer = bytearray(CHUNK_SIZE)
+            view = memoryview(buffer)
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                hasher.update(view[:read])
+    return hasher.hexdigest()
+
+def get_stat_signature(filename):
+    """Возвращает сигнатуру файла (размер, время изменения, inode) для кэша"""
+    file_stat = os.stat(filename)
+    return {
+        'size': file_stat.st_size,
+        'mtime_ns': file_stat.st_mtime_ns,
+        'inode': file_stat.st_ino
+    }
+
+def load_hash_cache(cache_file):
+    """Загружает кэш хешей из JSON файла"""
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            print("Ошибка при чтении кэша хешей, создаем новый")
+    return {}
+
+def save_hash_cache(hash_cache, cache_file):
+    """Атомарно сохраняет кэш хешей в JSON файл"""
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(hash_cache, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, cache_file)
+
+def calculate_files_hashes(files, algorithm=DEFAULT_ALGORITHM, cache_file="hash_cache.json", max_workers=None):
+    """Вычисляет хеши списка файлов в пуле потоков, пропуская неизмененные файлы по кэшу
+
+    Args:
+        files (list): Пути к файлам
+        algorithm (str): Алгоритм хеширования (blake2b, sha256, md5, xxh3)
+        cache_file (str): Файл кэша хешей; None отключает кэширование
+        max_workers (int): Количество потоков; по умолчанию по числу процессоров
+
+    Returns:
+        dict: {путь к файлу: хеш}
+    """
+    hash_cache = load_hash_cache(cache_file)
+    cache_lock = Lock()
+    results = {}
+    files_to_hash = []
+
+    for file in files:
+        try:
+            signature = get_stat_signature(file)
+        except OSError as e:
+            print(f"Ошибка при получении информации о файле {file}: {str(e)}")
+            continue
+
+        cached = hash_cache.get(file, {})
+        cached_hash = cached.get('hashes', {}).get(algorithm)
+        if cached_hash and cached.get('signature') == signature:
+            results[file] = cached_hash
+        else:
+            files_to_hash.append((file, signature))
+
+    if not files_to_hash:
+        return results
+
+    def hash_one(file, signature):
+        file_hash = calculate_file_hash(file, algorithm)
+        with cache_lock:
+            entry = hash_cache.get(file)
+            # При изменении файла старые хеши других алгоритмов больше не действительны
+            if not entry or entry.get('signature') != signature:
+                entry = {'signature': signature, 'hashes': {}}
+                hash_cache[file] = entry
+            entry['hashes'][algorithm] = file_hash
+        return file_hash
+
+    workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        future_to_file = {
+            executor.submit(hash_one, file, signature): file
+            for file, signature in files_to_hash
+        }
+        for future in as_completed(future_to_file):
+            file = future_to_file[future]
+            try:
+                results[file] = future.result()
+            except Exception as e:
+                print(f"Ошибка при хешировании файла {file}: {str(e)}")
+
+    if cache_file:
+        try:
+            save_hash_cache(hash_cache, cache_file)
+        except Exception as e:
+            print(f"Ошибка при сохранении кэша хешей: {str(e)}")
+
+    return results
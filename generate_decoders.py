@@ -0,0 +1,495 @@
+import os
+import re
+import glob
+import keyword
+import argparse
+import importlib.util
+import xml.etree.ElementTree as ET
+
+XS = '{http://www.w3.org/2001/XMLSchema}'
+
+# Соответствие встроенных типов XSD функциям преобразования в сгенерированном модуле
+BUILTIN_CONVERTERS = {
+    'date': '_to_date',
+    'dateTime': '_to_datetime',
+    'int': '_to_int',
+    'integer': '_to_int',
+    'long': '_to_int',
+    'short': '_to_int',
+    'byte': '_to_int',
+    'nonNegativeInteger': '_to_int',
+    'positiveInteger': '_to_int',
+    'unsignedInt': '_to_int',
+    'unsignedLong': '_to_int',
+    'unsignedShort': '_to_int',
+    'decimal': '_to_decimal',
+    'double': '_to_float',
+    'float': '_to_float',
+    'boolean': '_to_bool',
+}
+
+# Вспомогательный код, который попадает в начало каждого сгенерированного модуля
+RUNTIME_CODE = '''import sys
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+def _local(tag):
+    return tag[tag.rfind('}') + 1:]
+
+def _to_str(value):
+    return value.strip() if value is not None else None
+
+def _to_int(value):
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value.strip()
+
+def _to_float(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return value.strip()
+
+def _to_decimal(value):
+    if value is None:
+        return None
+    try:
+        return Decimal(value.strip())
+    except InvalidOperation:
+        return value.strip()
+
+def _to_bool(value):
+    if value is None:
+        return None
+    value = value.strip()
+    if value in ('true', '1'):
+        return True
+    if value in ('false', '0'):
+        return False
+    return value
+
+def _to_date(value):
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        # Отбрасываем часовой пояс вида Z или +03:00
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return value
+
+def _to_datetime(value):
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return value
+
+def _make_enum(values):
+    """Возвращает преобразователь, который отдает общие (interned) строки перечисления"""
+    table = {value: sys.intern(value) for value in values}
+    def convert(value):
+        if value is None:
+            return None
+        value = value.strip()
+        return table.get(value, value)
+    return convert
+
+class _Record:
+    __slots__ = ()
+
+    def to_dict(self):
+        """Преобразует запись в словарь (вложенные записи - рекурсивно)"""
+        result = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, _Record):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [item.to_dict() if isinstance(item, _Record) else item for item in value]
+            result[name] = value
+        return result
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+'''
+
+def local_name(qname):
+    """Возвращает имя без префикса пространства имен (xs:string -> string)"""
+    if qname is None:
+        return None
+    return qname.split(':', 1)[-1]
+
+def to_identifier(name):
+    """Преобразует имя XML в допустимый идентификатор Python"""
+    identifier = re.sub(r'\W', '_', name)
+    if not identifier or identifier[0].isdigit():
+        identifier = f"_{identifier}"
+    if keyword.iskeyword(identifier):
+        identifier += '_'
+    return identifier
+
+def to_class_name(name):
+    """Преобразует имя типа XSD в имя класса"""
+    parts = re.split(r'[\W_]+', name)
+    class_name = ''.join(part[:1].upper() + part[1:] for part in parts if part)
+    return to_identifier(class_name or 'Record')
+
+class FieldSpec:
+    """Описание поля сгенерированного класса"""
+
+    def __init__(self, xml_name, kind, converter, repeated=False, class_name=None):
+        self.xml_name = xml_name
+        self.kind = kind  # attribute, element или text
+        self.converter = converter
+        self.repeated = repeated
+        self.class_name = class_name
+        self.slot = None
+
+class ClassSpec:
+    """Описание сгенерированного класса записи"""
+
+    def __init__(self, name):
+        self.name = name
+        self.fields = []
+
+class SchemaModel:
+    """Модель набора XSD файлов: именованные типы и элементы верхнего уровня"""
+
+    def __init__(self):
+        self.complex_types = {}
+        self.simple_types = {}
+        self.elements = {}
+        self.loaded_files = set()
+
+    def load(self, xsd_path):
+        """Загружает XSD файл и все подключенные через include/import файлы"""
+        xsd_path = os.path.abspath(xsd_path)
+        if xsd_path in self.loaded_files:
+            return
+        self.loaded_files.add(xsd_path)
+        root = ET.parse(xsd_path).getroot()
+
+        for child in root:
+            if child.tag in (f"{XS}include", f"{XS}import"):
+                location = child.get('schemaLocation')
+                if location:
+                    included = os.path.join(os.path.dirname(xsd_path), location)
+                    if os.path.exists(included):
+                        self.load(included)
+            elif child.tag == f"{XS}complexType" and child.get('name'):
+                self.complex_types[child.get('name')] = child
+            elif child.tag == f"{XS}simpleType" and child.get('name'):
+                self.simple_types[child.get('name')] = child
+            elif child.tag == f"{XS}element" and child.get('name'):
+                self.elements[child.get('name')] = child
+
+    def resolve_simple_type(self, type_node=None, type_name=None, seen=None):
+        """Возвращает (имя функции преобразования, значения перечисления) для простого типа"""
+        seen = seen or set()
+        if type_node is None:
+            name = local_name(type_name)
+            if name is None:
+                return '_to_str', None
+            if name in self.simple_types and name not in seen:
+                seen.add(name)
+                type_node = self.simple_types[name]
+            else:
+                return BUILTIN_CONVERTERS.get(name, '_to_str'), None
+
+        restriction = type_node.find(f"{XS}restriction")
+        if restriction is None:
+            return '_to_str', None
+        enumerations = [e.get('value') for e in restriction.findall(f"{XS}enumeration")]
+        if enumerations:
+            return None, enumerations
+        inner = restriction.find(f"{XS}simpleType")
+        if inner is not None:
+            return self.resolve_simple_type(inner, seen=seen)
+        return self.resolve_simple_type(type_name=restriction.get('base'), seen=seen)
+
+class DecoderGenerator:
+    """Строит описания классов по модели схемы и генерирует исходный код декодера"""
+
+    def __init__(self, model):
+        self.model = model
+        self.classes = []
+        self.class_by_type = {}
+        self.used_names = set()
+        self.enums = {}
+
+    def unique_class_name(self, name):
+        """Возвращает уникальное имя класса"""
+        base = to_class_name(name)
+        class_name = base
+        index = 2
+        while class_name in self.used_names:
+            class_name = f"{base}{index}"
+            index += 1
+        self.used_names.add(class_name)
+        return class_name
+
+    def enum_converter(self, values):
+        """Возвращает имя преобразователя для набора значений перечисления"""
+        key = tuple(values)
+        if key not in self.enums:
+            self.enums[key] = f"_enum_{len(self.enums) + 1}"
+        return self.enums[key]
+
+    def simple_converter(self, type_node=None, type_name=None):
+        """Возвращает имя преобразователя простого типа с учетом перечислений"""
+        converter, enumerations = self.model.resolve_simple_type(type_node, type_name)
+        if enumerations:
+            return self.enum_converter(enumerations)
+        return converter
+
+    def is_complex(self, type_name):
+        """Проверяет, ссылается ли имя на сложный тип"""
+        return local_name(type_name) in self.model.complex_types
+
+    def class_for_type(self, type_name):
+        """Возвращает имя класса для именованного сложного типа, создавая его при необходимости"""
+        name = local_name(type_name)
+        if name not in self.class_by_type:
+            spec = ClassSpec(self.unique_class_name(name))
+            self.class_by_type[name] = spec
+            self.classes.append(spec)
+            self.fill_class(spec, self.model.complex_types[name])
+        return self.class_by_type[name].name
+
+    def class_for_anonymous(self, element_name, complex_node):
+        """Создает класс для анонимного сложного типа элемента"""
+        spec = ClassSpec(self.unique_class_name(f"{element_name}Type"))
+        self.classes.append(spec)
+        self.fill_class(spec, complex_node)
+        return spec.name
+
+    def fill_class(self, spec, complex_node, seen_bases=None):
+        """Заполняет поля класса по описанию complexType"""
+        seen_bases = seen_bases or set()
+        for content_tag in (f"{XS}complexContent", f"{XS}simpleContent"):
+            content = complex_node.find(content_tag)
+            if content is None:
+                continue
+            for derivation in content:
+                base = local_name(derivation.get('base'))
+                if content_tag == f"{XS}simpleContent":
+                    spec.fields.append(FieldSpec('#text', 'text', self.simple_converter(type_name=derivation.get('base'))))
+                elif base in self.model.complex_types and base not in seen_bases:
+                    seen_bases.add(base)
+                    self.fill_class(spec, self.model.complex_types[base], seen_bases)
+                self.add_particles(spec, derivation)
+            return
+        self.add_particles(spec, complex_node)
+
+    def add_particles(self, spec, node, repeated=False):
+        """Рекурсивно добавляет элементы и атрибуты из sequence/choice/all"""
+        for child in node:
+            if child.tag in (f"{XS}sequence", f"{XS}choice", f"{XS}all"):
+                self.add_particles(spec, child, repeated or child.get('maxOccurs', '1') not in ('0', '1'))
+            elif child.tag == f"{XS}element":
+                self.add_element_field(spec, child, repeated)
+            elif child.tag == f"{XS}attribute":
+                name = child.get('name') or local_name(child.get('ref'))
+                if name:
+                    inner = child.find(f"{XS}simpleType")
+                    converter = self.simple_converter(inner, child.get('type'))
+                    spec.fields.append(FieldSpec(name, 'attribute', converter))
+
+    def add_element_field(self, spec, element, repeated):
+        """Добавляет поле для дочернего элемента"""
+        if element.get('ref'):
+            name = local_name(element.get('ref'))
+            element = self.model.elements.get(name, element)
+        else:
+            name = element.get('name')
+        if not name:
+            return
+
+        repeated = repeated or element.get('maxOccurs', '1') not in ('0', '1')
+        type_name = element.get('type')
+        complex_node = element.find(f"{XS}complexType")
+        simple_node = element.find(f"{XS}simpleType")
+
+        if complex_node is not None:
+            class_name = self.class_for_anonymous(name, complex_node)
+            spec.fields.append(FieldSpec(name, 'element', None, repeated, class_name))
+        elif type_name and self.is_complex(type_name):
+            class_name = self.class_for_type(type_name)
+            spec.fields.append(FieldSpec(name, 'element', None, repeated, class_name))
+        else:
+            converter = self.simple_converter(simple_node, type_name)
+            spec.fields.append(FieldSpec(name, 'element', converter, repeated))
+
+    def build(self):
+        """Строит классы для всех элементов верхнего уровня"""
+        roots = {}
+        for name, element in self.model.elements.items():
+            complex_node = element.find(f"{XS}complexType")
+            if complex_node is not None:
+                roots[name] = self.class_for_anonymous(name, complex_node)
+            elif element.get('type') and self.is_complex(element.get('type')):
+                roots[name] = self.class_for_type(element.get('type'))
+
+        # Записями считаем дочерние элементы корней (например, проверки внутри списка)
+        records = {}
+        for class_name in roots.values():
+            spec = next(s for s in self.classes if s.name == class_name)
+            for field in spec.fields:
+                if field.kind == 'element' and field.class_name:
+                    records.setdefault(field.xml_name, field.class_name)
+        return roots, records
+
+    def render(self, source_name):
+        """Генерирует исходный код модуля декодера"""
+        roots, records = self.build()
+        lines = [
+            f'"""Декодер, сгенерированный generate_decoders.py по схеме {source_name}. Не редактировать вручную."""',
+            RUNTIME_CODE,
+        ]
+        for values, name in self.enums.items():
+            lines.append(f"{name} = _make_enum({list(values)!r})")
+        lines.append('')
+
+        for spec in self.classes:
+            used_slots = set()
+            for field in spec.fields:
+                slot = to_identifier(field.xml_name if field.kind != 'text' else 'value')
+                while slot in used_slots:
+                    slot += '_'
+                used_slots.add(slot)
+                field.slot = slot
+
+            lines.append(f"class {spec.name}(_Record):")
+            lines.append(f"    __slots__ = {tuple(field.slot for field in spec.fields)!r}")
+            lines.append('')
+            lines.append('    @classmethod')
+            lines.append('    def from_element(cls, elem):')
+            lines.append('        obj = cls.__new__(cls)')
+            element_fields = [f for f in spec.fields if f.kind == 'element']
+            for field in spec.fields:
+                if field.kind == 'attribute':
+                    lines.append(f"        obj.{field.slot} = {field.converter}(elem.get({field.xml_name!r}))")
+                elif field.kind == 'text':
+                    lines.append(f"        obj.{field.slot} = {field.converter}(elem.text)")
+                elif field.repeated:
+                    lines.append(f"        obj.{field.slot} = []")
+                else:
+                    lines.append(f"        obj.{field.slot} = None")
+            if element_fields:
+                lines.append('        children = cls._CHILDREN')
+                lines.append('        for child in elem:')
+                lines.append('            spec = children.get(_local(child.tag))')
+                lines.append('            if spec is None:')
+                lines.append('                continue')
+                lines.append('            slot, convert, repeated, is_complex = spec')
+                lines.append('            value = convert(child) if is_complex else convert(child.text)')
+                lines.append('            if repeated:')
+                lines.append('                getattr(obj, slot).append(value)')
+                lines.append('            else:')
+                lines.append('                setattr(obj, slot, value)')
+            lines.append('        return obj')
+            lines.append('')
+
+        # Таблицы дочерних элементов заполняются после объявления всех классов
+        for spec in self.classes:
+            entries = []
+            for field in spec.fields:
+                if field.kind != 'element':
+                    continue
+                if field.class_name:
+                    entries.append(f"    {field.xml_name!r}: ({field.slot!r}, {field.class_name}.from_element, {field.repeated!r}, True),")
+                else:
+                    entries.append(f"    {field.xml_name!r}: ({field.slot!r}, {field.converter}, {field.repeated!r}, False),")
+            lines.append(f"{spec.name}._CHILDREN = {{")
+            lines.extend(entries)
+            lines.append('}')
+        lines.append('')
+
+        lines.append('ROOT_CLASSES = {')
+        for name, class_name in roots.items():
+            lines.append(f"    {name!r}: {class_name},")
+        lines.append('}')
+        lines.append('')
+        lines.append('RECORD_CLASSES = {')
+        for name, class_name in records.items():
+            lines.append(f"    {name!r}: {class_name},")
+        lines.append('}')
+        lines.append('')
+        lines.append('def decode(elem):')
+        lines.append('    """Преобразует элемент записи в типизированный объект (неизвестные теги - None)"""')
+        lines.append('    cls = RECORD_CLASSES.get(_local(elem.tag)) or ROOT_CLASSES.get(_local(elem.tag))')
+        lines.append('    if cls is None:')
+        lines.append('        return None')
+        lines.append('    return cls.from_element(elem)')
+        lines.append('')
+        return '\n'.join(lines)
+
+def generate_decoder(xsd_path, output_dir="decoders"):
+    """Генерирует модуль декодера по XSD файлу и возвращает путь к нему"""
+    model = SchemaModel()
+    model.load(xsd_path)
+    source = DecoderGenerator(model).render(os.path.basename(xsd_path))
+
+    os.makedirs(output_dir, exist_ok=True)
+    module_name = f"decoder_{to_identifier(os.path.splitext(os.path.basename(xsd_path))[0]).lower()}"
+    output_path = os.path.join(output_dir, f"{module_name}.py")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(source)
+    return output_path
+
+_loaded_decoders = {}
+
+def load_decoder(decoder_path):
+    """Загружает сгенерированный модуль и возвращает его функцию decode"""
+    decoder_path = os.path.abspath(decoder_path)
+    if decoder_path not in _loaded_decoders:
+        module_name = os.path.splitext(os.path.basename(decoder_path))[0]
+        spec = importlib.util.spec_from_file_location(module_name, decoder_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded_decoders[decoder_path] = module.decode
+    return _loaded_decoders[decoder_path]
+
+def find_xsd_files(base_dir="."):
+    """Находит все скачанные XSD файлы в xml/<тип>/xsd и xsd/"""
+    patterns = [
+        os.path.join(base_dir, 'xml', '*', 'xsd', '*.xsd'),
+        os.path.join(base_dir, 'xsd', '*.xsd'),
+    ]
+    xsd_files = []
+    for pattern in patterns:
+        xsd_files.extend(glob.glob(pattern))
+    return sorted(set(xsd_files))
+
+def main():
+    parser = argparse.ArgumentParser(description='Генерация декодеров записей по XSD схемам')
+    parser.add_argument('xsd_files', nargs='*', help='XSD файлы (по умолчанию - все скачанные)')
+    parser.add_argument('--output-dir', default='decoders', help='Директория для сгенерированных модулей')
+    args = parser.parse_args()
+
+    xsd_files = args.xsd_files or find_xsd_files()
+    if not xsd_files:
+        print("Не найдено XSD файлов")
+        return
+
+    print(f"Найдено XSD файлов: {len(xsd_files)}")
+    for xsd_file in xsd_files:
+        try:
+            output_path = generate_decoder(xsd_file, args.output_dir)
+            print(f"✓ {os.path.basename(xsd_file)} -> {output_path}")
+        except ET.ParseError as e:
+            print(f"✗ Ошибка при разборе {xsd_file}: {str(e)}")
+        except Exception as e:
+            print(f"✗ Ошибка при генерации декодера для {xsd_file}: {str(e)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import json
+import sqlite3
+import argparse
+from datetime import datetime
+from collections import defaultdict
+from tqdm import tqdm
+from xml_records import (find_archives, get_archive_partition, extract_snapshot_date,
+                         iter_archive_records, get_record_key, RECORD_KEY_FIELDS)
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+SCHEMA_SQL = [
+    """CREATE TABLE IF NOT EXISTS records (
+        dataset TEXT NOT NULL,
+        record_type TEXT NOT NULL,
+        record_key TEXT NOT NULL,
+        month TEXT NOT NULL,
+        snapshot TEXT NOT NULL,
+        archive TEXT NOT NULL,
+        member TEXT NOT NULL,
+        record_offset INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (dataset, record_type, record_key)
+    )""",
+    """CREATE TABLE IF NOT EXISTS watermarks (
+        dataset TEXT NOT NULL,
+        record_type TEXT NOT NULL,
+        month TEXT NOT NULL,
+        snapshot TEXT NOT NULL,
+        archive TEXT NOT NULL,
+        records INTEGER NOT NULL,
+        loaded_at TEXT NOT NULL,
+        PRIMARY KEY (dataset, record_type, month)
+    )""",
+]
+
+# Более старая выгрузка не должна перезаписывать запись из более новой
+UPSERT_SQL = """INSERT INTO records
+    (dataset, record_type, record_key, month, snapshot, archive, member, record_offset, data)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (dataset, record_type, record_key) DO UPDATE SET
+        month = excluded.month,
+        snapshot = excluded.snapshot,
+        archive = excluded.archive,
+        member = excluded.member,
+        record_offset = excluded.record_offset,
+        data = excluded.data
+    WHERE excluded.snapshot >= records.snapshot"""
+
+WATERMARK_SQL = """INSERT INTO watermarks
+    (dataset, record_type, month, snapshot, archive, records, loaded_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (dataset, record_type, month) DO UPDATE SET
+        snapshot = excluded.snapshot,
+        archive = excluded.archive,
+        records = excluded.records,
+        loaded_at = excluded.loaded_at"""
+
+def connect(db_path, engine='sqlite'):
+    """Открывает базу данных и создает таблицы при необходимости"""
+    if engine == 'duckdb':
+        if duckdb is None:
+            raise RuntimeError("Для работы с DuckDB требуется пакет duckdb")
+        connection = duckdb.connect(db_path)
+    else:
+        # Транзакциями управляем явно
+        connection = sqlite3.connect(db_path, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+    for statement in SCHEMA_SQL:
+        connection.execute(statement)
+    return connection
+
+def load_watermarks(connection):
+    """Загружает водяные знаки: {(набор, тип, месяц): дата последней загруженной выгрузки}"""
+    rows = connection.execute("SELECT dataset, record_type, month, snapshot FROM watermarks").fetchall()
+    return {(dataset, record_type, month): snapshot for dataset, record_type, month, snapshot in rows}
+
+def plan_archives(archives, watermarks):
+    """Отбирает архивы новее водяного знака своего раздела, упорядоченные по дате выгрузки"""
+    pending = []
+    for archive_path in archives:
+        partition = get_archive_partition(archive_path)
+        snapshot = extract_snapshot_date(archive_path)
+        if partition is None or snapshot is None:
+            continue
+        if snapshot <= watermarks.get(partition, ''):
+            continue
+        pending.append((snapshot, partition, archive_path))
+    # Более старые выгрузки загружаются раньше, чтобы новые записи оказались поверх
+    pending.sort()
+    return pending
+
+def ingest_archive(connection, archive_path, partition, snapshot, batch_size=5000,
+                   key_fields=RECORD_KEY_FIELDS, record_tag=None):
+    """Загружает записи архива батчами и сдвигает водяной знак в той же транзакции"""
+    dataset, record_type, month = partition
+    archive_name = os.path.basename(archive_path)
+    batch = []
+    total = 0
+    connection.execute("BEGIN TRANSACTION")
+    try:
+        for member_name, offset, record in iter_archive_records(archive_path, record_tag):
+            batch.append((
+                dataset, record_type, get_record_key(record, key_fields), month, snapshot,
+                archive_name, member_name, offset, json.dumps(record, ensure_ascii=False)
+            ))
+            if len(batch) >= batch_size:
+                connection.executemany(UPSERT_SQL, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            connection.executemany(UPSERT_SQL, batch)
+            total += len(batch)
+        connection.execute(WATERMARK_SQL, (dataset, record_type, month, snapshot, archive_name,
+                                           total, datetime.now().isoformat()))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return total
+
+def ingest(data_dir="data", db_path="inspections.db", engine='sqlite', batch_size=5000,
+           key_fields=RECORD_KEY_FIELDS, record_tag=None):
+    """Инкрементально загружает в базу только архивы новее водяных знаков"""
+    connection = connect(db_path, engine)
+    try:
+        watermarks = load_watermarks(connection)
+        pending = plan_archives(find_archives(data_dir), watermarks)
+
+        print(f"\nРазделов с водяными знаками: {len(watermarks)}")
+        print(f"Архивов для загрузки: {len(pending)}")
+        if not pending:
+            print("Новых данных нет")
+            return {}
+
+        stats = defaultdict(int)
+        for snapshot, partition, archive_path in tqdm(pending, desc="Загрузка архивов", unit="архив"):
+            try:
+                records = ingest_archive(connection, archive_path, partition, snapshot,
+                                         batch_size, key_fields, record_tag)
+                stats['archives'] += 1
+                stats['records'] += records
+            except Exception as e:
+                stats['failed'] += 1
+                tqdm.write(f"✗ Ошибка при загрузке {archive_path}: {str(e)}")
+
+        print(f"\nЗагрузка завершена:")
+        print(f"- Загружено архивов: {stats['archives']}")
+        print(f"- Загружено записей: {stats['records']}")
+        print(f"- Ошибок: {stats['failed']}")
+        return dict(stats)
+    finally:
+        connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Инкрементальная загрузка архивов проверок в локальную базу')
+    parser.add_argument('--data-dir', default='data', help='Директория с архивами')
+    parser.add_argument('--db', default='inspections.db', help='Файл базы данных')
+    parser.add_argument('--engine', choices=['sqlite', 'duckdb'], default='sqlite', help='СУБД')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Количество записей в одной вставке')
+    parser.add_argument('--key-field', action='append', default=None,
+                        help='Поле естественного ключа записи (можно указать несколько)')
+    parser.add_argument('--record-tag', default=None, help='Имя тега записи')
+    args = parser.parse_args()
+
+    key_fields = tuple(args.key_field) if args.key_field else RECORD_KEY_FIELDS
+    ingest(args.data_dir, args.db, args.engine, args.batch_size, key_fields, args.record_tag)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+from threading import Lock
+
+DEFAULT_QUEUE_DB = "work_queue.db"
+
+SCHEMA_SQL = """CREATE TABLE IF NOT EXISTS work (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority REAL NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    token TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result TEXT,
+    updated_at REAL NOT NULL
+)"""
+
+INDEX_SQL = "CREATE INDEX IF NOT EXISTS work_claim ON work (status, priority)"
+
+class LeaseQueue:
+    """Общая очередь работы для нескольких узлов с арендой задач по времени
+
+    Узел забирает задачу на lease_seconds и продлевает аренду, пока работает.
+    Если узел упал, аренда истекает и задачу забирает другой узел, поэтому
+    теряется не больше одной аренды работы. Каждая аренда получает свой токен:
+    узел, у которого аренду уже забрали, не сможет ни продлить, ни закрыть
+    задачу. Хранилище - SQLite (файл, доступный всем узлам); задача
+    берется внутри BEGIN IMMEDIATE, так что двое ее не получат.
+
+    Журнал - обычный rollback (DELETE), а не WAL: WAL держит индекс в общей
+    памяти и не работает, когда узлы открывают файл с разных машин по сетевой
+    ФС. Сетевая ФС должна поддерживать блокировки файлов (NFS с lockd, SMB);
+    если это не так, очередь нужно держать на сервере БД.
+
+    Args:
+        db_path (str): Файл очереди
+        lease_seconds (float): Срок аренды без продления, с
+        max_attempts (int): Сколько раз задачу можно брать, прежде чем признать ее неудачной
+    """
+
+    def __init__(self, db_path=DEFAULT_QUEUE_DB, lease_seconds=300, max_attempts=5):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.lock = Lock()
+        self.connection = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute(SCHEMA_SQL)
+        self.connection.execute(INDEX_SQL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def enqueue(self, key, kind, payload, priority=0):
+        """Добавляет задачу, если задачи с таким ключом еще нет
+
+        Returns:
+            bool: True, если задача добавлена
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO work (key, kind, payload, priority, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, json.dumps(payload, ensure_ascii=False), priority, time.time())
+            )
+        return cursor.rowcount == 1
+
+    def claim(self, owner):
+        """Берет в аренду самую приоритетную свободную задачу или задачу с истекшей арендой
+
+        Returns:
+            dict: {'key', 'kind', 'payload', 'attempts', 'token'} или None, если задач нет
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Истекшая аренда после последней попытки значит, что узел упал на этой задаче
+                # (fail() он уже не вызовет); такую задачу больше не раздаем, иначе она будет
+                # ронять узел за узлом
+                expired = self.connection.execute(
+                    "UPDATE work SET status = 'failed', owner = NULL, token = NULL, lease_until = NULL, "
+                    "error = ?, updated_at = ? WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                    ("аренда истекла после последней попытки", now, now, self.max_attempts)
+                ).rowcount
+                # Для свободной задачи lease_until - время, раньше которого ее не берут (пауза перед повтором)
+                row = self.connection.execute(
+                    "SELECT key, kind, payload, attempts, status, owner FROM work "
+                    "WHERE (status = 'pending' AND (lease_until IS NULL OR lease_until <= ?)) "
+                    "OR (status = 'leased' AND lease_until < ?) "
+                    "ORDER BY priority, rowid LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is not None:
+                    self.connection.execute(
+                        "UPDATE work SET status = 'leased', owner = ?, token = ?, lease_until = ?, "
+                        "attempts = attempts + 1, updated_at = ? WHERE key = ?",
+                        (owner, token, now + self.lease_seconds, now, row[0])
+                    )
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        if expired:
+            print(f"✗ Задач с истекшей арендой после последней попытки: {expired}, отмечены неудачными")
+        if row is None:
+            return None
+        key, kind, payload, attempts, status, previous_owner = row
+        if status == 'leased':
+            print(f"Аренда узла {previous_owner} истекла, задача передана узлу {owner}: {key}")
+        return {'key': key, 'kind': kind, 'payload': json.loads(payload), 'attempts': attempts + 1, 'token': token}
+
+    def update_lease(self, lease, sql, params):
+        """Выполняет UPDATE только для действующей аренды; возвращает False, если аренду уже забрали"""
+        with self.lock:
+            cursor = self.connection.execute(
+                f"UPDATE work SET {sql}, updated_at = ? WHERE key = ? AND token = ? AND status = 'leased'",
+                (*params, time.time(), lease['key'], lease['token'])
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, lease):
+        """Продлевает аренду
+
+        Returns:
+            bool: False, если аренда потеряна и работу нужно прекратить
+        """
+        return self.update_lease(lease, "lease_until = ?", (time.time() + self.lease_seconds,))
+
+    def complete(self, lease, result=None):
+        """Отмечает задачу выполненной"""
+        return self.update_lease(lease, "status = 'done', owner = NULL, token = NULL, lease_until = NULL, "
+                                        "error = NULL, result = ?", (json.dumps(result, ensure_ascii=False),))
+
+    def fail(self, lease, error, retry_delay=0, permanent=False):
+        """Возвращает задачу в очередь после паузы или отмечает ее неудачной, если попытки исчерпаны"""
+        if permanent or lease['attempts'] >= self.max_attempts:
+            return self.update_lease(lease, "status = 'failed', owner = NULL, token = NULL, lease_until = NULL, "
+                                            "error = ?", (error,))
+        return self.update_lease(lease, "status = 'pending', owner = NULL, token = NULL, lease_until = ?, "
+                                        "error = ?", (time.time() + retry_delay, error))
+
+    def release(self, lease):
+        """Возвращает задачу в очередь без траты попытки (остановка узла)"""
+        return self.update_lease(lease, "status = 'pending', owner = NULL, token = NULL, lease_until = NULL, "
+                                        "attempts = attempts - 1", ())
+
+    def retry_failed(self):
+        """Возвращает все неудачные задачи в очередь с обнуленными попытками"""
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE work SET status = 'pending', attempts = 0, error = NULL, updated_at = ? WHERE status = 'failed'",
+                (time.time(),)
+            )
+        return cursor.rowcount
+
+    def iter_done(self, kind=None):
+        """Перечисляет выполненные задачи: (ключ, вид, задача, результат)"""
+        query = "SELECT key, kind, payload, result FROM work WHERE status = 'done'"
+        params = []
+        if kind is not None:
+            query += " AND kind = ?"
+            params.append(kind)
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        for key, kind, payload, result in rows:
+            yield key, kind, json.loads(payload), json.loads(result) if result else None
+
+    def get_stats(self):
+        """Число задач по статусам и действующие аренды по узлам"""
+        now = time.time()
+        with self.lock:
+            by_status = dict(self.connection.execute("SELECT status, COUNT(*) FROM work GROUP BY status").fetchall())
+            by_owner = dict(self.connection.execute(
+                "SELECT owner, COUNT(*) FROM work WHERE status = 'leased' AND lease_until >= ? GROUP BY owner", (now,)
+            ).fetchall())
+            expired = self.connection.execute(
+                "SELECT COUNT(*) FROM work WHERE status = 'leased' AND lease_until < ?", (now,)
+            ).fetchone()[0]
+        return {'by_status': by_status, 'by_owner': by_owner, 'expired': expired}
+
+    def get_failed(self, limit=50):
+        """Неудачные задачи с последней ошибкой"""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT key, attempts, error FROM work WHERE status = 'failed' ORDER BY updated_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+
+def main():
+    parser = argparse.ArgumentParser(description='Состояние общей очереди работы')
+    parser.add_argument('--queue-db', default=DEFAULT_QUEUE_DB, help='Файл очереди')
+    parser.add_argument('--retry-failed', action='store_true', help='Вернуть неудачные задачи в очередь')
+    args = parser.parse_args()
+
+    with LeaseQueue(args.queue_db) as queue:
+        if args.retry_failed:
+            print(f"Возвращено в очередь: {queue.retry_failed()}")
+        stats = queue.get_stats()
+        print("Задачи по статусам:")
+        for status in ('pending', 'leased', 'done', 'failed'):
+            print(f"- {status}: {stats['by_status'].get(status, 0)}")
+        print(f"Аренд с истекшим сроком (будут переданы другим узлам): {stats['expired']}")
+        if stats['by_owner']:
+            print("Действующие аренды:")
+            for owner, count in sorted(stats['by_owner'].items()):
+                print(f"- {owner}: {count}")
+        failed = queue.get_failed()
+        if failed:
+            print("Неудачные задачи:")
+            for key, attempts, error in failed:
+                print(f"  - {key} (попыток: {attempts}): {error}")
+
+if __name__ == "__main__":
+    main()
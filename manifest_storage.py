@@ -0,0 +1,173 @@
+import os
+import gzip
+import json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Способ сжатия -> расширение файла и значение Content-Encoding
+COMPRESSION_EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+MANIFEST_EXTENSIONS = ('.xml', '.xml.gz', '.xml.zst')
+
+def is_manifest(filename):
+    """Проверяет, является ли файл месячным XML (сжатым или нет)"""
+    return filename.endswith(MANIFEST_EXTENSIONS)
+
+def strip_compression_suffix(filename):
+    """Убирает расширение сжатия: name.xml.gz -> name.xml"""
+    for extension in COMPRESSION_EXTENSIONS.values():
+        if filename.endswith(f".xml{extension}"):
+            return filename[:-len(extension)]
+    return filename
+
+def get_manifest_path(xml_filename, compression=None):
+    """Возвращает путь, по которому сохраняется XML с учетом сжатия"""
+    if compression:
+        return f"{xml_filename}{COMPRESSION_EXTENSIONS[compression]}"
+    return xml_filename
+
+def find_manifest(xml_filename):
+    """Находит сохраненный XML в любом из вариантов хранения или возвращает None"""
+    for path in (xml_filename, *(f"{xml_filename}{ext}" for ext in COMPRESSION_EXTENSIONS.values())):
+        if os.path.exists(path):
+            return path
+    return None
+
+def open_manifest(path):
+    """Открывает XML для потокового чтения, распаковывая его на лету"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError("Для чтения .zst требуется пакет zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+def get_accept_encoding(compression):
+    """Заголовок Accept-Encoding, при котором тело можно сохранить без перепаковки"""
+    if compression == 'zstd':
+        return 'zstd, gzip;q=0.5'
+    if compression == 'gzip':
+        return 'gzip'
+    return None
+
+class DownloadInterrupted(Exception):
+    """Скачивание остановлено при завершении работы"""
+
+def get_checkpoint_path(filename):
+    """Файл с валидаторами ответа для докачки filename.part"""
+    return f"{filename}.part.json"
+
+def load_checkpoint(filename):
+    """Возвращает (сколько байт уже в .part, валидатор для If-Range) или (0, None)
+
+    Докачка возможна только если при остановке сохранены ETag или Last-Modified
+    и размер .part не менялся с тех пор.
+    """
+    tmp_filename = f"{filename}.part"
+    checkpoint_path = get_checkpoint_path(filename)
+    if not (os.path.exists(tmp_filename) and os.path.exists(checkpoint_path)):
+        return 0, None
+    try:
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return 0, None
+    validator = checkpoint.get('etag') or checkpoint.get('last_modified')
+    if not validator or os.path.getsize(tmp_filename) != checkpoint.get('bytes'):
+        return 0, None
+    return checkpoint['bytes'], validator
+
+def save_checkpoint(response, filename):
+    """Сохраняет валидаторы ответа рядом с .part, чтобы потом докачать файл с того же места"""
+    with open(get_checkpoint_path(filename), 'w', encoding='utf-8') as f:
+        json.dump({
+            'url': response.url,
+            'bytes': os.path.getsize(f"{filename}.part"),
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+        }, f)
+
+def clear_checkpoint(filename):
+    """Удаляет сведения о недокачанном файле"""
+    if os.path.exists(get_checkpoint_path(filename)):
+        os.remove(get_checkpoint_path(filename))
+
+def discard_partial(filename):
+    """Удаляет недокачанный .part вместе с валидаторами, чтобы скачать файл заново"""
+    clear_checkpoint(filename)
+    if os.path.exists(f"{filename}.part"):
+        os.remove(f"{filename}.part")
+
+def save_response(response, filename, compression=None, progress_bar=None, chunk_size=8192, stop_event=None):
+    """Сохраняет тело ответа в файл, при необходимости сжимая его
+
+    Если сервер прислал тело в том же кодировании, в котором мы храним файл
+    (Content-Encoding: gzip для .gz или zstd для .zst), байты пишутся на диск
+    как есть, без распаковки и повторного сжатия. Ответ 206 дописывается
+    к существующему .part.
+
+    Если установлен stop_event, запись прерывается с DownloadInterrupted.
+    Несжатый файл, полученный без Content-Encoding, остается в .part вместе
+    с валидаторами, и следующий запуск докачивает его через Range; сжатый
+    поток дописать нельзя, поэтому его .part удаляется.
+
+    Returns:
+        int: Сколько байт тела получено (для метрик, когда прогресс-бар не нужен)
+    """
+    content_encoding = response.headers.get('content-encoding', '').lower()
+    tmp_filename = f"{filename}.part"
+
+    received = 0
+
+    def stopped():
+        return stop_event is not None and stop_event.is_set()
+
+    if compression and content_encoding == compression:
+        with open(tmp_filename, 'wb') as f:
+            for chunk in response.raw.stream(chunk_size, decode_content=False):
+                if stopped():
+                    break
+                size = f.write(chunk)
+                received += size
+                if progress_bar is not None:
+                    progress_bar.update(size)
+        if stopped():
+            os.remove(tmp_filename)
+            raise DownloadInterrupted(filename)
+        os.replace(tmp_filename, filename)
+        return received
+
+    if compression == 'gzip':
+        output = gzip.open(tmp_filename, 'wb')
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Для сжатия в .zst требуется пакет zstandard")
+        output = zstandard.ZstdCompressor().stream_writer(open(tmp_filename, 'wb'), closefd=True)
+    else:
+        output = open(tmp_filename, 'ab' if response.status_code == 206 else 'wb')
+
+    with output:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if stopped():
+                break
+            if chunk:
+                output.write(chunk)
+                received += len(chunk)
+                if progress_bar is not None:
+                    progress_bar.update(len(chunk))
+    if stopped():
+        if compression or content_encoding not in ('', 'identity'):
+            os.remove(tmp_filename)
+        else:
+            save_checkpoint(response, filename)
+        raise DownloadInterrupted(filename)
+    os.replace(tmp_filename, filename)
+    clear_checkpoint(filename)
+    return received
@@ -0,0 +1,394 @@
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from urllib3.util.retry import Retry
+from profiling import profiler
+
+# Границы корзин гистограмм времени, с
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Metric:
+    """Метрика с метками; значения хранятся по кортежу значений меток"""
+
+    kind = None
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.lock = registry.lock
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def get_key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+    def to_dict(self):
+        with self.lock:
+            return {','.join(key) or 'value': value for key, value in sorted(self.values.items())}
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Текущее значение; можно задать функцию, которая вычисляет его в момент выгрузки"""
+
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        super().__init__(registry, name, help_text, labelnames)
+        self.functions = {}
+        self.peaks = {}
+
+    def set(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = value
+            self.peaks[key] = max(self.peaks.get(key, value), value)
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            value = self.values.get(key, 0) + amount
+            self.values[key] = value
+            self.peaks[key] = max(self.peaks.get(key, value), value)
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """Значение берется из function() при каждой выгрузке (например, длина очереди)"""
+        with self.lock:
+            self.functions[self.get_key(labels)] = function
+
+    def collect(self):
+        with self.lock:
+            functions = list(self.functions.items())
+        for key, function in functions:
+            try:
+                self.set(function(), **dict(zip(self.labelnames, key)))
+            except Exception:
+                # Источник значения мог уже закрыться (например, очередь остановленного планировщика)
+                pass
+
+    def render(self):
+        self.collect()
+        return super().render()
+
+    def to_dict(self):
+        self.collect()
+        with self.lock:
+            return {','.join(key) or 'value': {'value': value, 'peak': self.peaks.get(key, value)}
+                    for key, value in sorted(self.values.items())}
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def get_quantile(self, state, quantile):
+        """Оценка квантиля по верхней границе корзины"""
+        target = quantile * state['count']
+        for bound, count in zip(self.buckets, state['buckets']):
+            if count >= target:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted((key, dict(state, buckets=list(state['buckets']))) for key, state in self.values.items())
+        for key, state in items:
+            for bound, count in zip(self.buckets, state['buckets']):
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, {'le': bound})} {count}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, {'le': '+Inf'})} {state['count']}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {state['sum']}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+    def to_dict(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return {
+            ','.join(key) or 'value': {
+                'count': state['count'],
+                'mean': state['sum'] / state['count'] if state['count'] else None,
+                'p50': self.get_quantile(state, 0.5),
+                'p95': self.get_quantile(state, 0.95),
+            }
+            for key, state in items
+        }
+
+class Registry:
+    """Набор метрик процесса с выгрузкой в формате Prometheus и в JSON"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.started_at = time.time()
+
+    def register(self, cls, name, help_text, labelnames=(), **kwargs):
+        if name not in self.metrics:
+            self.metrics[name] = cls(self, name, help_text, labelnames, **kwargs)
+        return self.metrics[name]
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def render(self):
+        """Текст в формате Prometheus exposition"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Пишет метрики в файл для textfile collector (атомарно, через временный файл)"""
+        tmp_path = f"{path}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def get_summary(self):
+        """Итоговая сводка: сырые метрики плюс производные показатели"""
+        raw = {name: metric.to_dict() for name, metric in self.metrics.items()}
+        summary = {'uptime_seconds': round(time.time() - self.started_at, 1), 'hosts': {}, 'cache_hit_ratio': {}}
+
+        seconds = raw.get('knm_download_seconds_total', {})
+        for host, total_bytes in raw.get('knm_download_bytes_total', {}).items():
+            host_seconds = seconds.get(host, 0)
+            summary['hosts'][host] = {
+                'bytes': total_bytes,
+                'seconds': round(host_seconds, 3),
+                'bytes_per_second': round(total_bytes / host_seconds) if host_seconds else None,
+            }
+
+        lookups = {}
+        for key, count in raw.get('knm_cache_lookups_total', {}).items():
+            cache, result = key.split(',')
+            lookups.setdefault(cache, {}).setdefault(result, 0)
+            lookups[cache][result] += count
+        for cache, results in lookups.items():
+            total = sum(results.values())
+            summary['cache_hit_ratio'][cache] = round(results.get('hit', 0) / total, 3) if total else None
+
+        statuses = raw.get('knm_http_responses_total', {})
+        summary['throttled_429'] = sum(count for key, count in statuses.items() if key.endswith(',429'))
+        summary['server_errors_5xx'] = sum(count for key, count in statuses.items() if key.split(',')[-1].startswith('5'))
+        summary['metrics'] = raw
+        return summary
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.get_summary(), f, indent=2, ensure_ascii=False, default=str)
+
+metrics = Registry()
+
+HTTP_RESPONSES = metrics.counter('knm_http_responses_total', 'Ответы сервера по хосту и коду (error - сетевая ошибка)',
+                                 ('host', 'status'))
+DOWNLOAD_BYTES = metrics.counter('knm_download_bytes_total', 'Скачано байт по хосту', ('host',))
+DOWNLOAD_SECONDS = metrics.counter('knm_download_seconds_total', 'Время скачиваний по хосту, с', ('host',))
+TTFB = metrics.histogram('knm_time_to_first_byte_seconds', 'Время до заголовков ответа, с', ('host',))
+DOWNLOAD_DURATION = metrics.histogram('knm_download_duration_seconds', 'Полное время скачивания файла, с', ('host',))
+IN_FLIGHT = metrics.gauge('knm_downloads_in_flight', 'Скачиваний выполняется сейчас')
+RETRIES = metrics.counter('knm_retries_total', 'Повторные попытки по источнику', ('source',))
+CACHE_LOOKUPS = metrics.counter('knm_cache_lookups_total', 'Обращения к кэшам (hit/miss)', ('cache', 'result'))
+QUEUE_DEPTH = metrics.gauge('knm_queue_depth', 'Длина очередей', ('queue',))
+STAGE_DURATION = metrics.histogram('knm_stage_duration_seconds', 'Время стадий обработки, с', ('stage',))
+
+def record_cache(cache, hit):
+    """Учитывает обращение к кэшу"""
+    CACHE_LOOKUPS.inc(cache=cache, result='hit' if hit else 'miss')
+
+class DownloadTracker:
+    """Замер одного скачивания: TTFB, полное время, байты, код ответа, число одновременных скачиваний
+
+    Создается перед запросом; response() вызывается, когда пришли заголовки,
+    finish() или fail() - ровно один раз в конце.
+    """
+
+    def __init__(self, url):
+        self.host = urlsplit(url).hostname or 'unknown'
+        self.start = time.monotonic()
+        self.done = False
+        IN_FLIGHT.inc()
+
+    def response(self, response):
+        TTFB.observe(time.monotonic() - self.start, host=self.host)
+        HTTP_RESPONSES.inc(host=self.host, status=response.status_code)
+
+    def finish(self, size):
+        if self.done:
+            return
+        self.done = True
+        elapsed = time.monotonic() - self.start
+        IN_FLIGHT.dec()
+        DOWNLOAD_DURATION.observe(elapsed, host=self.host)
+        DOWNLOAD_BYTES.inc(size, host=self.host)
+        DOWNLOAD_SECONDS.inc(elapsed, host=self.host)
+
+    def fail(self, status=None):
+        """Неудачное скачивание; status - код ответа, если ответ с ошибкой не был учтен в response()"""
+        if self.done:
+            return
+        self.done = True
+        IN_FLIGHT.dec()
+        if status is not None:
+            HTTP_RESPONSES.inc(host=self.host, status=status)
+
+class CountingRetry(Retry):
+    """Retry для HTTPAdapter, который учитывает повторы внутри сессии
+
+    Повторы на 429/5xx делает urllib3, и до кода скачивания доходит только
+    последний ответ; здесь учитываются промежуточные ответы и сами повторы.
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        host = getattr(_pool, 'host', None) or 'unknown'
+        HTTP_RESPONSES.inc(host=host, status=response.status if response is not None else 'error')
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        # Сюда доходим, только если попытки не исчерпаны (иначе increment бросает MaxRetryError)
+        RETRIES.inc(source='http')
+        return retry
+
+class StageTimer:
+    """Контекстный менеджер, замеряющий время стадии в knm_stage_duration_seconds
+
+    Заодно открывает span стадии в профилировщике (если включен --profile).
+    Если та же стадия уже открыта в этом потоке (этап конвейера вызывает
+    функцию с @timed той же стадии), вложенный замер не ведется, чтобы время
+    не учитывалось дважды.
+    """
+
+    local = threading.local()
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        open_stages = self.local.__dict__.setdefault('stages', set())
+        self.nested = self.stage in open_stages
+        if self.nested:
+            return self
+        open_stages.add(self.stage)
+        self.span = profiler.span(self.stage)
+        self.span.__enter__()
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.nested:
+            return
+        STAGE_DURATION.observe(time.monotonic() - self.start, stage=self.stage)
+        self.span.__exit__(*exc_info)
+        self.local.stages.discard(self.stage)
+
+def timed(stage):
+    """Декоратор: время каждого вызова функции учитывается как стадия stage"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with StageTimer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def serve(port):
+    """Отдает метрики по http://127.0.0.1:port/metrics"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] == '/metrics':
+                body = metrics.render().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            elif self.path.split('?')[0] == '/summary':
+                body = json.dumps(metrics.get_summary(), ensure_ascii=False, indent=2, default=str).encode('utf-8')
+                content_type = 'application/json; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def add_arguments(parser):
+    """Добавляет в argparse параметры выгрузки метрик"""
+    parser.add_argument('--metrics-file', default=None,
+                        help='Периодически писать метрики в файл в формате Prometheus (textfile collector)')
+    parser.add_argument('--metrics-port', type=int, default=None, help='Отдавать метрики по HTTP на /metrics')
+    parser.add_argument('--metrics-json', default=None, help='Записать JSON сводку метрик при завершении')
+    parser.add_argument('--metrics-interval', type=float, default=15, help='Период записи --metrics-file, с')
+
+def start_from_args(args):
+    """Запускает выгрузку метрик по параметрам из add_arguments; итог пишется при выходе из процесса"""
+    if args.metrics_port:
+        serve(args.metrics_port)
+        print(f"Метрики: http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.metrics_file:
+        def write_periodically():
+            while True:
+                time.sleep(args.metrics_interval)
+                metrics.write_textfile(args.metrics_file)
+
+        threading.Thread(target=write_periodically, daemon=True).start()
+
+    def finish():
+        if args.metrics_file:
+            metrics.write_textfile(args.metrics_file)
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+
+    atexit.register(finish)
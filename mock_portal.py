@@ -0,0 +1,369 @@
+import os
+import io
+import json
+import time
+import random
+import hashlib
+import zipfile
+import argparse
+import threading
+from datetime import datetime
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+LIST_PATHS = {'248': '/blob/erknm-opendata/248/list.xml', 'no248': '/blob/erknm-opendata/list.xml'}
+MONTH_DIRS = {'248': '/blob/erknm-opendata/248/', 'no248': '/blob/erknm-opendata/'}
+XSD_PATH = '/blob/opendata/xsd/structure-20220125.xsd'
+API_PREFIX = '/api/portal/public-open-data/check/'
+CHUNK_SIZE = 16 * 1024
+
+XSD_CONTENT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="data">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="record" type="xs:string" maxOccurs="unbounded"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+"""
+
+def get_kind(path):
+    """Вид файла по пути запроса: list, xml, zip, xsd или api"""
+    if path in LIST_PATHS.values():
+        return 'list'
+    if path.startswith(API_PREFIX):
+        return 'api'
+    return os.path.splitext(path)[1].lstrip('.')
+
+def make_archive(name, size, seed):
+    """ZIP с одним XML файлом примерно заданного размера (без сжатия, чтобы размер был предсказуем)"""
+    rng = random.Random(f"{seed}:{name}")
+    records = []
+    total = 0
+    while total < size:
+        record = f"<record>{rng.getrandbits(256):064x}</record>\n"
+        records.append(record)
+        total += len(record)
+    content = '<?xml version="1.0" encoding="UTF-8"?>\n<data>\n' + ''.join(records) + '</data>\n'
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+        zip_file.writestr(name.replace('.zip', '.xml'), content)
+    return buffer.getvalue()
+
+class MockPortal:
+    """Локальная замена proverki.gov.ru для проверки и замеров скачивания
+
+    Отдает синтетические list.xml обоих наборов, месячные XML, ZIP архивы,
+    общую XSD схему и ответ API со списком архивов за месяц. Поддерживает
+    ETag/If-None-Match, Range/If-Range и HEAD. Задержка перед ответом,
+    ограничение скорости на соединение и доля ответов 429/502 задаются
+    параметрами. Сбой разыгрывается по seed, пути и номеру запроса к этому
+    пути, поэтому сценарий воспроизводим и не зависит от порядка запросов:
+    разные скачивающие скрипты получают на одних и тех же файлах одни и те же
+    сбои. list.xml не сбоит.
+
+    Args:
+        months (int): Сколько месяцев (начиная с start) в каждом наборе
+        archives (int): Архивов в месяце
+        archive_size (int): Примерный размер архива, байт
+        latency (float): Задержка перед заголовками ответа, с
+        bandwidth (int): Скорость на соединение, байт/с; None - без ограничения
+        error_rate (float): Доля ответов 502
+        throttle_rate (float): Доля ответов 429
+        retry_after (int): Значение Retry-After для 429, с
+        start (tuple): (год, месяц) первого месяца
+        seed (int): Seed для содержимого и разыгрывания ошибок
+    """
+
+    def __init__(self, months=3, archives=2, archive_size=256 * 1024, latency=0.0, bandwidth=None,
+                 error_rate=0.0, throttle_rate=0.0, retry_after=1, start=(2021, 1), seed=0):
+        self.months = months
+        self.archives = archives
+        self.archive_size = archive_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.first_month = start
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.base_url = None
+        self.server = None
+        self.files = {}  # Путь -> {'body', 'etag', 'kind'} (содержимое, кроме list.xml и API, строится по base_url)
+        self.reset_stats()
+
+    def iter_months(self):
+        year, month = self.first_month
+        for _ in range(self.months):
+            yield year, month
+            month += 1
+            if month > 12:
+                year, month = year + 1, 1
+
+    def get_archive_names(self, year, month, dataset):
+        # Архивы наборов лежат в одном каталоге месяца, поэтому различаются днем в имени
+        first_day = 15 if dataset == '248' else 1
+        return [f"data-{year}{month:02d}{first_day + i:02d}-structure-20220125.zip" for i in range(self.archives)]
+
+    def add_file(self, path, body):
+        self.files[path] = {
+            'body': body,
+            'etag': f'"{hashlib.sha1(body).hexdigest()[:16]}"',
+            'kind': get_kind(path),
+        }
+
+    def build(self):
+        """Строит содержимое портала; ссылки в XML абсолютные, поэтому вызывается после запуска сервера"""
+        self.files = {}
+        self.add_file(XSD_PATH, XSD_CONTENT)
+        self.listings = {}
+        for dataset in ('248', 'no248'):
+            items = []
+            for i, (year, month) in enumerate(self.iter_months(), 1):
+                month_path = f"{MONTH_DIRS[dataset]}7710146102-inspection-{year}-{month}.xml"
+                archive_links = []
+                for name in self.get_archive_names(year, month, dataset):
+                    archive_path = f"/blob/opendata/{year}/{month}/{name}"
+                    self.add_file(archive_path, make_archive(name, self.archive_size, self.seed))
+                    archive_links.append((archive_path, name))
+                self.listings[(year, month, dataset)] = [
+                    {'fileName': name, 'url': f"{self.base_url}{path}", 'size': len(self.files[path]['body'])}
+                    for path, name in archive_links
+                ]
+                links = [f"{self.base_url}{path}" for path, _ in archive_links] + [f"{self.base_url}{XSD_PATH}"]
+                month_xml = '<?xml version="1.0" encoding="UTF-8"?>\n<list>\n' + ''.join(
+                    f'  <item link="{link}"/>\n' for link in links) + '</list>\n'
+                self.add_file(month_path, month_xml.encode('utf-8'))
+                items.append(f'<item identifier="{i}" title="Проверки на {month:02d}.{year}" '
+                             f'link="{self.base_url}{month_path}" format="xml"/>')
+            list_xml = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?><list><standardversion>'
+                        + ''.join(items) + '</standardversion></list>')
+            self.add_file(LIST_PATHS[dataset], list_xml.encode('utf-8'))
+
+    def get_expected(self, kinds=('xml', 'zip', 'xsd')):
+        """Пути файлов, которые должен получить полный проход скачивания"""
+        return {path for path, info in self.files.items() if info['kind'] in kinds}
+
+    def write_lists(self, base_dir):
+        """Пишет list.xml наборов в <base_dir>/xml/<набор>/list.xml, как их ждут скрипты скачивания"""
+        for dataset, path in LIST_PATHS.items():
+            list_dir = os.path.join(base_dir, 'xml', dataset)
+            os.makedirs(list_dir, exist_ok=True)
+            with open(os.path.join(list_dir, 'list.xml'), 'wb') as f:
+                f.write(self.files[path]['body'])
+
+    def reset_stats(self):
+        """Обнуляет статистику запросов (перед очередным замером)"""
+        with self.lock:
+            self.started_at = time.monotonic()
+            self.stats = {'requests': 0, 'by_status': {}, 'by_kind': {}, 'bytes_sent': 0, 'faults': 0,
+                          'faults_by_kind': {}}
+            self.completed = {}  # Путь -> сколько раз файл отдан целиком
+            self.attempts = {}  # Путь -> сколько раз его запрашивали
+            self.first_archive_at = None
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats, by_status=dict(self.stats['by_status']), by_kind=dict(self.stats['by_kind']),
+                         faults_by_kind=dict(self.stats['faults_by_kind']))
+            stats['completed'] = dict(self.completed)
+            stats['time_to_first_archive'] = (self.first_archive_at - self.started_at
+                                              if self.first_archive_at is not None else None)
+        return stats
+
+    def record(self, path, kind, status, sent=0, complete=False):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['by_status'][str(status)] = self.stats['by_status'].get(str(status), 0) + 1
+            self.stats['by_kind'][kind] = self.stats['by_kind'].get(kind, 0) + 1
+            self.stats['bytes_sent'] += sent
+            if status in (429, 502):
+                self.stats['faults'] += 1
+                self.stats['faults_by_kind'][kind] = self.stats['faults_by_kind'].get(kind, 0) + 1
+            if complete:
+                self.completed[path] = self.completed.get(path, 0) + 1
+                if kind == 'zip' and self.first_archive_at is None:
+                    self.first_archive_at = time.monotonic()
+
+    def pick_fault(self, path, kind):
+        """Разыгрывает сбой для запроса: 429, 502 или None"""
+        if kind == 'list':
+            return None
+        with self.lock:
+            attempt = self.attempts[path] = self.attempts.get(path, 0) + 1
+        roll = random.Random(f"{self.seed}:{path}:{attempt}").random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 502
+        return None
+
+    def get_api_body(self, path, query):
+        """Ответ API за месяц: {'files': [{'fileName', 'url', 'size'}]} или None, если месяца нет"""
+        try:
+            year, month = (int(part) for part in path[len(API_PREFIX):].strip('/').split('/'))
+        except ValueError:
+            return None
+        dataset = '248' if parse_qs(query).get('isFederalLaw248', ['false'])[0] == 'true' else 'no248'
+        files = self.listings.get((year, month, dataset))
+        if files is None:
+            return None
+        return json.dumps({'files': files}, ensure_ascii=False).encode('utf-8')
+
+    def make_handler(self):
+        portal = self
+
+        class PortalHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_HEAD(self):
+                self.handle_request(send_body=False)
+
+            def do_GET(self):
+                self.handle_request(send_body=True)
+
+            def send_empty(self, status, headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def handle_request(self, send_body):
+                parts = urlsplit(self.path)
+                path, kind = parts.path, get_kind(parts.path)
+                if portal.latency:
+                    time.sleep(portal.latency)
+
+                fault = portal.pick_fault(path, kind)
+                if fault is not None:
+                    headers = {'Retry-After': str(portal.retry_after)} if fault == 429 else None
+                    self.send_empty(fault, headers)
+                    portal.record(path, kind, fault)
+                    return
+
+                if kind == 'api':
+                    body = portal.get_api_body(path, parts.query)
+                    info = {'body': body, 'etag': f'"{hashlib.sha1(body).hexdigest()[:16]}"'} if body else None
+                else:
+                    info = portal.files.get(path)
+                if info is None:
+                    self.send_empty(404)
+                    portal.record(path, kind, 404)
+                    return
+
+                body, etag = info['body'], info['etag']
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_empty(304, {'ETag': etag})
+                    portal.record(path, kind, 304)
+                    return
+
+                status, start, end = 200, 0, len(body) - 1
+                range_header = self.headers.get('Range')
+                if_range = self.headers.get('If-Range')
+                if range_header and range_header.startswith('bytes=') and (if_range is None or if_range == etag):
+                    first, _, last = range_header[len('bytes='):].partition('-')
+                    if first.isdigit():
+                        start = int(first)
+                        end = min(int(last), end) if last.isdigit() else end
+                        if start > end:
+                            self.send_empty(416, {'Content-Range': f"bytes */{len(body)}"})
+                            portal.record(path, kind, 416)
+                            return
+                        status = 206
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json' if kind == 'api' else 'application/octet-stream')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', formatdate(0, usegmt=True))
+                self.send_header('Accept-Ranges', 'bytes')
+                if status == 206:
+                    self.send_header('Content-Range', f"bytes {start}-{end}/{len(body)}")
+                self.end_headers()
+                if not send_body:
+                    portal.record(path, kind, status)
+                    return
+
+                sent = 0
+                began = time.monotonic()
+                try:
+                    for offset in range(start, end + 1, CHUNK_SIZE):
+                        chunk = body[offset:min(offset + CHUNK_SIZE, end + 1)]
+                        self.wfile.write(chunk)
+                        sent += len(chunk)
+                        if portal.bandwidth:
+                            delay = sent / portal.bandwidth - (time.monotonic() - began)
+                            if delay > 0:
+                                time.sleep(delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                # Файл получен целиком, если отдан до конца (с учетом докачки по Range)
+                portal.record(path, kind, status, sent, complete=end == len(body) - 1 and sent == end - start + 1)
+
+            def log_message(self, format, *args):
+                pass
+
+        return PortalHandler
+
+    def start(self, port=0, host='127.0.0.1'):
+        """Запускает сервер в отдельном потоке; port=0 - любой свободный порт"""
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.base_url = f"http://{host}:{self.server.server_address[1]}"
+        self.build()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный сервер, имитирующий портал открытых данных proverki.gov.ru')
+    parser.add_argument('--port', type=int, default=8790, help='Порт сервера')
+    parser.add_argument('--months', type=int, default=3, help='Месяцев в каждом наборе')
+    parser.add_argument('--archives', type=int, default=2, help='Архивов в месяце')
+    parser.add_argument('--archive-kb', type=int, default=256, help='Примерный размер архива, КБ')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Задержка перед ответом, мс')
+    parser.add_argument('--bandwidth-kbps', type=float, default=None, help='Скорость на соединение, КБ/с')
+    parser.add_argument('--error-rate', type=float, default=0, help='Доля ответов 502')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='Доля ответов 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After для 429, с')
+    parser.add_argument('--start-year', type=int, default=2021, help='Год первого месяца')
+    parser.add_argument('--start-month', type=int, default=1, help='Первый месяц')
+    parser.add_argument('--seed', type=int, default=0, help='Seed содержимого и сбоев')
+    parser.add_argument('--write-lists', metavar='DIR', default=None,
+                        help='Записать list.xml в DIR/xml/248 и DIR/xml/no248')
+    args = parser.parse_args()
+
+    portal = MockPortal(args.months, args.archives, args.archive_kb * 1024, args.latency_ms / 1000,
+                        int(args.bandwidth_kbps * 1024) if args.bandwidth_kbps else None,
+                        args.error_rate, args.throttle_rate, args.retry_after,
+                        (args.start_year, args.start_month), args.seed)
+    base_url = portal.start(args.port)
+    if args.write_lists:
+        portal.write_lists(args.write_lists)
+        print(f"list.xml записаны в {os.path.join(args.write_lists, 'xml')}")
+    print(f"Портал: {base_url}")
+    for dataset, path in LIST_PATHS.items():
+        print(f"- list.xml ({dataset}): {base_url}{path}")
+    print(f"- API: {base_url}{API_PREFIX}{{год}}/{{месяц}}?isFederalLaw248=true|false")
+    print(f"Файлов: {len(portal.files)}, объем: {sum(len(info['body']) for info in portal.files.values())} байт")
+    try:
+        while True:
+            time.sleep(60)
+            stats = portal.get_stats()
+            print(f"[{datetime.now():%H:%M:%S}] запросов: {stats['requests']}, сбоев: {stats['faults']}, "
+                  f"отдано: {stats['bytes_sent']} байт")
+    except KeyboardInterrupt:
+        portal.stop()
+
+if __name__ == "__main__":
+    main()
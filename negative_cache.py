@@ -0,0 +1,122 @@
+import re
+import time
+import argparse
+from datetime import datetime
+from state_store import StateStore, DEFAULT_STATE_DB
+
+NEGATIVE_NAMESPACE = 'negative'
+
+# Статусы, после которых URL сразу считается отсутствующим
+MISSING_STATUSES = (404, 410)
+
+class NegativeCache:
+    """Негативный кэш URL, которых нет на сервере или которые стабильно отвечают 5xx
+
+    404/410 запоминаются сразу, 5xx - после server_error_threshold ошибок подряд.
+    Пока срок записи не истек, URL не запрашивается. При каждом повторном
+    попадании в кэш срок удваивается (но не больше max_ttl), успешное
+    скачивание удаляет запись.
+
+    Args:
+        store (StateStore): Хранилище состояния
+        ttl (float): Срок для 404/410, с
+        server_error_ttl (float): Срок для повторяющихся 5xx, с
+        server_error_threshold (int): Сколько 5xx подряд нужно, чтобы запомнить URL
+        max_ttl (float): Максимальный срок после удвоений, с
+    """
+
+    def __init__(self, store, ttl=7 * 24 * 3600, server_error_ttl=3600, server_error_threshold=3,
+                 max_ttl=30 * 24 * 3600):
+        self.store = store
+        self.ttl = ttl
+        self.server_error_ttl = server_error_ttl
+        self.server_error_threshold = server_error_threshold
+        self.max_ttl = max_ttl
+        self.skipped = []
+
+    def get(self, url):
+        """Возвращает действующую запись кэша для URL или None"""
+        entry = self.store.get(NEGATIVE_NAMESPACE, url)
+        if entry is None or entry.get('until', 0) <= time.time():
+            return None
+        return entry
+
+    def is_blocked(self, url):
+        """Проверяет, нужно ли пропустить URL; пропущенные URL запоминаются для отчета"""
+        if self.get(url) is None:
+            return False
+        self.skipped.append(url)
+        return True
+
+    def record_failure(self, url, status):
+        """Учитывает неудачный ответ сервера
+
+        Returns:
+            bool: True, если URL теперь в негативном кэше
+        """
+        if status is None or not (status in MISSING_STATUSES or status >= 500):
+            return False
+        now = time.time()
+        entry = self.store.get(NEGATIVE_NAMESPACE, url) or {'hits': 0, 'errors': 0, 'first_seen': datetime.now().isoformat()}
+        entry['status'] = status
+        entry['last_seen'] = datetime.now().isoformat()
+
+        if status in MISSING_STATUSES:
+            ttl = self.ttl
+        else:
+            entry['errors'] += 1
+            if entry['errors'] < self.server_error_threshold:
+                entry['until'] = 0
+                self.store.set(NEGATIVE_NAMESPACE, url, entry)
+                return False
+            ttl = self.server_error_ttl
+
+        entry['hits'] += 1
+        entry['until'] = now + min(self.max_ttl, ttl * 2 ** (entry['hits'] - 1))
+        # Запись хранится дольше срока блокировки, чтобы помнить число попаданий для удвоения
+        self.store.set(NEGATIVE_NAMESPACE, url, entry, ttl=self.max_ttl * 2)
+        return True
+
+    def record_success(self, url):
+        """Удаляет URL из кэша после успешного ответа"""
+        self.store.delete(NEGATIVE_NAMESPACE, url)
+
+    def print_summary(self):
+        """Выводит, сколько URL пропущено по негативному кэшу за запуск"""
+        if self.skipped:
+            print(f"\nПропущено URL по негативному кэшу: {len(self.skipped)}")
+
+def get_error_status(error):
+    """Возвращает HTTP статус из исключения requests или None для сетевых ошибок"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return response.status_code
+    # Когда повторы urllib3 исчерпаны по status_forcelist, ответа в исключении нет, только текст
+    match = re.search(r'too many (\d{3}) error responses', str(error))
+    return int(match.group(1)) if match else None
+
+def main():
+    parser = argparse.ArgumentParser(description='Отчет по негативному кэшу URL (404/410 и повторяющиеся 5xx)')
+    parser.add_argument('--state-db', default=DEFAULT_STATE_DB, help='Файл хранилища состояния')
+    parser.add_argument('--all', action='store_true', help='Показать и записи с истекшим сроком блокировки')
+    parser.add_argument('--clear', action='store_true', help='Очистить негативный кэш')
+    args = parser.parse_args()
+
+    with StateStore(args.state_db) as store:
+        entries = store.items(NEGATIVE_NAMESPACE)
+        now = time.time()
+        active = [(url, entry) for url, entry, _ in entries if entry.get('until', 0) > now]
+        shown = [(url, entry) for url, entry, _ in entries] if args.all else active
+        print(f"URL в негативном кэше: {len(active)} (всего записей: {len(entries)})")
+        for url, entry in sorted(shown, key=lambda item: item[1].get('until', 0)):
+            until = datetime.fromtimestamp(entry['until']).isoformat(timespec='seconds') if entry.get('until') else '-'
+            print(f"  - [{entry.get('status')}] {url}")
+            print(f"    до: {until}, попаданий: {entry['hits']}, ошибок 5xx подряд: {entry['errors']}, "
+                  f"последний раз: {entry['last_seen']}")
+        if args.clear:
+            for url, _, _ in entries:
+                store.delete(NEGATIVE_NAMESPACE, url)
+            print("Негативный кэш очищен")
+
+if __name__ == "__main__":
+    main()
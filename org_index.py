@@ -0,0 +1,275 @@
+import os
+import re
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from collections import defaultdict
+from tqdm import tqdm
+from repack_zstd import open_archive
+from xml_records import find_archives, iter_archive_records, iter_record_elements, flatten_element
+
+SCHEMA_SQL = [
+    """CREATE TABLE IF NOT EXISTS postings (
+        term_type TEXT NOT NULL,
+        term TEXT NOT NULL,
+        archive TEXT NOT NULL,
+        member TEXT NOT NULL,
+        record_offset INTEGER NOT NULL,
+        PRIMARY KEY (term_type, term, archive, member, record_offset)
+    ) WITHOUT ROWID""",
+    """CREATE INDEX IF NOT EXISTS postings_archive ON postings (archive)""",
+    """CREATE TABLE IF NOT EXISTS indexed_archives (
+        archive TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        postings INTEGER NOT NULL,
+        indexed_at TEXT NOT NULL
+    )""",
+]
+
+# Последний компонент пути поля -> тип термина
+FIELD_PATTERNS = [
+    ('inn', re.compile(r'(?:^|_)INN$', re.IGNORECASE)),
+    ('ogrn', re.compile(r'(?:^|_)OGRN(?:IP)?$', re.IGNORECASE)),
+    ('name', re.compile(r'(?:ORG_?NAME|FULL_?NAME|SHORT_?NAME|^NAME$)', re.IGNORECASE)),
+]
+
+LEGAL_FORMS_RE = re.compile(
+    r'\b(?:ооо|оао|зао|пао|ао|ип|нко|ано|гбу|гуп|муп|фгуп|мбу|фгбу|общество с ограниченной ответственностью'
+    r'|акционерное общество|публичное акционерное общество|индивидуальный предприниматель)\b'
+)
+
+def normalize_name(name):
+    """Нормализует название организации для поиска"""
+    name = name.casefold().replace('ё', 'е')
+    name = re.sub(r'[«»"\'`„“”.,()\-]', ' ', name)
+    name = LEGAL_FORMS_RE.sub(' ', name)
+    return ' '.join(name.split())
+
+def normalize_code(value):
+    """Оставляет в ИНН/ОГРН только цифры"""
+    return re.sub(r'\D', '', value)
+
+def normalize_term(term_type, value):
+    """Нормализует значение термина по его типу"""
+    if term_type == 'name':
+        return normalize_name(value)
+    return normalize_code(value)
+
+def extract_terms(record):
+    """Извлекает из записи термины (ИНН, ОГРН, название) для индекса"""
+    terms = set()
+    for key, value in record.items():
+        if not value or not isinstance(value, str):
+            continue
+        # Последний компонент пути без атрибутного префикса и суффикса повторения
+        field = re.sub(r'\[\d+\]$', '', key).replace('@', '/').rsplit('/', 1)[-1]
+        for term_type, pattern in FIELD_PATTERNS:
+            if pattern.search(field):
+                term = normalize_term(term_type, value)
+                if term:
+                    terms.add((term_type, term))
+                break
+    return terms
+
+def connect(db_path, check_same_thread=True):
+    """Открывает базу индекса и создает таблицы при необходимости"""
+    # Пока другой процесс пишет в индекс, ждем освобождения блокировки, а не падаем сразу
+    connection = sqlite3.connect(db_path, isolation_level=None, timeout=60, check_same_thread=check_same_thread)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    for statement in SCHEMA_SQL:
+        connection.execute(statement)
+    return connection
+
+def is_indexed(connection, archive_path):
+    """Проверяет, проиндексирован ли архив в текущем состоянии"""
+    file_stat = os.stat(archive_path)
+    row = connection.execute("SELECT size, mtime_ns FROM indexed_archives WHERE archive = ?",
+                             (os.path.abspath(archive_path),)).fetchone()
+    return row is not None and row == (file_stat.st_size, file_stat.st_mtime_ns)
+
+def index_archive(connection, archive_path, batch_size=5000, record_tag=None):
+    """Индексирует один архив, заменяя его прежние записи в индексе"""
+    archive = os.path.abspath(archive_path)
+    file_stat = os.stat(archive_path)
+    batch = []
+    total = 0
+    connection.execute("BEGIN")
+    try:
+        connection.execute("DELETE FROM postings WHERE archive = ?", (archive,))
+        for member_name, offset, record in iter_archive_records(archive_path, record_tag):
+            for term_type, term in extract_terms(record):
+                batch.append((term_type, term, archive, member_name, offset))
+            if len(batch) >= batch_size:
+                connection.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?, ?, ?)", batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            connection.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?, ?, ?)", batch)
+            total += len(batch)
+        connection.execute("INSERT OR REPLACE INTO indexed_archives VALUES (?, ?, ?, ?, ?)",
+                           (archive, file_stat.st_size, file_stat.st_mtime_ns, total, datetime.now().isoformat()))
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    return total
+
+class IndexWriter:
+    """Общий писатель индекса для нескольких потоков разбора
+
+    В SQLite одновременно пишет только одно соединение, поэтому потоки не
+    открывают свои транзакции на весь архив, а передают пакеты записей
+    индекса через одно соединение под блокировкой; каждый пакет - короткая
+    транзакция. Архив отмечается проиндексированным после последнего пакета,
+    так что прерванный архив при следующем запуске индексируется заново.
+    """
+
+    def __init__(self, db_path, batch_size=5000):
+        self.connection = connect(db_path, check_same_thread=False)
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+
+    def write(self, statements):
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                for sql, rows in statements:
+                    self.connection.executemany(sql, rows)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def index_records(self, archive_path, records):
+        """Индексирует записи архива, уже разобранные вызывающим, и возвращает их дальше
+
+        Args:
+            archive_path (str): Путь к архиву
+            records: Записи из iter_archive_records
+
+        Yields:
+            tuple: Те же (имя файла в архиве, номер записи, запись)
+        """
+        archive = os.path.abspath(archive_path)
+        file_stat = os.stat(archive_path)
+        # Отметка о прежней индексации снимается вместе со старыми записями: если разбор
+        # прервется, архив не будет считаться проиндексированным с неполными записями
+        self.write([("DELETE FROM postings WHERE archive = ?", [(archive,)]),
+                    ("DELETE FROM indexed_archives WHERE archive = ?", [(archive,)])])
+        batch = []
+        total = 0
+        for member_name, offset, record in records:
+            for term_type, term in extract_terms(record):
+                batch.append((term_type, term, archive, member_name, offset))
+            if len(batch) >= self.batch_size:
+                self.write([("INSERT OR IGNORE INTO postings VALUES (?, ?, ?, ?, ?)", batch)])
+                total += len(batch)
+                batch = []
+            yield member_name, offset, record
+        total += len(batch)
+        self.write([
+            ("INSERT OR IGNORE INTO postings VALUES (?, ?, ?, ?, ?)", batch),
+            ("INSERT OR REPLACE INTO indexed_archives VALUES (?, ?, ?, ?, ?)",
+             [(archive, file_stat.st_size, file_stat.st_mtime_ns, total, datetime.now().isoformat())]),
+        ])
+
+    def close(self):
+        self.connection.close()
+
+def build_index(data_dir="data", db_path="org_index.db", record_tag=None):
+    """Добавляет в индекс новые и измененные архивы"""
+    connection = connect(db_path)
+    try:
+        archives = [a for a in find_archives(data_dir) if not is_indexed(connection, a)]
+        print(f"Архивов для индексации: {len(archives)}")
+        total = 0
+        for archive_path in tqdm(archives, desc="Индексация", unit="архив"):
+            try:
+                total += index_archive(connection, archive_path, record_tag=record_tag)
+            except Exception as e:
+                tqdm.write(f"✗ Ошибка при индексации {archive_path}: {str(e)}")
+        print(f"Добавлено записей индекса: {total}")
+    finally:
+        connection.close()
+
+def find_postings(connection, term_type, value):
+    """Находит положения записей по термину: {(архив, файл): [номера записей]}"""
+    term = normalize_term(term_type, value)
+    rows = connection.execute(
+        "SELECT archive, member, record_offset FROM postings WHERE term_type = ? AND term = ?",
+        (term_type, term)
+    ).fetchall()
+    postings = defaultdict(list)
+    for archive, member, offset in rows:
+        postings[(archive, member)].append(offset)
+    return postings
+
+def read_records(archive_path, member_name, offsets, record_tag=None):
+    """Читает из файла архива только записи с указанными номерами
+
+    Разбор файла прекращается сразу после последней нужной записи, а
+    остальные записи не преобразуются в словари.
+    """
+    wanted = set(offsets)
+    last = max(wanted)
+    with open_archive(archive_path) as zip_ref:
+        with zip_ref.open(member_name) as member:
+            for offset, elem in enumerate(iter_record_elements(member, record_tag)):
+                if offset in wanted:
+                    yield offset, flatten_element(elem)
+                if offset >= last:
+                    break
+
+def lookup(db_path, term_type, value, record_tag=None):
+    """Возвращает все записи об организации по ИНН, ОГРН или названию"""
+    connection = connect(db_path)
+    try:
+        postings = find_postings(connection, term_type, value)
+    finally:
+        connection.close()
+    for (archive, member), offsets in sorted(postings.items()):
+        if not os.path.exists(archive):
+            continue
+        for offset, record in read_records(archive, member, offsets, record_tag):
+            yield {'archive': archive, 'member': member, 'offset': offset, 'record': record}
+
+def main():
+    parser = argparse.ArgumentParser(description='Индекс организаций (ИНН/ОГРН/название) по архивам проверок')
+    parser.add_argument('--db', default='org_index.db', help='Файл индекса')
+    parser.add_argument('--record-tag', default=None, help='Имя тега записи')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Добавить в индекс новые архивы')
+    build_parser.add_argument('--data-dir', default='data', help='Директория с архивами')
+
+    lookup_parser = subparsers.add_parser('lookup', help='Найти проверки организации')
+    group = lookup_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--inn', help='ИНН')
+    group.add_argument('--ogrn', help='ОГРН')
+    group.add_argument('--name', help='Название организации')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_index(args.data_dir, args.db, args.record_tag)
+        return
+
+    if args.inn:
+        term_type, value = 'inn', args.inn
+    elif args.ogrn:
+        term_type, value = 'ogrn', args.ogrn
+    else:
+        term_type, value = 'name', args.name
+
+    found = 0
+    for result in lookup(args.db, term_type, value, args.record_tag):
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + '\n')
+        found += 1
+    print(f"Найдено записей: {found}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import os
+import queue
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from tqdm import tqdm
+from download_xml_files import create_session, download_file, normalize_filename
+from process_xml_files import (find_latest_xml_files, get_target_directory, extract_links_from_xml,
+                               check_file_integrity, download_with_rate_limit, extract_date_from_filename)
+from xml_records import iter_archive_records
+from manifest_storage import find_manifest, open_manifest
+from retention import DiskSpaceGuard, RetentionPolicy
+import metrics
+import profiling
+from metrics import StageTimer
+
+# Маркер завершения работы этапа
+_STOP = object()
+
+class InFlightBudget:
+    """Ограничивает количество и суммарный объем файлов между скачиванием и разбором"""
+
+    def __init__(self, max_items=8, max_bytes=2 * 1024 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.items = 0
+        self.bytes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Ждет, пока в работе не освободится место для нового файла"""
+        with self.condition:
+            while self.items >= self.max_items or self.bytes >= self.max_bytes:
+                self.condition.wait()
+            self.items += 1
+
+    def add_bytes(self, size):
+        """Учитывает объем скачанного файла"""
+        with self.condition:
+            self.bytes += size
+
+    def release(self, size=0):
+        """Освобождает место после окончания обработки файла"""
+        with self.condition:
+            self.items -= 1
+            self.bytes -= size
+            self.condition.notify_all()
+
+class WorkItem:
+    """Файл, проходящий через этапы конвейера"""
+
+    def __init__(self, url, target_path, source_xml):
+        self.url = url
+        self.target_path = target_path
+        self.source_xml = source_xml
+        self.size = 0
+        self.records = 0
+
+class Pipeline:
+    """Конвейер скачивание -> проверка -> распаковка и разбор с ограниченными очередями
+
+    Каждый этап работает в своих потоках и передает файлы следующему через
+    очередь ограниченного размера, поэтому сеть, диск и процессор заняты
+    одновременно, а память и объем файлов в работе остаются ограниченными.
+    """
+
+    def __init__(self, base_dir=".", download_workers=3, parse_workers=2, queue_size=16,
+                 max_in_flight=8, max_bytes_in_flight=2 * 1024 * 1024 * 1024,
+                 force_update=False, sink=None, space_guard=None):
+        self.base_dir = base_dir
+        self.data_base_dir = os.path.join(base_dir, "data")
+        self.xsd_base_dir = os.path.join(base_dir, "xsd")
+        self.download_workers = download_workers
+        self.parse_workers = parse_workers
+        self.force_update = force_update
+        self.sink = sink
+        self.space_guard = space_guard
+        self.budget = InFlightBudget(max_in_flight, max_bytes_in_flight)
+
+        self.manifest_queue = queue.Queue(maxsize=queue_size)
+        self.download_queue = queue.Queue(maxsize=queue_size)
+        self.verify_queue = queue.Queue(maxsize=queue_size)
+        self.parse_queue = queue.Queue(maxsize=queue_size)
+
+        self.local = threading.local()
+        self.seen_urls = set()
+        self.stats_lock = threading.Lock()
+        self.stats = {'manifests': 0, 'downloaded': 0, 'existing': 0, 'failed': 0,
+                      'deferred': 0, 'invalid': 0, 'parsed': 0, 'records': 0}
+        self.pbar = None
+
+    def get_session(self):
+        """Возвращает сессию текущего потока"""
+        if not hasattr(self.local, 'session'):
+            self.local.session = create_session()
+        return self.local.session
+
+    def count(self, key, value=1):
+        """Увеличивает счетчик статистики"""
+        with self.stats_lock:
+            self.stats[key] += value
+        if self.pbar is not None:
+            self.pbar.set_postfix(self.stats, refresh=False)
+
+    def produce_manifests(self, list_xml_paths):
+        """Этап 0: скачивает новые месячные XML из list.xml и отдает их на разбор ссылок"""
+        try:
+            for xml_file in find_latest_xml_files(self.base_dir):
+                self.manifest_queue.put(xml_file)
+
+            for list_xml_path in list_xml_paths:
+                if not os.path.exists(list_xml_path):
+                    continue
+                data_dir = os.path.join(os.path.dirname(list_xml_path), "data")
+                root = ET.parse(list_xml_path).getroot()
+                for item in root.findall(".//item"):
+                    link = item.get('link')
+                    if not link or not link.endswith('.xml'):
+                        continue
+                    xml_filename = os.path.join(data_dir, normalize_filename(os.path.basename(link)))
+                    if find_manifest(xml_filename):
+                        continue
+                    if download_file(link, xml_filename, self.get_session(), verbose=False) is True:
+                        self.manifest_queue.put(xml_filename)
+        finally:
+            self.manifest_queue.put(_STOP)
+
+    def extract_links(self):
+        """Этап 1: извлекает ссылки на архивы и XSD из месячных XML"""
+        try:
+            while True:
+                xml_file = self.manifest_queue.get()
+                if xml_file is _STOP:
+                    break
+                try:
+                    with open_manifest(xml_file) as xml_stream:
+                        root = ET.parse(xml_stream).getroot()
+                except ET.ParseError as e:
+                    tqdm.write(f"✗ Ошибка при парсинге {xml_file}: {str(e)}")
+                    continue
+                target_dir = get_target_directory(os.path.basename(xml_file), xml_file)
+                if not target_dir:
+                    continue
+                self.count('manifests')
+
+                zip_links, xsd_links = extract_links_from_xml(root)
+                items = [
+                    WorkItem(link, os.path.join(self.data_base_dir, target_dir, os.path.basename(link)), xml_file)
+                    for link in zip_links
+                ]
+                items.extend(
+                    WorkItem(link, os.path.join(self.xsd_base_dir, os.path.basename(link)), xml_file)
+                    for link in xsd_links
+                )
+                # Сначала самые свежие выгрузки
+                items.sort(key=lambda item: extract_date_from_filename(os.path.basename(item.url)) or '', reverse=True)
+                for item in items:
+                    if item.url in self.seen_urls:
+                        continue
+                    self.seen_urls.add(item.url)
+                    if self.pbar is not None:
+                        self.pbar.total += 1
+                        self.pbar.refresh()
+                    self.download_queue.put(item)
+        finally:
+            for _ in range(self.download_workers):
+                self.download_queue.put(_STOP)
+
+    def download(self):
+        """Этап 2: скачивает файлы, ожидая освобождения места в бюджете"""
+        while True:
+            item = self.download_queue.get()
+            if item is _STOP:
+                self.verify_queue.put(_STOP)
+                break
+
+            self.budget.acquire()
+            # Файл в бюджете не вытесняется, пока не пройдет проверку и разбор
+            if self.space_guard is not None:
+                self.space_guard.pin(item.target_path)
+            try:
+                with StageTimer('download'):
+                    os.makedirs(os.path.dirname(item.target_path), exist_ok=True)
+                    if self.force_update or not os.path.exists(item.target_path):
+                        if not self.download_item(item):
+                            self.finish(item)
+                            continue
+                        self.count('downloaded')
+                    else:
+                        self.count('existing')
+                    item.size = os.path.getsize(item.target_path)
+                self.budget.add_bytes(item.size)
+                self.verify_queue.put(item)
+            except Exception as e:
+                tqdm.write(f"✗ Ошибка при скачивании {item.url}: {str(e)}")
+                self.count('failed')
+                self.finish(item)
+
+    def download_item(self, item):
+        """Скачивает файл, резервируя место на диске по Content-Length ответа"""
+        result = download_with_rate_limit(item.url, item.target_path, self.get_session(), space_guard=self.space_guard)
+        if result == "deferred":
+            tqdm.write(f"Недостаточно места на диске, скачивание отложено: {os.path.basename(item.url)}")
+            self.count('deferred')
+            return False
+        if not result:
+            self.count('failed')
+            return False
+        return True
+
+    def verify(self):
+        """Этап 3: проверяет целостность скачанных файлов"""
+        stopped = 0
+        while stopped < self.download_workers:
+            item = self.verify_queue.get()
+            if item is _STOP:
+                stopped += 1
+                continue
+            with StageTimer('verify'):
+                valid = check_file_integrity(item.target_path)
+            if valid:
+                self.parse_queue.put(item)
+            else:
+                self.count('invalid')
+                if os.path.exists(item.target_path):
+                    os.remove(item.target_path)
+                self.finish(item)
+        for _ in range(self.parse_workers):
+            self.parse_queue.put(_STOP)
+
+    def parse(self):
+        """Этап 4: потоково распаковывает архив и разбирает записи"""
+        while True:
+            item = self.parse_queue.get()
+            if item is _STOP:
+                break
+            try:
+                if item.target_path.endswith('.zip'):
+                    # Архив разбирается один раз, записи получает sink
+                    with StageTimer('parse'):
+                        records = iter_archive_records(item.target_path)
+                        if self.sink is not None:
+                            item.records = self.sink(item.target_path, records)
+                        else:
+                            item.records = sum(1 for _ in records)
+                    self.count('parsed')
+                    self.count('records', item.records or 0)
+            except Exception as e:
+                tqdm.write(f"✗ Ошибка при разборе {item.target_path}: {str(e)}")
+            finally:
+                self.finish(item)
+
+    def finish(self, item):
+        """Освобождает бюджет и отмечает файл как обработанный"""
+        self.budget.release(item.size)
+        if self.space_guard is not None:
+            self.space_guard.unpin(item.target_path)
+        if self.pbar is not None:
+            self.pbar.update(1)
+
+    def run(self, list_xml_paths=("xml/248/list.xml", "xml/no248/list.xml")):
+        """Запускает все этапы и ждет их завершения"""
+        stages = [threading.Thread(target=self.produce_manifests, args=(list_xml_paths,), name="manifests"),
+                  threading.Thread(target=self.extract_links, name="links"),
+                  threading.Thread(target=self.verify, name="verify")]
+        stages.extend(threading.Thread(target=self.download, name=f"download-{i}") for i in range(self.download_workers))
+        stages.extend(threading.Thread(target=self.parse, name=f"parse-{i}") for i in range(self.parse_workers))
+
+        with tqdm(total=0, desc="Конвейер", unit="файл") as pbar:
+            self.pbar = pbar
+            for stage in stages:
+                stage.daemon = True
+                stage.start()
+            for stage in stages:
+                stage.join()
+            self.pbar = None
+
+        if self.space_guard is not None:
+            self.space_guard.print_summary()
+        print("\nКонвейер завершен:")
+        print(f"- Месячных XML: {self.stats['manifests']}")
+        print(f"- Скачано файлов: {self.stats['downloaded']}")
+        print(f"- Уже было скачано: {self.stats['existing']}")
+        print(f"- Ошибок скачивания: {self.stats['failed']}")
+        print(f"- Отложено из-за нехватки места: {self.stats['deferred']}")
+        print(f"- Поврежденных файлов: {self.stats['invalid']}")
+        print(f"- Разобрано архивов: {self.stats['parsed']}")
+        print(f"- Записей: {self.stats['records']}")
+        return self.stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Конвейер скачивание -> проверка -> распаковка -> разбор')
+    parser.add_argument('--base-dir', default='.', help='Базовая директория')
+    parser.add_argument('--download-workers', type=int, default=3, help='Потоков скачивания')
+    parser.add_argument('--parse-workers', type=int, default=2, help='Потоков разбора')
+    parser.add_argument('--queue-size', type=int, default=16, help='Размер очередей между этапами')
+    parser.add_argument('--max-in-flight', type=int, default=8, help='Максимум файлов между скачиванием и разбором')
+    parser.add_argument('--max-mb-in-flight', type=int, default=2048, help='Максимальный объем файлов в работе, МБ')
+    parser.add_argument('--parquet-dir', default=None, help='Конвертировать разобранные архивы в Parquet')
+    parser.add_argument('--index-db', default=None, help='Добавлять разобранные архивы в индекс организаций')
+    parser.add_argument('--force', action='store_true', help='Перескачать существующие файлы')
+    parser.add_argument('--keep-last', type=int, default=None,
+                        help='Вытеснять при нехватке места архивы сверх последней выгрузки месяца и N самых свежих')
+    parser.add_argument('--reserve-gb', type=float, default=1.0, help='Минимум свободного места на диске, ГБ')
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_from_args(args)
+    profiling.start_from_args(args)
+
+    convert_records = None
+    if args.parquet_dir:
+        from convert_to_parquet import convert_records, pa
+        if pa is None:
+            print("Для конвертации в Parquet требуется пакет pyarrow")
+            return
+
+    index_writer = None
+    if args.index_db:
+        import org_index
+        # Одно соединение на все потоки разбора: SQLite не допускает параллельных писателей
+        index_writer = org_index.IndexWriter(args.index_db)
+
+    sink = None
+    if convert_records is not None or index_writer is not None:
+        def sink(archive_path, records):
+            if index_writer is not None:
+                records = index_writer.index_records(archive_path, records)
+            if convert_records is not None:
+                stats = convert_records(archive_path, records, args.parquet_dir)
+                if stats:
+                    return stats['records']
+            return sum(1 for _ in records)
+
+    policy = RetentionPolicy(args.keep_last) if args.keep_last is not None else None
+    space_guard = DiskSpaceGuard(os.path.join(args.base_dir, "data"), policy, int(args.reserve_gb * 1024 ** 3))
+    pipeline = Pipeline(args.base_dir, args.download_workers, args.parse_workers, args.queue_size,
+                        args.max_in_flight, args.max_mb_in_flight * 1024 * 1024, args.force, sink, space_guard)
+    list_xml_paths = [os.path.join(args.base_dir, "xml", subdir, "list.xml") for subdir in ('248', 'no248')]
+    try:
+        pipeline.run(list_xml_paths)
+    finally:
+        if index_writer is not None:
+            index_writer.close()
+
+if __name__ == "__main__":
+    main()
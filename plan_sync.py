@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from download_xml_files import create_session
+from process_xml_files import (find_latest_xml_files, get_target_directory, extract_links_from_xml,
+                               extract_date_from_filename, get_file_info, download_with_rate_limit,
+                               check_file_integrity)
+from manifest_storage import open_manifest
+from state_store import StateStore, DEFAULT_STATE_DB
+from negative_cache import NegativeCache
+from retention import DiskSpaceGuard, DEFAULT_RESERVE_BYTES
+from check_archives_size import format_size
+from validate_xml import IntegrityCache
+import metrics
+import profiling
+from metrics import CACHE_LOOKUPS, StageTimer
+
+HEAD_NAMESPACE = 'head'
+THROUGHPUT_NAMESPACE = 'throughput'
+DEFAULT_HEAD_TTL = 6 * 3600
+THROUGHPUT_HISTORY = 200
+
+# Лимит скорости одного потока в download_with_rate_limit, если истории еще нет
+DEFAULT_STREAM_RATE = 10 * 1024 * 1024
+
+def collect_candidates(base_dir="."):
+    """Собирает все ZIP и XSD файлы, на которые ссылаются месячные XML
+
+    Returns:
+        list: [{'url', 'target_path', 'source'}] без повторов URL
+    """
+    data_base_dir = os.path.join(base_dir, "data")
+    xsd_base_dir = os.path.join(base_dir, "xsd")
+    candidates = {}
+    for xml_file in find_latest_xml_files(base_dir):
+        try:
+            with StageTimer('parse'), open_manifest(xml_file) as xml_stream:
+                root = ET.parse(xml_stream).getroot()
+        except ET.ParseError as e:
+            print(f"✗ Ошибка при парсинге {xml_file}: {str(e)}")
+            continue
+        zip_links, xsd_links = extract_links_from_xml(root)
+        xml_basename = os.path.basename(xml_file)
+        target_dir = get_target_directory(xml_basename, xml_file)
+        if target_dir:
+            for link in zip_links:
+                candidates.setdefault(link, {
+                    'url': link,
+                    'target_path': os.path.join(data_base_dir, target_dir, os.path.basename(link)),
+                    'source': xml_basename,
+                })
+        for link in xsd_links:
+            candidates.setdefault(link, {
+                'url': link,
+                'target_path': os.path.join(xsd_base_dir, os.path.basename(link)),
+                'source': xml_basename,
+            })
+    return list(candidates.values())
+
+def head_all(urls, store, max_workers=16, ttl=DEFAULT_HEAD_TTL):
+    """Выполняет HEAD запросы параллельно по keep-alive соединениям, используя кэш
+
+    Returns:
+        tuple: ({url: информация о файле или None}, количество ответов из кэша)
+    """
+    results = {}
+    pending = []
+    for url in urls:
+        cached = store.get(HEAD_NAMESPACE, url)
+        if cached is not None:
+            results[url] = cached
+        else:
+            pending.append(url)
+    cache_hits = len(results)
+
+    local = threading.local()
+
+    def head(url):
+        if not hasattr(local, 'session'):
+            local.session = create_session()
+        return get_file_info(url, local.session)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_url = {executor.submit(head, url): url for url in pending}
+        for future in tqdm(as_completed(future_to_url), total=len(pending), desc="HEAD запросы"):
+            url = future_to_url[future]
+            info = future.result()
+            results[url] = info
+            # Кэшируем только успешные ответы, ошибки переспрашиваем в следующий раз
+            if info is not None and info['status'] == 200:
+                store.set(HEAD_NAMESPACE, url, info, ttl)
+    CACHE_LOOKUPS.inc(cache_hits, cache='head', result='hit')
+    CACHE_LOOKUPS.inc(len(pending), cache='head', result='miss')
+    return results, cache_hits
+
+def get_stream_rate(store):
+    """Средняя скорость одного потока по истории скачиваний, байт/с (или None)"""
+    history = store.items(THROUGHPUT_NAMESPACE, limit=50)
+    total_bytes = sum(value['bytes'] for _, value, _ in history)
+    total_seconds = sum(value['seconds'] for _, value, _ in history)
+    if total_bytes <= 0 or total_seconds <= 0:
+        return None
+    return total_bytes / total_seconds
+
+def record_throughput(store, url, size, seconds):
+    """Сохраняет скорость завершенного скачивания в историю"""
+    if size <= 0 or seconds <= 0:
+        return
+    store.set(THROUGHPUT_NAMESPACE, f"{time.time():.6f} {os.path.basename(url)}",
+              {'bytes': size, 'seconds': seconds})
+    store.trim(THROUGHPUT_NAMESPACE, THROUGHPUT_HISTORY)
+
+def build_plan(base_dir=".", store=None, max_workers=16, force_update=False, ttl=DEFAULT_HEAD_TTL,
+               download_workers=3):
+    """Строит план синхронизации: что скачивать, сколько байт и сколько времени это займет"""
+    candidates = collect_candidates(base_dir)
+    # Сначала самые свежие выгрузки, как при обычном скачивании
+    candidates.sort(key=lambda c: extract_date_from_filename(os.path.basename(c['url'])) or '', reverse=True)
+
+    # URL, которых нет на сервере, не запрашиваем до истечения срока в негативном кэше
+    negative_cache = NegativeCache(store)
+    blocked = [c for c in candidates if negative_cache.is_blocked(c['url'])]
+    candidates = [c for c in candidates if c not in blocked]
+
+    heads, cache_hits = head_all([c['url'] for c in candidates], store, max_workers, ttl)
+    integrity = IntegrityCache(base_dir)
+    items = []
+    skipped = {'present': 0, 'verified': 0, 'negative': len(blocked)}
+    unavailable = []
+    for candidate in candidates:
+        info = heads.get(candidate['url'])
+        if info is None or info['status'] != 200:
+            if info is not None:
+                negative_cache.record_failure(candidate['url'], info['status'])
+            unavailable.append({'url': candidate['url'], 'status': info['status'] if info else None})
+            continue
+        target_path = candidate['target_path']
+        reason = 'force' if force_update else 'missing'
+        if not force_update and os.path.exists(target_path):
+            if integrity.is_verified(target_path):
+                skipped['verified'] += 1
+                continue
+            if info['size'] and os.path.getsize(target_path) == info['size']:
+                skipped['present'] += 1
+                continue
+            reason = 'size_mismatch'
+        items.append({**candidate, **info, 'reason': reason})
+
+    total_bytes = sum(item['size'] for item in items)
+    stream_rate = get_stream_rate(store)
+    rate = (stream_rate or DEFAULT_STREAM_RATE) * max(1, min(download_workers, len(items)))
+    return {
+        'created_at': datetime.now().isoformat(),
+        'base_dir': base_dir,
+        'items': items,
+        'total_bytes': total_bytes,
+        'skipped': skipped,
+        'unavailable': unavailable,
+        'head_cache_hits': cache_hits,
+        'download_workers': download_workers,
+        'rate': rate,
+        'rate_from_history': stream_rate is not None,
+        'estimated_seconds': total_bytes / rate if rate else None,
+    }
+
+def print_plan(plan):
+    """Выводит сводку плана"""
+    print(f"\nПлан синхронизации от {plan['created_at']}:")
+    print(f"- Файлов к скачиванию: {len(plan['items'])}")
+    print(f"- Объем к скачиванию: {format_size(plan['total_bytes'])}")
+    print(f"- Пропущено (уже скачаны, размер совпадает): {plan['skipped']['present']}")
+    print(f"- Пропущено (проверены по кэшу целостности): {plan['skipped']['verified']}")
+    print(f"- Пропущено (в негативном кэше): {plan['skipped'].get('negative', 0)}")
+    print(f"- Недоступно на сервере: {len(plan['unavailable'])}")
+    print(f"- HEAD ответов из кэша: {plan['head_cache_hits']}")
+    source = "по истории скачиваний" if plan['rate_from_history'] else "по лимиту скорости (истории еще нет)"
+    print(f"- Скорость: {format_size(plan['rate'])}/с, {source}")
+    if plan['estimated_seconds'] is not None:
+        minutes, seconds = divmod(int(plan['estimated_seconds']), 60)
+        hours, minutes = divmod(minutes, 60)
+        print(f"- Оценка времени: {hours:d}:{minutes:02d}:{seconds:02d}")
+
+def execute_plan(plan, store, max_workers=None, reserve_bytes=DEFAULT_RESERVE_BYTES):
+    """Скачивает файлы из готового плана без повторных HEAD запросов"""
+    max_workers = max_workers or plan.get('download_workers', 3)
+    space_guard = DiskSpaceGuard(os.path.join(plan['base_dir'], "data"), None, reserve_bytes)
+    integrity = IntegrityCache(plan['base_dir'])
+    local = threading.local()
+    results = {'downloaded': 0, 'present': 0, 'deferred': 0, 'failed': 0, 'invalid': 0}
+    results_lock = threading.Lock()
+
+    def count(key):
+        with results_lock:
+            results[key] += 1
+
+    def run(item):
+        if not hasattr(local, 'session'):
+            local.session = create_session()
+        target_path = item['target_path']
+        # План мог устареть: файл уже скачан другим запуском
+        if item['reason'] != 'force' and os.path.exists(target_path) and os.path.getsize(target_path) == item['size']:
+            count('present')
+            return
+        if not space_guard.acquire(target_path, item['size']):
+            count('deferred')
+            return
+        try:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            start_time = time.time()
+            if not download_with_rate_limit(item['url'], target_path, local.session):
+                count('failed')
+                return
+            record_throughput(store, item['url'], os.path.getsize(target_path), time.time() - start_time)
+        finally:
+            space_guard.release(target_path)
+        # Вердикт сохраняется, чтобы следующий план пропустил файл без повторной проверки
+        is_valid = check_file_integrity(target_path)
+        integrity.record(target_path, is_valid)
+        if is_valid:
+            count('downloaded')
+        else:
+            count('invalid')
+            os.remove(target_path)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run, item) for item in plan['items']]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Выполнение плана"):
+            future.result()
+    integrity.save()
+
+    space_guard.print_summary()
+    print(f"\nИтоги выполнения плана:")
+    print(f"- Скачано: {results['downloaded']}")
+    print(f"- Уже были скачаны: {results['present']}")
+    print(f"- Отложено из-за нехватки места: {results['deferred']}")
+    print(f"- Ошибок скачивания: {results['failed']}")
+    print(f"- Не прошли проверку целостности: {results['invalid']}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='План синхронизации по HEAD запросам и его выполнение')
+    parser.add_argument('--base-dir', default='.', help='Базовая директория')
+    parser.add_argument('--state-db', default=DEFAULT_STATE_DB, help='Файл хранилища состояния')
+    parser.add_argument('--output', '-o', default='plan.json', help='Куда сохранить план')
+    parser.add_argument('--execute', metavar='PLAN', help='Выполнить ранее сохраненный план')
+    parser.add_argument('--head-workers', type=int, default=16, help='Параллельных HEAD запросов')
+    parser.add_argument('--workers', type=int, default=3, help='Потоков скачивания')
+    parser.add_argument('--head-ttl-hours', type=float, default=6, help='Срок хранения HEAD ответов в кэше, ч')
+    parser.add_argument('--reserve-gb', type=float, default=1.0, help='Минимум свободного места на диске, ГБ')
+    parser.add_argument('--force', action='store_true', help='Планировать перескачивание существующих файлов')
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_from_args(args)
+    profiling.start_from_args(args)
+
+    with StateStore(args.state_db) as store:
+        if args.execute:
+            with open(args.execute, 'r', encoding='utf-8') as f:
+                plan = json.load(f)
+            print_plan(plan)
+            execute_plan(plan, store, args.workers, int(args.reserve_gb * 1024 ** 3))
+            return
+
+        plan = build_plan(args.base_dir, store, args.head_workers, args.force,
+                          args.head_ttl_hours * 3600, args.workers)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, indent=2, ensure_ascii=False)
+        print_plan(plan)
+        print(f"\nПлан сохранен в файл: {args.output}")
+        print(f"Для выполнения: python plan_sync.py --execute {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,17 @@ import re
 from tqdm import tqdm
 import json
 from download_xml_files import create_session, download_file, normalize_filename
+from manifest_storage import is_manifest, open_manifest
+from retention import DiskSpaceGuard, RetentionPolicy, DEFAULT_RESERVE_BYTES
+from validate_xml import IntegrityCache
+from events import events, add_arguments as add_event_arguments, configure_from_args
+import metrics
+from metrics import DownloadTracker, StageTimer, timed
+import profiling
 import zipfile
 import requests
 import time
+import argparse
 from threading import Lock
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -15,6 +23,9 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 downloading_files = {}
 downloading_lock = Lock()
 
+# Счетчики стадии process, которые видны в прогресс-барах
+PROGRESS_COUNTERS = ('downloaded', 'existing', 'failed', 'corrupted', 'deferred')
+
 def get_current_year_month():
     """Возвращает текущий год и месяц"""
     now = datetime.now()
@@ -22,39 +33,34 @@ def get_current_year_month():
 
 def find_latest_xml_files(base_dir):
     """Находит все XML файлы в директориях 248/data и no248/data и сортирует их по дате"""
-    print("\nИщем все XML файлы")
     xml_files = []  # Список для хранения путей к файлам и их дат
     
     # Проверяем обе директории
     for subdir in ['248', 'no248']:
         dir_path = os.path.join(base_dir, 'xml', subdir, 'data')
-        print(f"\nПроверяем директорию: {dir_path}")
         
         if not os.path.exists(dir_path):
-            print(f"Директория не найдена: {dir_path}")
+            events.emit('scan', 'dir_missing', 'debug', "Директория не найдена: {path}", path=dir_path)
             continue
         
-        # Выводим все XML файлы в директории
-        files = [f for f in os.listdir(dir_path) if f.endswith('.xml')]
-        print(f"Найдено XML файлов в {subdir}/data: {len(files)}")
+        files = [f for f in os.listdir(dir_path) if is_manifest(f)]
+        events.emit('scan', 'dir', 'debug', "Найдено XML файлов в {subdir}/data: {count}",
+                    subdir=subdir, path=dir_path, count=len(files))
         
         # Добавляем файлы с их датами
         for file in files:
             full_path = os.path.join(dir_path, file)
             date = extract_date_from_xml_filename(file)
             xml_files.append((full_path, date))
-            print(f"  - {file} (дата: {date})")
+            events.emit('scan', 'manifest', 'debug', "  - {file} (дата: {date})", file=file, date=date)
     
     if not xml_files:
-        print("\nНе найдено XML файлов")
+        events.emit('scan', 'empty', 'warning', "Не найдено XML файлов")
         return []
     
     # Сортируем файлы по дате в порядке убывания
     sorted_files = sorted(xml_files, key=lambda x: x[1] if x[1] else '000000', reverse=True)
-    
-    print(f"\nНайдено {len(sorted_files)} файлов, отсортированных по дате:")
-    for file, date in sorted_files:
-        print(f"  - {os.path.basename(file)} (дата: {date})")
+    events.emit('scan', 'found', 'info', "Найдено {count} XML файлов", count=len(sorted_files))
     
     return [file for file, _ in sorted_files]
 
@@ -66,13 +72,10 @@ def get_target_directory(filename, source_dir):
     elif 'xml/no248' in source_dir:
         subdir = 'no248'
     else:
-        print(f"Неизвестная исходная директория: {source_dir}")
+        events.emit('scan', 'unknown_source', 'warning', "Неизвестная исходная директория: {source_dir}",
+                    source_dir=source_dir)
         return None
     
-    print(f"\nОпределение директории для файла: {filename}")
-    print(f"Исходная директория: {source_dir}")
-    print(f"Поддиректория: {subdir}")
-    
     # Определяем тип файла (inspections или plan)
     file_type = 'inspections'  # по умолчанию
     if 'plan' in filename.lower():
@@ -84,14 +87,15 @@ def get_target_directory(filename, source_dir):
         year = year_match.group(1)
         month = year_match.group(2).zfill(2)  # Добавляем ведущий ноль для месяцев < 10
         target_dir = os.path.join(subdir, file_type, f"{year}-{month}")
-        print(f"Найден год и месяц: {year}-{month}")
-        print(f"Тип файла: {file_type}")
-        print(f"Целевая директория: {target_dir}")
+        events.emit('scan', 'target_dir', 'debug', "{file}: целевая директория {target_dir}",
+                    file=filename, source_dir=source_dir, target_dir=target_dir)
         return target_dir
     
-    print(f"Не удалось определить целевую директорию для файла: {filename}")
+    events.emit('scan', 'no_target_dir', 'warning', "Не удалось определить целевую директорию для файла: {file}",
+                file=filename)
     return None
 
+@timed('extract_links')
 def extract_links_from_xml(xml_root):
     """Извлекает все ссылки на ZIP и XSD файлы из XML"""
     # Словари для хранения уникальных ссылок с их метаданными
@@ -162,58 +166,73 @@ def extract_links_from_xml(xml_root):
     
     return sorted_zip_links, sorted_xsd_links
 
+@timed('verify')
 def check_file_integrity(file_path):
     """Проверяет целостность файла"""
     if not os.path.exists(file_path):
-        print(f"Файл не существует: {file_path}")
+        events.emit('verify', 'missing', 'debug', "Файл не существует: {file}", file=file_path)
         return False
-        
+    
+    basename = os.path.basename(file_path)
     # Для ZIP файлов проверяем целостность архива
     if file_path.endswith('.zip'):
         try:
-            print(f"\nПроверка целостности ZIP файла: {os.path.basename(file_path)}")
             with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                # Получаем список файлов в архиве
-                file_list = zip_ref.namelist()
-                print(f"Файлов в архиве: {len(file_list)}")
-                
                 # Проверяем целостность всех файлов в архиве
                 bad_file = zip_ref.testzip()
                 if bad_file is None:
-                    print("✓ ZIP файл цел")
+                    events.emit('verify', 'ok', 'debug', "✓ ZIP файл цел: {file} (файлов в архиве: {members})",
+                                file=basename, members=len(zip_ref.infolist()))
                     return True
                 else:
-                    print(f"✗ Обнаружен поврежденный файл в архиве: {bad_file}")
+                    events.emit('verify', 'corrupted', 'error', "Обнаружен поврежденный файл в архиве {file}: {member}",
+                                file=basename, member=bad_file)
                     return False
         except zipfile.BadZipFile:
-            print("✗ ZIP файл поврежден или имеет неверный формат")
+            events.emit('verify', 'bad_zip', 'error', "ZIP файл поврежден или имеет неверный формат: {file}", file=basename)
             return False
         except Exception as e:
-            print(f"✗ Ошибка при проверке ZIP файла: {str(e)}")
+            events.emit('verify', 'error', 'error', "Ошибка при проверке ZIP файла {file}: {error}",
+                        file=basename, error=str(e))
             return False
     
     # Для остальных файлов проверяем, что файл не пустой
     try:
         size = os.path.getsize(file_path)
         if size > 0:
-            print(f"✓ Файл существует и не пуст (размер: {size} байт)")
+            events.emit('verify', 'ok', 'debug', "✓ Файл существует и не пуст: {file} ({size} байт)",
+                        file=basename, size=size)
             return True
         else:
-            print("✗ Файл пуст")
+            events.emit('verify', 'empty', 'error', "Файл пуст: {file}", file=basename)
             return False
     except Exception as e:
-        print(f"✗ Ошибка при проверке файла: {str(e)}")
+        events.emit('verify', 'error', 'error', "Ошибка при проверке файла {file}: {error}", file=basename, error=str(e))
         return False
 
-def get_file_size(url, session):
-    """Получает размер файла по URL"""
+def get_file_info(url, session):
+    """Получает по HEAD запросу статус, размер и валидаторы файла
+
+    Returns:
+        dict: {'status', 'size', 'etag', 'last_modified'} или None при сетевой ошибке
+    """
     try:
         response = session.head(url, allow_redirects=True)
-        if response.status_code == 200:
-            return int(response.headers.get('content-length', 0))
+        return {
+            'status': response.status_code,
+            'size': int(response.headers.get('content-length', 0)) if response.status_code == 200 else 0,
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+        }
     except Exception as e:
-        print(f"Ошибка при получении размера файла {url}: {str(e)}")
-    return 0
+        events.emit('download', 'head_error', 'warning', "Ошибка при получении размера файла {url}: {error}",
+                    url=url, error=str(e))
+    return None
+
+def get_file_size(url, session):
+    """Получает размер файла по URL"""
+    info = get_file_info(url, session)
+    return info['size'] if info else 0
 
 def is_file_downloading(url):
     """Проверяет, скачивается ли файл в данный момент"""
@@ -228,12 +247,21 @@ def mark_file_downloading(url, is_downloading=True):
         else:
             downloading_files.pop(url, None)
 
-def download_with_rate_limit(url, target_path, session, chunk_size=8192, rate_limit=10*1024*1024):
-    """Скачивает файл с ограничением скорости"""
+@timed('download')
+def download_with_rate_limit(url, target_path, session, chunk_size=8192, rate_limit=10*1024*1024, space_guard=None):
+    """Скачивает файл с ограничением скорости
+
+    Если передан space_guard, место под файл резервируется по Content-Length
+    ответа до записи на диск, без отдельного HEAD запроса. Если места нет,
+    соединение закрывается и возвращается "deferred".
+    """
+    tracker = None
+    reserved = False
     try:
         # Проверяем, не скачивается ли уже этот файл
         if is_file_downloading(url):
-            print(f"Файл {os.path.basename(url)} уже скачивается в другом потоке")
+            events.emit('download', 'busy', 'warning', "Файл {file} уже скачивается в другом потоке",
+                        file=os.path.basename(url))
             return False
 
         # Отмечаем файл как скачиваемый
@@ -248,10 +276,18 @@ def download_with_rate_limit(url, target_path, session, chunk_size=8192, rate_li
             'Connection': 'keep-alive'
         }
 
+        tracker = DownloadTracker(url)
         response = session.get(url, stream=True, headers=headers)
+        tracker.response(response)
         response.raise_for_status()
         
         total_size = int(response.headers.get('content-length', 0))
+        if space_guard is not None:
+            if not space_guard.acquire(target_path, total_size):
+                response.close()
+                tracker.fail()
+                return "deferred"
+            reserved = True
         downloaded = 0
         start_time = time.time()
         
@@ -271,39 +307,64 @@ def download_with_rate_limit(url, target_path, session, chunk_size=8192, rate_li
                         if elapsed < expected_time:
                             time.sleep(expected_time - elapsed)
         
+        tracker.finish(downloaded)
         return True
     except Exception as e:
-        print(f"Ошибка при скачивании {url}: {str(e)}")
+        # Код ответа не учитываем: он уже учтен в response() или в CountingRetry.increment
+        if tracker is not None:
+            tracker.fail()
+        events.emit('download', 'error', 'warning', "Ошибка при скачивании {url}: {error}", url=url, error=str(e))
         if os.path.exists(target_path):
             os.remove(target_path)
         return False
     finally:
+        if reserved:
+            space_guard.release(target_path)
         # Освобождаем файл
         mark_file_downloading(url, False)
 
-def download_and_check_file(file_info):
-    """Функция для скачивания и проверки одного файла"""
+def download_and_check_file(file_info, space_guard=None, integrity=None):
+    """Функция для скачивания и проверки одного файла
+
+    Вердикты проверки сохраняются в integrity (IntegrityCache), если он передан.
+    """
     url, target_path, session, force_update = file_info
     basename = os.path.basename(url)
     
     # Проверяем существование и целостность файла, если не требуется принудительное обновление
     if not force_update and os.path.exists(target_path):
-        print(f"\nПроверка существующего файла: {basename}")
-        if check_file_integrity(target_path):
+        if integrity is not None and integrity.is_verified(target_path):
+            events.emit('process', 'existing', 'debug', "Пропущен файл (уже скачан и цел): {file}", file=basename)
+            return f"Пропущен файл (уже скачан и цел): {basename}", True
+        is_valid = check_file_integrity(target_path)
+        if integrity is not None:
+            integrity.record(target_path, is_valid)
+        if is_valid:
+            events.emit('process', 'existing', 'debug', "Пропущен файл (уже скачан и цел): {file}", file=basename)
             return f"Пропущен файл (уже скачан и цел): {basename}", True
         else:
-            print(f"Файл поврежден, будет перескачан: {basename}")
+            events.emit('process', 'redownload', 'warning', "Файл поврежден, будет перескачан: {file}", file=basename)
     
     # Скачиваем файл с ограничением скорости
-    result = download_with_rate_limit(url, target_path, session)
+    result = download_with_rate_limit(url, target_path, session, space_guard=space_guard)
+    if result == "deferred":
+        events.emit('process', 'deferred', 'warning', "Недостаточно места на диске, скачивание отложено: {file}",
+                    file=basename)
+        return f"Недостаточно места на диске, скачивание отложено: {basename}", False
     if result:
         # Проверяем целостность скачанного файла
-        print(f"\nПроверка скачанного файла: {basename}")
-        if check_file_integrity(target_path):
+        is_valid = check_file_integrity(target_path)
+        if integrity is not None:
+            integrity.record(target_path, is_valid)
+        if is_valid:
+            events.emit('process', 'downloaded', 'debug', "✓ Файл успешно скачан и проверен: {file}", file=basename)
             return f"✓ Файл успешно скачан и проверен: {basename}", True
         else:
+            events.emit('process', 'corrupted', 'error', "Файл скачан, но проверка целостности не пройдена: {file}",
+                        file=basename)
             return f"✗ Файл скачан, но проверка целостности не пройдена: {basename}", False
     else:
+        events.emit('process', 'failed', 'error', "Ошибка при скачивании файла: {file}", file=basename, url=url)
         return f"✗ Ошибка при скачивании файла: {basename}", False
 
 def extract_date_from_filename(filename):
@@ -324,12 +385,18 @@ def extract_date_from_xml_filename(filename):
         return f"{year}{month}"
     return None
 
-def process_single_xml(xml_file, data_base_dir, xsd_base_dir, force_update=False):
-    """Обрабатывает один XML файл и скачивает связанные файлы"""
+def process_single_xml(xml_file, data_base_dir, xsd_base_dir, force_update=False, space_guard=None, integrity=None):
+    """Обрабатывает один XML файл и скачивает связанные файлы
+
+    Args:
+        space_guard (DiskSpaceGuard): Если задан, место под файл резервируется по
+            Content-Length ответа до записи
+        integrity (IntegrityCache): Куда сохранять вердикты проверки целостности, а не поместившиеся файлы откладываются
+    """
     try:
-        print(f"\nОбработка XML файла: {xml_file}")
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
+        events.emit('process', 'manifest_start', 'debug', "Обработка XML файла: {file}", file=xml_file)
+        with StageTimer('parse'), open_manifest(xml_file) as xml_stream:
+            root = ET.parse(xml_stream).getroot()
         zip_links, xsd_links = extract_links_from_xml(root)
         
         # Создаем отдельную сессию для каждого потока
@@ -340,7 +407,8 @@ def process_single_xml(xml_file, data_base_dir, xsd_base_dir, force_update=False
         xml_basename = os.path.basename(xml_file)
         target_dir = get_target_directory(xml_basename, xml_file)
         if not target_dir:
-            print(f"\nПропущен файл {xml_basename}: не удалось определить целевую директорию")
+            events.emit('process', 'manifest_skipped', 'debug', "Пропущен файл {file}: не удалось определить целевую директорию",
+                        file=xml_basename)
             return 0
         
         # Создаем полный путь к целевой директории
@@ -369,38 +437,49 @@ def process_single_xml(xml_file, data_base_dir, xsd_base_dir, force_update=False
         files_to_download.sort(key=lambda x: x[2] if x[2] else '00000000', reverse=True)
         
         total_files = len(files_to_download)
-        print(f"\nВ файле {xml_basename} найдено {len(zip_links)} ZIP и {len(xsd_links)} XSD файлов")
+        events.emit('process', 'links', 'debug', "В файле {file} найдено {zip} ZIP и {xsd} XSD файлов",
+                    file=xml_basename, zip=len(zip_links), xsd=len(xsd_links))
         
         # Создаем прогресс-бар для файлов текущего XML
         with tqdm(total=total_files, desc=f"Файлы из {xml_basename}", position=1, leave=False) as file_pbar:
             # Скачиваем файлы из текущего XML
             for i, (url, target_path, date) in enumerate(files_to_download, 1):
                 try:
-                    print(f"\nСкачивание файла {i} из {total_files} в {xml_basename}: {os.path.basename(url)}")
-                    print(f"URL: {url}")
-                    print(f"Сохраняем в: {target_path}")
-                    print(f"Дата файла: {date}")
-                    print(f"Источник: {xml_basename}")
-                    message, success = download_and_check_file((url, target_path, session, force_update))
-                    print(f"{message}")
+                    events.emit('process', 'file_start', 'debug', "Скачивание файла {index} из {total} в {source}: {url}",
+                                index=i, total=total_files, source=xml_basename, url=url, target=target_path, date=date)
+                    # Файл не вытесняется, пока скачивается и проверяется
+                    if space_guard is not None:
+                        space_guard.pin(target_path)
+                    try:
+                        message, success = download_and_check_file((url, target_path, session, force_update),
+                                                                   space_guard, integrity)
+                    finally:
+                        if space_guard is not None:
+                            space_guard.unpin(target_path)
+                    file_pbar.set_postfix_str(events.format_counters('process', PROGRESS_COUNTERS), refresh=False)
                     file_pbar.update(1)
                 except Exception as e:
-                    print(f"Ошибка при скачивании {url}: {str(e)}")
+                    events.emit('process', 'error', 'error', "Ошибка при скачивании {url}: {error}", url=url, error=str(e))
                     continue
         
-        print(f"\nЗавершена обработка файла {xml_basename}")
+        events.emit('process', 'manifest_done', 'info', "Завершена обработка файла {file} ({total} файлов)",
+                    file=xml_basename, total=total_files)
         return total_files
         
     except Exception as e:
-        print(f"Ошибка при обработке XML файла {xml_file}: {str(e)}")
+        events.emit('process', 'manifest_error', 'error', "Ошибка при обработке XML файла {file}: {error}",
+                    file=xml_file, error=str(e))
         return 0
 
-def process_xml_files(base_dir=".", force_update=False):
+def process_xml_files(base_dir=".", force_update=False, keep_last=None, reserve_bytes=DEFAULT_RESERVE_BYTES):
     """Обрабатывает XML файлы и скачивает связанные файлы
     
     Args:
         base_dir (str): Базовая директория для скачивания файлов
         force_update (bool): Если True, то файлы будут перескачаны даже если они уже существуют
+        keep_last (int): Если задан, при нехватке места вытесняются архивы, не защищенные
+            политикой "последняя выгрузка месяца плюс keep_last самых свежих"
+        reserve_bytes (int): Место на диске, которое всегда остается свободным
     """
     # Создаем базовые директории для данных
     data_base_dir = os.path.join(base_dir, "data")
@@ -418,13 +497,18 @@ def process_xml_files(base_dir=".", force_update=False):
     
     print(f"\nНайдено {len(latest_files)} XML файлов для обработки")
     
+    policy = RetentionPolicy(keep_last) if keep_last is not None else None
+    space_guard = DiskSpaceGuard(data_base_dir, policy, reserve_bytes)
+    integrity = IntegrityCache(base_dir)
+    
     # Создаем прогресс-бар для XML файлов
     with tqdm(total=len(latest_files), desc="Обработка XML файлов", position=0) as xml_pbar:
         # Обрабатываем XML файлы в трех потоках
         with ThreadPoolExecutor(max_workers=3) as executor:
             # Создаем список задач
             future_to_xml = {
-                executor.submit(process_single_xml, xml_file, data_base_dir, xsd_base_dir, force_update): xml_file 
+                executor.submit(process_single_xml, xml_file, data_base_dir, xsd_base_dir, force_update, space_guard,
+                                integrity): xml_file 
                 for xml_file in latest_files
             }
             
@@ -435,13 +519,32 @@ def process_xml_files(base_dir=".", force_update=False):
                 try:
                     files_processed = future.result()
                     total_files_processed += files_processed
-                    xml_pbar.update(1)
                 except Exception as e:
-                    print(f"Ошибка при обработке {xml_file}: {str(e)}")
-                    xml_pbar.update(1)
+                    events.emit('process', 'manifest_error', 'error', "Ошибка при обработке {file}: {error}",
+                                file=xml_file, error=str(e))
+                xml_pbar.set_postfix_str(events.format_counters('process', PROGRESS_COUNTERS), refresh=False)
+                xml_pbar.update(1)
     
+    integrity.save()
     print(f"\nЗавершена обработка всех XML файлов")
     print(f"Всего скачано файлов: {total_files_processed}")
+    space_guard.print_summary()
+    events.print_summary()
+
+def main():
+    parser = argparse.ArgumentParser(description='Скачивание ZIP и XSD файлов по месячным XML')
+    parser.add_argument('--keep-last', type=int, default=None,
+                        help='Вытеснять при нехватке места архивы сверх последней выгрузки месяца и N самых свежих')
+    parser.add_argument('--reserve-gb', type=float, default=1.0, help='Минимум свободного места на диске, ГБ')
+    add_event_arguments(parser)
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    metrics.start_from_args(args)
+    profiling.start_from_args(args)
+    # По умолчанию включаем принудительное обновление
+    process_xml_files(force_update=True, keep_last=args.keep_last, reserve_bytes=int(args.reserve_gb * 1024 ** 3))
 
 if __name__ == "__main__":
-    process_xml_files(force_update=True)  # По умолчанию включаем принудительное обновление 
\ No newline at end of file
+    main() 
\ No newline at end of file
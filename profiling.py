@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import threading
+from collections import defaultdict
+
+MODES = ('spans', 'cprofile', 'sample')
+
+class NullSpan:
+    """Пустой span, когда профилирование выключено"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.profiler.enter(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.exit(self)
+        return False
+
+class Profiler:
+    """Профилирование по стадиям (разбор XML, извлечение ссылок, скачивание, проверка, анализ)
+
+    Каждая стадия оборачивается в span. В режиме spans считаются вызовы, полное
+    и собственное время стадии (без вложенных стадий). В режиме cprofile на
+    время стадии в потоке включается cProfile; при входе во вложенную стадию
+    профиль внешней приостанавливается, так что у каждой стадии свой профиль
+    (<стадия>.pstats для snakeviz, flameprof, gprof2dot). В режиме sample
+    отдельный поток с периодом interval снимает стеки всех потоков, которые
+    находятся внутри стадии, и пишет их в stacks.folded (формат flamegraph.pl
+    и speedscope, первый кадр - стадия).
+
+    Пока профилирование выключено, span() возвращает общий пустой объект,
+    так что стоимость span - одна проверка флага.
+
+    Args:
+        mode (str): spans, cprofile, sample или None - выключено
+        output_dir (str): Куда писать отчеты
+        interval (float): Период снятия стеков в режиме sample, с
+    """
+
+    def __init__(self, mode=None, output_dir="profile", interval=0.005):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.configure(mode, output_dir, interval)
+
+    def configure(self, mode=None, output_dir="profile", interval=0.005):
+        self.enabled = mode is not None
+        self.mode = mode
+        self.output_dir = output_dir
+        self.interval = interval
+        self.started_at = time.perf_counter()
+        self.totals = defaultdict(lambda: {'calls': 0, 'total': 0.0, 'self': 0.0, 'max': 0.0})
+        self.stats = {}
+        self.samples = defaultdict(int)
+        self.stage_samples = defaultdict(int)
+        self.active = {}  # id потока -> стек span этого потока (для потока сэмплирования)
+        self.sampler = None
+        self.sampler_stop = threading.Event()
+        if mode == 'sample':
+            self.sampler = threading.Thread(target=self.sample_loop, daemon=True)
+            self.sampler.start()
+
+    def span(self, stage):
+        """Контекстный менеджер для стадии stage"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, stage)
+
+    def get_stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+            with self.lock:
+                self.active[threading.get_ident()] = stack
+        return stack
+
+    def enter(self, span):
+        stack = self.get_stack()
+        span.child_time = 0.0
+        span.profile = None
+        if self.mode == 'cprofile':
+            if stack and stack[-1].profile is not None:
+                stack[-1].profile.disable()
+            span.profile = cProfile.Profile()
+            try:
+                span.profile.enable()
+            except ValueError:
+                # В этом потоке уже работает другой профилировщик
+                span.profile = None
+        span.start = time.perf_counter()
+        stack.append(span)
+
+    def exit(self, span):
+        elapsed = time.perf_counter() - span.start
+        stack = self.local.stack
+        stack.pop()
+        if span.profile is not None:
+            span.profile.disable()
+            with self.lock:
+                if span.stage in self.stats:
+                    self.stats[span.stage].add(span.profile)
+                else:
+                    self.stats[span.stage] = pstats.Stats(span.profile)
+            if stack and stack[-1].profile is not None:
+                stack[-1].profile.enable()
+        if stack:
+            stack[-1].child_time += elapsed
+        with self.lock:
+            totals = self.totals[span.stage]
+            totals['calls'] += 1
+            totals['total'] += elapsed
+            totals['self'] += elapsed - span.child_time
+            totals['max'] = max(totals['max'], elapsed)
+
+    def sample_loop(self):
+        """Поток сэмплирования: раз в interval снимает стеки потоков, находящихся в стадиях"""
+        own_id = threading.get_ident()
+        while not self.sampler_stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                active = [(thread_id, [span.stage for span in stack]) for thread_id, stack in self.active.items()
+                          if stack and thread_id != own_id]
+            for thread_id, stages in active:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ';'.join(stages + calls[::-1])
+                with self.lock:
+                    self.samples[key] += 1
+                    self.stage_samples[stages[-1]] += 1
+
+    def get_breakdown(self):
+        """Время по стадиям: вызовы, полное и собственное время, доля от времени работы"""
+        wall = time.perf_counter() - self.started_at
+        with self.lock:
+            totals = {stage: dict(values) for stage, values in self.totals.items()}
+            stage_samples = dict(self.stage_samples)
+        breakdown = {'wall_seconds': round(wall, 3), 'mode': self.mode, 'stages': {}}
+        for stage, values in sorted(totals.items(), key=lambda item: -item[1]['self']):
+            breakdown['stages'][stage] = {
+                'calls': values['calls'],
+                'total_seconds': round(values['total'], 4),
+                'self_seconds': round(values['self'], 4),
+                'mean_seconds': round(values['total'] / values['calls'], 6),
+                'max_seconds': round(values['max'], 4),
+                'self_share': round(values['self'] / wall, 4) if wall else None,
+            }
+            if self.mode == 'sample':
+                breakdown['stages'][stage]['samples'] = stage_samples.get(stage, 0)
+        return breakdown
+
+    def write_reports(self):
+        """Пишет отчеты в output_dir и выводит разбивку по стадиям"""
+        if not self.enabled:
+            return
+        if self.sampler is not None:
+            self.sampler_stop.set()
+            self.sampler.join()
+        os.makedirs(self.output_dir, exist_ok=True)
+        breakdown = self.get_breakdown()
+        with open(os.path.join(self.output_dir, "stages.json"), 'w', encoding='utf-8') as f:
+            json.dump(breakdown, f, indent=2, ensure_ascii=False)
+
+        if self.mode == 'cprofile':
+            for stage, stats in self.stats.items():
+                stats.dump_stats(os.path.join(self.output_dir, f"{stage}.pstats"))
+        if self.mode == 'sample':
+            with open(os.path.join(self.output_dir, "stacks.folded"), 'w', encoding='utf-8') as f:
+                for key, count in sorted(self.samples.items()):
+                    f.write(f"{key} {count}\n")
+
+        # Доли считаются от времени работы процесса, при нескольких потоках их сумма может превышать 100%
+        print(f"\nПрофиль по стадиям (время работы {breakdown['wall_seconds']:.2f} с):")
+        for stage, values in breakdown['stages'].items():
+            share = f"{values['self_share'] * 100:.1f}%" if values['self_share'] is not None else '-'
+            print(f"- {stage}: вызовов {values['calls']}, всего {values['total_seconds']:.3f} с, "
+                  f"собственное {values['self_seconds']:.3f} с ({share}), макс. {values['max_seconds']:.3f} с")
+        print(f"Отчеты сохранены в {self.output_dir}")
+
+# Общий профилировщик процесса; main() скриптов включает его через start_from_args
+profiler = Profiler()
+
+def span(stage):
+    """Span стадии в общем профилировщике"""
+    return profiler.span(stage)
+
+def add_arguments(parser):
+    """Добавляет в argparse параметры профилирования"""
+    parser.add_argument('--profile', nargs='?', const='spans', choices=MODES, default=None,
+                        help='Профилировать стадии: spans - только время, cprofile - cProfile по стадиям, '
+                             'sample - сэмплирование стеков для flamegraph')
+    parser.add_argument('--profile-dir', default='profile', help='Каталог отчетов профилирования')
+    parser.add_argument('--profile-interval', type=float, default=5, help='Период сэмплирования, мс')
+
+def start_from_args(args):
+    """Включает профилирование по параметрам из add_arguments; отчеты пишутся при выходе из процесса"""
+    if args.profile is None:
+        return
+    profiler.configure(args.profile, args.profile_dir, args.profile_interval / 1000)
+    atexit.register(profiler.write_reports)
@@ -0,0 +1,299 @@
+import os
+import json
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+from repack_zstd import open_archive
+from xml_records import find_archives, get_archive_partition, extract_snapshot_date
+import org_index
+
+class LRUCache:
+    """Потокобезопасный LRU кэш ответов в памяти"""
+
+    def __init__(self, max_entries=1024, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Возвращает значение и помечает его как недавно использованное"""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, etag, body):
+        """Добавляет значение, вытесняя самые старые записи"""
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[key] = (etag, body)
+            self.size += len(body)
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+class DiskCache:
+    """Кэш ответов на диске: тело и ETag в отдельных файлах"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def get(self, key, etag):
+        """Возвращает тело ответа, если сохраненный ETag совпадает"""
+        path = self._path(key)
+        try:
+            with open(f"{path}.etag", 'r', encoding='utf-8') as f:
+                if f.read() != etag:
+                    return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key, etag, body):
+        """Атомарно сохраняет тело ответа и его ETag"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        with open(f"{path}.etag", 'w', encoding='utf-8') as f:
+            f.write(etag)
+
+def make_etag(*parts):
+    """Строит ETag по состоянию файлов корпуса"""
+    digest = hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+def file_signature(path):
+    """Возвращает (размер, время изменения) файла"""
+    file_stat = os.stat(path)
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+class CorpusService:
+    """Чтение корпуса: список месяцев, содержимое архивов, записи и поиск организаций"""
+
+    def __init__(self, data_dir="data", index_db="org_index.db"):
+        self.data_dir = os.path.abspath(data_dir)
+        self.index_db = index_db
+
+    def archive_path(self, dataset, record_type, month, archive):
+        """Возвращает путь к архиву, не выходящий за пределы директории данных"""
+        path = os.path.abspath(os.path.join(self.data_dir, dataset, record_type, month, archive))
+        if not path.startswith(self.data_dir + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def months(self):
+        """Список месяцев с архивами; ETag зависит от состояния всех архивов"""
+        archives = find_archives(self.data_dir)
+        signature = tuple((path, file_signature(path)) for path in archives)
+
+        def build():
+            months = {}
+            for path in archives:
+                partition = get_archive_partition(path)
+                if partition is None:
+                    continue
+                entry = months.setdefault(partition, {
+                    'dataset': partition[0], 'type': partition[1], 'month': partition[2], 'archives': []
+                })
+                entry['archives'].append({
+                    'name': os.path.basename(path),
+                    'snapshot': extract_snapshot_date(path),
+                    'size': os.path.getsize(path),
+                })
+            return [months[key] for key in sorted(months)]
+        return make_etag('months', signature), build
+
+    def members(self, archive_path):
+        """Список XML файлов архива"""
+        etag = make_etag('members', archive_path, file_signature(archive_path))
+
+        def build():
+            with open_archive(archive_path) as zip_ref:
+                return [
+                    {'name': info.filename, 'size': info.file_size,
+                     'compressed_size': info.compress_size, 'crc': info.CRC}
+                    for info in zip_ref.infolist() if not info.is_dir()
+                ]
+        return etag, build
+
+    def record(self, archive_path, member, offset):
+        """Одна запись по номеру"""
+        etag = make_etag('record', archive_path, file_signature(archive_path), member, offset)
+
+        def build():
+            for _, record in org_index.read_records(archive_path, member, [offset]):
+                return record
+            return None
+        return etag, build
+
+    def org_etag(self, params):
+        """ETag поиска зависит от состояния индекса"""
+        # Индекс открыт в режиме WAL: новые записи лежат в -wal до контрольной точки,
+        # поэтому без его подписи клиенты получали бы 304 на устаревший результат
+        try:
+            wal_signature = file_signature(f"{self.index_db}-wal")
+        except FileNotFoundError:
+            wal_signature = None
+        return make_etag('orgs', sorted(params.items()), file_signature(self.index_db), wal_signature)
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов только на чтение"""
+
+    protocol_version = 'HTTP/1.1'
+    service = None
+    memory_cache = None
+    disk_cache = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, etag=None):
+        """Отправляет готовый JSON ответ"""
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        """Отправляет ошибку в формате JSON"""
+        self.send_json(status, json.dumps({'error': message}, ensure_ascii=False).encode('utf-8'))
+
+    def not_modified(self, etag):
+        """Отвечает 304, если у клиента актуальная версия"""
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return True
+        return False
+
+    def send_cached(self, key, etag, build):
+        """Отдает ответ из кэша в памяти, кэша на диске или строит его заново"""
+        if self.not_modified(etag):
+            return
+        cached = self.memory_cache.get(key)
+        if cached is not None and cached[0] == etag:
+            self.send_json(200, cached[1], etag)
+            return
+        body = self.disk_cache.get(key, etag)
+        if body is None:
+            value = build()
+            if value is None:
+                self.send_error_json(404, 'Не найдено')
+                return
+            body = json.dumps(value, ensure_ascii=False, default=str).encode('utf-8')
+            self.disk_cache.put(key, etag, body)
+        self.memory_cache.put(key, etag, body)
+        self.send_json(200, body, etag)
+
+    def send_stream(self, etag, lines):
+        """Отправляет большой результат построчно (JSONL, chunked)"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        for line in lines:
+            chunk = (json.dumps(line, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+            self.wfile.write(f"{len(chunk):X}\r\n".encode('ascii') + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        parts = [unquote(p) for p in parsed.path.strip('/').split('/') if p]
+        try:
+            if parts == ['health']:
+                self.send_json(200, b'{"status": "ok"}')
+            elif parts == ['months']:
+                etag, build = self.service.months()
+                self.send_cached('months', etag, build)
+            elif len(parts) == 6 and parts[0] == 'archives' and parts[5] == 'members':
+                archive_path = self.service.archive_path(*parts[1:5])
+                if archive_path is None:
+                    self.send_error_json(404, 'Архив не найден')
+                    return
+                etag, build = self.service.members(archive_path)
+                self.send_cached(parsed.path, etag, build)
+            elif len(parts) >= 7 and parts[0] == 'records':
+                # Имя файла в архиве может содержать поддиректории
+                archive_path = self.service.archive_path(*parts[1:5])
+                if archive_path is None or not parts[-1].isdigit():
+                    self.send_error_json(404, 'Запись не найдена')
+                    return
+                etag, build = self.service.record(archive_path, '/'.join(parts[5:-1]), int(parts[-1]))
+                self.send_cached(parsed.path, etag, build)
+            elif parts == ['orgs']:
+                params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                term = next(((t, params[t]) for t in ('inn', 'ogrn', 'name') if params.get(t)), None)
+                if term is None:
+                    self.send_error_json(400, 'Укажите inn, ogrn или name')
+                    return
+                if not os.path.exists(self.service.index_db):
+                    self.send_error_json(503, 'Индекс организаций не построен')
+                    return
+                etag = self.service.org_etag(params)
+                if self.not_modified(etag):
+                    return
+                self.send_stream(etag, org_index.lookup(self.service.index_db, *term))
+            else:
+                self.send_error_json(404, 'Неизвестный адрес')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except KeyError:
+            self.send_error_json(404, 'Файл не найден в архиве')
+
+def create_server(host="127.0.0.1", port=8080, data_dir="data", index_db="org_index.db",
+                  cache_dir=".query_cache", max_entries=1024):
+    """Создает HTTP сервер поверх локального корпуса"""
+    handler = type('Handler', (RequestHandler,), {
+        'service': CorpusService(data_dir, index_db),
+        'memory_cache': LRUCache(max_entries),
+        'disk_cache': DiskCache(cache_dir),
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный HTTP сервис только для чтения поверх скачанного корпуса')
+    parser.add_argument('--host', default='127.0.0.1', help='Адрес')
+    parser.add_argument('--port', type=int, default=8080, help='Порт')
+    parser.add_argument('--data-dir', default='data', help='Директория с архивами')
+    parser.add_argument('--index-db', default='org_index.db', help='Индекс организаций')
+    parser.add_argument('--cache-dir', default='.query_cache', help='Директория кэша ответов')
+    parser.add_argument('--cache-entries', type=int, default=1024, help='Размер кэша в памяти')
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.data_dir, args.index_db, args.cache_dir, args.cache_entries)
+    print(f"Сервис запущен: http://{args.host}:{args.port}/")
+    print("Адреса: /months, /archives/<248|no248>/<тип>/<месяц>/<архив>/members,")
+    print("        /records/<248|no248>/<тип>/<месяц>/<архив>/<файл>/<номер>, /orgs?inn=|ogrn=|name=")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nСервис остановлен")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
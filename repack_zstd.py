@@ -0,0 +1,286 @@
+import io
+import os
+import json
+import struct
+import bisect
+import zipfile
+import argparse
+from tqdm import tqdm
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Расширение перепакованных архивов и сигнатура в конце файла
+REPACKED_EXTENSION = '.zst'
+FOOTER_MAGIC = b'KNMZSTD1'
+FOOTER = struct.Struct('<8sQ')
+
+DEFAULT_FRAME_SIZE = 4 * 1024 * 1024
+
+class ArchiveMember:
+    """Описание файла внутри перепакованного архива (совместимо с zipfile.ZipInfo)"""
+
+    def __init__(self, entry):
+        self.filename = entry['name']
+        self.file_size = entry['size']
+        self.compress_size = sum(frame[1] for frame in entry['frames'])
+        self.CRC = entry['crc']
+        self.frames = entry['frames']
+        # Смещения начала каждого кадра в распакованных данных для поиска через bisect
+        self.frame_starts = [frame[2] for frame in entry['frames']]
+
+    def is_dir(self):
+        return self.filename.endswith('/')
+
+class MemberReader(io.RawIOBase):
+    """Поток чтения файла из архива с произвольным доступом по кадрам zstd"""
+
+    def __init__(self, path, member):
+        self.file = open(path, 'rb')
+        self.member = member
+        self.position = 0
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.frame_index = None
+        self.frame_data = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.member.file_size
+        self.position = max(0, offset)
+        return self.position
+
+    def _load_frame(self, index):
+        """Распаковывает кадр, если он еще не в памяти"""
+        if index != self.frame_index:
+            compressed_offset, compressed_size, _, _ = self.member.frames[index]
+            self.file.seek(compressed_offset)
+            self.frame_data = self.decompressor.decompress(self.file.read(compressed_size))
+            self.frame_index = index
+        return self.frame_data
+
+    def readinto(self, buffer):
+        if self.position >= self.member.file_size or not self.member.frames:
+            return 0
+        index = bisect.bisect_right(self.member.frame_starts, self.position) - 1
+        data = self._load_frame(index)
+        start = self.position - self.member.frame_starts[index]
+        chunk = data[start:start + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        super().close()
+
+class SeekableArchive:
+    """Чтение перепакованного архива с интерфейсом, совместимым с zipfile.ZipFile"""
+
+    def __init__(self, path, mode='r'):
+        if zstandard is None:
+            raise RuntimeError("Для чтения перепакованных архивов требуется пакет zstandard")
+        self.path = path
+        with open(path, 'rb') as f:
+            f.seek(-FOOTER.size, io.SEEK_END)
+            magic, index_offset = FOOTER.unpack(f.read(FOOTER.size))
+            if magic != FOOTER_MAGIC:
+                raise zipfile.BadZipFile(f"{path} не является перепакованным архивом")
+            f.seek(index_offset)
+            index_size = os.path.getsize(path) - FOOTER.size - index_offset
+            self.index = json.loads(f.read(index_size).decode('utf-8'))
+        self.members = [ArchiveMember(entry) for entry in self.index['members']]
+        self.members_by_name = {member.filename: member for member in self.members}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def infolist(self):
+        return list(self.members)
+
+    def namelist(self):
+        return [member.filename for member in self.members]
+
+    def getinfo(self, name):
+        return self.members_by_name[name]
+
+    def open(self, name, mode='r'):
+        """Открывает файл архива для потокового чтения с произвольным доступом"""
+        member = name if isinstance(name, ArchiveMember) else self.members_by_name[name]
+        return io.BufferedReader(MemberReader(self.path, member), buffer_size=256 * 1024)
+
+    def read(self, name):
+        with self.open(name) as f:
+            return f.read()
+
+    def testzip(self):
+        """Проверяет, что все кадры распаковываются (аналог ZipFile.testzip)"""
+        for member in self.members:
+            try:
+                with self.open(member) as f:
+                    while f.read(DEFAULT_FRAME_SIZE):
+                        pass
+            except zstandard.ZstdError:
+                return member.filename
+        return None
+
+    def extractall(self, path):
+        """Распаковывает все файлы в директорию"""
+        for member in self.members:
+            target = os.path.join(path, member.filename)
+            if member.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target) or path, exist_ok=True)
+            with self.open(member) as source, open(target, 'wb') as f:
+                while True:
+                    chunk = source.read(DEFAULT_FRAME_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+
+def is_repacked(path):
+    """Проверяет, является ли файл перепакованным архивом"""
+    return path.endswith(REPACKED_EXTENSION)
+
+def open_archive(path):
+    """Открывает ZIP или перепакованный архив с одинаковым интерфейсом чтения"""
+    if is_repacked(path):
+        return SeekableArchive(path)
+    return zipfile.ZipFile(path, 'r')
+
+def repack_archive(zip_path, output_path, frame_size=DEFAULT_FRAME_SIZE, level=3):
+    """Перепаковывает ZIP в контейнер из независимых кадров zstd с индексом смещений
+
+    Файлы читаются через zipfile, который сверяет CRC каждого файла, поэтому
+    поврежденный архив не будет перепакован.
+    """
+    compressor = zstandard.ZstdCompressor(level=level, write_content_size=True)
+    tmp_path = f"{output_path}.part"
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    members = []
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref, open(tmp_path, 'wb') as out:
+            for info in zip_ref.infolist():
+                entry = {'name': info.filename, 'size': info.file_size, 'crc': info.CRC, 'frames': []}
+                if not info.is_dir():
+                    uncompressed_offset = 0
+                    with zip_ref.open(info) as source:
+                        while True:
+                            chunk = source.read(frame_size)
+                            if not chunk:
+                                break
+                            frame = compressor.compress(chunk)
+                            # [смещение кадра, размер кадра, смещение в распакованных данных, размер]
+                            entry['frames'].append([out.tell(), len(frame), uncompressed_offset, len(chunk)])
+                            out.write(frame)
+                            uncompressed_offset += len(chunk)
+                members.append(entry)
+
+            index_offset = out.tell()
+            index = {
+                'source': os.path.basename(zip_path),
+                'source_size': os.path.getsize(zip_path),
+                'frame_size': frame_size,
+                'members': members,
+            }
+            out.write(json.dumps(index, ensure_ascii=False).encode('utf-8'))
+            out.write(FOOTER.pack(FOOTER_MAGIC, index_offset))
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output_path
+
+def get_repacked_path(zip_path, data_dir, output_dir):
+    """Путь перепакованного архива в зеркальной структуре директорий"""
+    relative = os.path.relpath(zip_path, data_dir)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + REPACKED_EXTENSION)
+
+def is_up_to_date(zip_path, output_path):
+    """Перепакованная копия существует и не старше исходного ZIP"""
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(zip_path)
+
+def prefer_repacked(archives, data_dir, output_dir="repacked"):
+    """Заменяет ZIP архивы актуальными перепакованными копиями
+
+    Копия ищется в зеркальной структуре output_dir (см. get_repacked_path) и
+    рядом с ZIP (перепаковка в ту же директорию). Перепакованные архивы из
+    списка, у которых есть исходный ZIP, отбрасываются, чтобы каждый архив
+    встречался один раз.
+
+    Args:
+        archives (list): Пути к архивам (из find_archives)
+        data_dir (str): Директория исходных архивов
+        output_dir (str): Директория перепакованных архивов
+
+    Returns:
+        list: Пути к архивам для чтения через open_archive
+    """
+    sources = {os.path.splitext(path)[0] for path in archives if path.endswith('.zip')}
+    result = []
+    for path in archives:
+        if is_repacked(path):
+            if os.path.splitext(path)[0] not in sources:
+                result.append(path)
+            continue
+        candidates = (get_repacked_path(path, data_dir, output_dir), os.path.splitext(path)[0] + REPACKED_EXTENSION)
+        result.append(next((candidate for candidate in candidates if is_up_to_date(path, candidate)), path))
+    return result
+
+def repack_all(data_dir="data", output_dir="repacked", frame_size=DEFAULT_FRAME_SIZE, level=3):
+    """Перепаковывает все архивы, для которых нет актуальной перепакованной копии"""
+    from xml_records import find_archives
+
+    archives = [path for path in find_archives(data_dir) if path.endswith('.zip')]
+    pending = []
+    for zip_path in archives:
+        output_path = get_repacked_path(zip_path, data_dir, output_dir)
+        if is_up_to_date(zip_path, output_path):
+            continue
+        pending.append((zip_path, output_path))
+
+    print(f"Архивов: {len(archives)}, требуют перепаковки: {len(pending)}")
+    repacked = 0
+    for zip_path, output_path in tqdm(pending, desc="Перепаковка", unit="архив"):
+        try:
+            repack_archive(zip_path, output_path, frame_size, level)
+            repacked += 1
+        except (zipfile.BadZipFile, OSError) as e:
+            tqdm.write(f"✗ Архив не перепакован (поврежден?) {zip_path}: {str(e)}")
+    print(f"Перепаковано архивов: {repacked}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Перепаковка проверенных ZIP архивов в формат zstd с произвольным доступом')
+    parser.add_argument('--data-dir', default='data', help='Директория с исходными архивами')
+    parser.add_argument('--output-dir', default='repacked', help='Директория для перепакованных архивов')
+    parser.add_argument('--frame-mb', type=int, default=4, help='Размер кадра zstd, МБ')
+    parser.add_argument('--level', type=int, default=3, help='Уровень сжатия zstd')
+    args = parser.parse_args()
+
+    if zstandard is None:
+        print("Для перепаковки требуется пакет zstandard")
+        return
+    repack_all(args.data_dir, args.output_dir, args.frame_mb * 1024 * 1024, args.level)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import os
+import shutil
+import argparse
+from threading import Lock
+from collections import defaultdict
+from xml_records import find_archives, extract_snapshot_date, get_archive_partition
+from check_archives_size import format_size
+
+# Запас свободного места, который никогда не занимаем скачиванием
+DEFAULT_RESERVE_BYTES = 1024 * 1024 * 1024
+
+def get_last_access(path):
+    """Время последнего обращения к архиву (atime, а если он не обновляется - mtime)"""
+    file_stat = os.stat(path)
+    return max(file_stat.st_atime, file_stat.st_mtime)
+
+def get_month_key(archive_path):
+    """Выгрузка какого месяца и набора данных лежит в архиве
+
+    Месяц берется из раздела data/<248|no248>/<inspections|plan>/YYYY-MM или из даты
+    выгрузки в имени архива, а не из директории: download_data.py складывает все месяцы
+    в одну data/ (и data/248/). Директория остается в ключе только чтобы различать наборы.
+    Архив без даты получает собственный ключ и поэтому всегда защищен.
+    """
+    partition = get_archive_partition(archive_path)
+    if partition is not None:
+        return partition
+    snapshot_date = extract_snapshot_date(archive_path)
+    if snapshot_date is None:
+        return (os.path.abspath(archive_path),)
+    return (os.path.dirname(os.path.abspath(archive_path)), snapshot_date[:6])
+
+class RetentionPolicy:
+    """Политика хранения: последняя выгрузка каждого месяца плюс N самых свежих выгрузок
+
+    Args:
+        keep_last (int): Сколько самых свежих выгрузок хранить сверх последней в каждом месяце
+    """
+
+    def __init__(self, keep_last=0):
+        self.keep_last = keep_last
+
+    def get_protected(self, archives):
+        """Возвращает множество архивов, которые политика запрещает удалять"""
+        protected = set()
+        by_month = defaultdict(list)
+        for archive in archives:
+            by_month[get_month_key(archive)].append(archive)
+        for month_archives in by_month.values():
+            protected.add(max(month_archives, key=lambda path: extract_snapshot_date(path) or ''))
+
+        if self.keep_last > 0:
+            newest = sorted(archives, key=lambda path: extract_snapshot_date(path) or '', reverse=True)
+            protected.update(newest[:self.keep_last])
+        return protected
+
+    def get_candidates(self, data_dir, exclude=()):
+        """Архивы, которые можно удалить, от самых давно не использованных к недавним (LRU)"""
+        archives = find_archives(data_dir)
+        protected = self.get_protected(archives)
+        protected = {os.path.abspath(path) for path in protected}
+        protected.update(os.path.abspath(path) for path in exclude)
+        candidates = [archive for archive in archives if os.path.abspath(archive) not in protected]
+        candidates.sort(key=get_last_access)
+        return candidates
+
+def evict(candidates, bytes_needed=None, dry_run=False):
+    """Удаляет архивы по порядку, пока не освободится bytes_needed (или все, если None)
+
+    Returns:
+        tuple: (список удаленных архивов, освобождено байт)
+    """
+    removed = []
+    freed = 0
+    for archive in candidates:
+        if bytes_needed is not None and freed >= bytes_needed:
+            break
+        try:
+            size = os.path.getsize(archive)
+            if not dry_run:
+                os.remove(archive)
+        except OSError as e:
+            print(f"✗ Не удалось удалить {archive}: {str(e)}")
+            continue
+        removed.append(archive)
+        freed += size
+    return removed, freed
+
+def apply_retention(data_dir="data", keep_last=0, dry_run=False):
+    """Удаляет все архивы, не защищенные политикой хранения"""
+    candidates = RetentionPolicy(keep_last).get_candidates(data_dir)
+    removed, freed = evict(candidates, dry_run=dry_run)
+    action = "Будет удалено" if dry_run else "Удалено"
+    for archive in removed:
+        print(f"  - {archive}")
+    print(f"{action} архивов: {len(removed)}, освобождено: {format_size(freed)}")
+    return removed
+
+class DiskSpaceGuard:
+    """Резервирует место на диске под скачивания до их начала
+
+    Перед скачиванием поток запрашивает место под размер из Content-Length.
+    Если места не хватает, guard сначала вытесняет холодные архивы по политике
+    хранения, а если и это не помогает, скачивание откладывается, чтобы не
+    оборваться на середине с ENOSPC. Уже записанная часть резерва учтена в
+    свободном месте диска, поэтому из него вычитается только недописанная.
+    Файлы, которые скачиваются или ждут проверки и разбора, закрепляются
+    через pin() и не вытесняются.
+
+    Args:
+        data_dir (str): Директория с архивами (на том же диске, что и скачивания)
+        policy (RetentionPolicy): Политика для вытеснения; None - только откладывать
+        reserve_bytes (int): Место, которое всегда остается свободным
+    """
+
+    def __init__(self, data_dir="data", policy=None, reserve_bytes=DEFAULT_RESERVE_BYTES):
+        self.data_dir = data_dir
+        self.policy = policy
+        self.reserve_bytes = reserve_bytes
+        self.reservations = {}  # Абсолютный путь -> полный размер файла
+        self.pinned = defaultdict(int)  # Абсолютный путь -> сколько раз закреплен
+        self.deferred = []
+        self.evicted = []
+        self.lock = Lock()
+
+    @staticmethod
+    def get_unwritten(path, size):
+        """Сколько байт файлу размером size осталось записать поверх уже лежащих на диске"""
+        try:
+            return max(0, size - os.path.getsize(path))
+        except OSError:
+            return size
+
+    def get_free_space(self):
+        """Свободное место с учетом того, что скачивания других потоков еще допишут"""
+        os.makedirs(self.data_dir, exist_ok=True)
+        unwritten = sum(self.get_unwritten(path, size) for path, size in self.reservations.items())
+        return shutil.disk_usage(self.data_dir).free - unwritten - self.reserve_bytes
+
+    def pin(self, path):
+        """Запрещает вытеснять файл, пока он в работе (скачивается, ждет проверки или разбора)"""
+        with self.lock:
+            self.pinned[os.path.abspath(path)] += 1
+
+    def unpin(self, path):
+        with self.lock:
+            key = os.path.abspath(path)
+            self.pinned[key] -= 1
+            if self.pinned[key] <= 0:
+                del self.pinned[key]
+
+    def acquire(self, target_path, size):
+        """Резервирует size байт под файл; возвращает False, если скачивание нужно отложить"""
+        target_path = os.path.abspath(target_path)
+        with self.lock:
+            # Перезаписываемый файл освободит свое место
+            needed = self.get_unwritten(target_path, size)
+            shortage = needed - self.get_free_space()
+            if shortage > 0 and self.policy is not None:
+                candidates = self.policy.get_candidates(
+                    self.data_dir, exclude=[*self.reservations, *self.pinned, target_path])
+                # Не удаляем ничего, если файл не поместится даже после вытеснения всех кандидатов
+                if sum(os.path.getsize(archive) for archive in candidates) >= shortage:
+                    removed, freed = evict(candidates, shortage)
+                    for archive in removed:
+                        print(f"Вытеснен архив для освобождения места: {archive}")
+                    self.evicted.extend(removed)
+                    shortage -= freed
+            if shortage > 0:
+                self.deferred.append((target_path, needed))
+                return False
+            self.reservations[target_path] = size
+            return True
+
+    def release(self, target_path):
+        """Снимает резерв после завершения скачивания (файл уже занимает место сам)"""
+        with self.lock:
+            self.reservations.pop(os.path.abspath(target_path), None)
+
+    def print_summary(self):
+        """Выводит итог по вытесненным архивам и отложенным скачиваниям"""
+        if self.evicted:
+            print(f"\nВытеснено архивов: {len(self.evicted)}")
+        if self.deferred:
+            total = sum(size for _, size in self.deferred)
+            print(f"\nОтложено скачиваний из-за нехватки места: {len(self.deferred)} ({format_size(total)})")
+            for target_path, size in self.deferred:
+                print(f"  - {os.path.basename(target_path)} ({format_size(size)})")
+
+def main():
+    parser = argparse.ArgumentParser(description='Политика хранения архивов выгрузок')
+    parser.add_argument('--data-dir', default='data', help='Директория с архивами')
+    parser.add_argument('--keep-last', type=int, default=None,
+                        help='Сколько самых свежих выгрузок хранить сверх последней в каждом месяце (по умолчанию 0)')
+    parser.add_argument('--free-gb', type=float, default=None,
+                        help='Вместо полной очистки вытеснять холодные архивы, пока не освободится столько ГБ')
+    parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет удалено')
+    parser.add_argument('--apply', action='store_true', help='Удалять архивы с политикой по умолчанию (--keep-last 0)')
+    args = parser.parse_args()
+
+    # Удаление необратимо, поэтому без явно заданной политики разрешен только --dry-run
+    if not args.dry_run and args.keep_last is None and not args.apply:
+        print("✗ Укажите --keep-last N или --apply, чтобы удалить архивы, либо --dry-run для просмотра")
+        return
+    if args.keep_last is None:
+        args.keep_last = 0
+
+    if args.free_gb is None:
+        apply_retention(args.data_dir, args.keep_last, args.dry_run)
+        return
+
+    bytes_needed = int(args.free_gb * 1024 ** 3) - shutil.disk_usage(args.data_dir).free
+    if bytes_needed <= 0:
+        print(f"Свободно уже не меньше {args.free_gb} ГБ")
+        return
+    candidates = RetentionPolicy(args.keep_last).get_candidates(args.data_dir)
+    removed, freed = evict(candidates, bytes_needed, args.dry_run)
+    for archive in removed:
+        print(f"  - {archive}")
+    print(f"Вытеснено архивов: {len(removed)}, освобождено: {format_size(freed)}")
+    if freed < bytes_needed:
+        print(f"✗ Политика хранения не позволяет освободить {format_size(bytes_needed)}")
+
+if __name__ == "__main__":
+    main()
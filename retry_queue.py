@@ -0,0 +1,159 @@
+import time
+import heapq
+import random
+import argparse
+from datetime import datetime
+from state_store import StateStore, DEFAULT_STATE_DB
+from metrics import QUEUE_DEPTH, RETRIES
+
+DEAD_LETTER_NAMESPACE = 'dead_letter'
+
+class RetryQueue:
+    """Очередь повторных попыток для файлов, пропущенных из-за сетевых ошибок
+
+    Пропущенный файл повторяется в конце того же запуска, пока сессия и
+    соединения еще открыты. Задержка растет экспоненциально (с разбросом,
+    чтобы повторы не приходили на сервер одновременно). Файлы, исчерпавшие
+    число попыток, попадают в список недоставленных, который сохраняется
+    в хранилище состояния и переживает перезапуск.
+
+    Args:
+        max_attempts (int): Сколько всего попыток (включая первую) дается файлу
+        base_delay (float): Задержка перед первым повтором, с
+        max_delay (float): Максимальная задержка, с
+        store (StateStore): Хранилище для списка недоставленных; None - только вывод
+    """
+
+    def __init__(self, max_attempts=4, base_delay=2.0, max_delay=120.0, store=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.store = store
+        self.heap = []
+        self.items = {}
+        self.counter = 0
+        self.recovered = []
+        self.dead = []
+        self.failed = []
+        QUEUE_DEPTH.set_function(self.__len__, queue='retry')
+
+    def __len__(self):
+        return len(self.heap)
+
+    def get_delay(self, attempts):
+        """Задержка перед следующей попыткой: половина фиксирована, половина случайна"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def add(self, key, payload, error=None):
+        """Ставит неудавшийся файл на повтор
+
+        Returns:
+            bool: False, если попытки исчерпаны и файл перенесен в недоставленные
+        """
+        item = self.items.setdefault(key, {'payload': payload, 'attempts': 0})
+        item['attempts'] += 1
+        item['error'] = error
+        if item['attempts'] >= self.max_attempts:
+            del self.items[key]
+            self.mark_dead(key, payload, item['attempts'], error)
+            return False
+
+        RETRIES.inc(source='retry_queue')
+        # Счетчик разрешает равные сроки без сравнения ключей
+        self.counter += 1
+        heapq.heappush(self.heap, (time.monotonic() + self.get_delay(item['attempts']), self.counter, key))
+        return True
+
+    def mark_dead(self, key, payload, attempts, error=None):
+        """Переносит файл в список недоставленных"""
+        self.dead.append(key)
+        if self.store is not None:
+            self.store.set(DEAD_LETTER_NAMESPACE, key, {
+                'payload': payload,
+                'attempts': attempts,
+                'error': error,
+                'failed_at': datetime.now().isoformat(),
+            })
+        print(f"✗ Попытки исчерпаны ({attempts}), файл перенесен в недоставленные: {key}")
+
+    def resolve(self, key):
+        """Убирает файл из списка недоставленных после успешного скачивания"""
+        if self.store is not None:
+            self.store.delete(DEAD_LETTER_NAMESPACE, key)
+
+    def drain(self, handler):
+        """Повторяет файлы из очереди по мере наступления их срока, пока очередь не опустеет
+
+        Повторяется только временная неудача ("skip" или исключение). False -
+        файла нет на сервере или URL в негативном кэше: такой файл снимается
+        с повторов сразу и в недоставленные не попадает.
+
+        Args:
+            handler: Функция payload -> True при успехе, "skip" при временной ошибке, False если файла нет
+
+        Returns:
+            int: Сколько файлов удалось скачать при повторе
+        """
+        recovered = 0
+        if self.heap:
+            print(f"\nПовторные попытки для {len(self.heap)} пропущенных файлов...")
+        while self.heap:
+            due, _, key = heapq.heappop(self.heap)
+            wait = due - time.monotonic()
+            if wait > 0:
+                print(f"Повтор через {wait:.1f} с: {key}")
+                time.sleep(wait)
+
+            item = self.items[key]
+            try:
+                result = handler(item['payload'])
+                error = None if result is True else f"результат: {result}"
+            except Exception as e:
+                result = "skip"
+                error = str(e)
+
+            if result is True:
+                del self.items[key]
+                recovered += 1
+                self.recovered.append(key)
+                self.resolve(key)
+                print(f"✓ Скачан при повторе (попытка {item['attempts'] + 1}): {key}")
+            elif result is False:
+                del self.items[key]
+                self.failed.append(key)
+                print(f"✗ Файла нет на сервере (или URL в негативном кэше), повторов не будет: {key}")
+            else:
+                self.add(key, item['payload'], error)
+        return recovered
+
+    def print_summary(self):
+        """Выводит итоги повторов за запуск"""
+        if self.recovered or self.dead or self.failed:
+            print(f"\nПовторные попытки:")
+            print(f"- Скачано при повторе: {len(self.recovered)}")
+            print(f"- Нет на сервере: {len(self.failed)}")
+            print(f"- Перенесено в недоставленные: {len(self.dead)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Список файлов, которые не удалось скачать после всех попыток')
+    parser.add_argument('--state-db', default=DEFAULT_STATE_DB, help='Файл хранилища состояния')
+    parser.add_argument('--clear', action='store_true', help='Очистить список недоставленных')
+    args = parser.parse_args()
+
+    with StateStore(args.state_db) as store:
+        dead_letters = store.items(DEAD_LETTER_NAMESPACE)
+        if not dead_letters:
+            print("Список недоставленных файлов пуст")
+            return
+        print(f"Недоставленных файлов: {len(dead_letters)}")
+        for key, value, _ in dead_letters:
+            print(f"  - {key}")
+            print(f"    попыток: {value['attempts']}, последняя: {value['failed_at']}, ошибка: {value['error']}")
+        if args.clear:
+            for key, _, _ in dead_letters:
+                store.delete(DEAD_LETTER_NAMESPACE, key)
+            print("Список недоставленных очищен")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,533 @@
+import os
+import json
+import time
+import queue
+import shutil
+import argparse
+import itertools
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from tqdm import tqdm
+from download_xml_data import (create_session, download_file, extract_links_from_xml,
+                               extract_date_from_filename, normalize_filename)
+from process_xml_files import check_file_integrity
+from manifest_storage import get_manifest_path, open_manifest
+from url_resolver import UrlResolver
+from retry_queue import RetryQueue
+from negative_cache import NegativeCache
+from state_store import StateStore, DEFAULT_STATE_DB
+from plan_sync import HEAD_NAMESPACE
+from validate_xml import IntegrityCache
+import metrics
+import profiling
+from metrics import QUEUE_DEPTH, StageTimer, record_cache
+
+DATASETS = ('248', 'no248')
+
+# Месячные XML маленькие и открывают новую работу, поэтому идут раньше архивов
+KIND_PRIORITY = {'xml': 0, 'xsd': 1, 'zip': 2}
+
+# Элемент очереди, по которому поток завершает работу; сортируется после всех файлов
+STOP = ((float('inf'),), float('inf'), None)
+
+class WorkItem:
+    """Файл для скачивания: месячный XML, ZIP или XSD"""
+
+    def __init__(self, kind, url, filename, date, size=None):
+        self.kind = kind
+        self.url = url
+        self.filename = filename
+        self.date = date
+        self.size = size
+        self.attempts = 0
+
+    def get_priority(self):
+        """Ключ очереди: тип файла, затем более свежий месяц, затем меньший размер"""
+        size = self.size if self.size is not None else float('inf')
+        return (KIND_PRIORITY[self.kind], -self.date.toordinal(), size)
+
+class DownloadScheduler:
+    """Единая очередь с приоритетами для обоих list.xml и всех типов файлов
+
+    Месячные XML из xml/248/list.xml и xml/no248/list.xml, а также ZIP и XSD
+    из них попадают в одну очередь, которую разбирает общий пул потоков.
+    Пока скачиваются архивы одного набора, уже идут XML и архивы другого,
+    поэтому пул не простаивает на границах этапов и наборов. Каждый URL
+    скачивается один раз на оба набора: XSD, общие для 248 и no248,
+    связываются жесткой ссылкой (или копируются) во второй каталог.
+
+    Args:
+        base_dir (str): Каталог с 248/list.xml и no248/list.xml
+        workers (int): Размер пула потоков
+        compression (str): Хранить месячные XML сжатыми (gzip или zstd)
+        retry_queue (RetryQueue): Задержки повторов и список недоставленных
+        negative_cache (NegativeCache): URL, которые не нужно запрашивать
+        store (StateStore): Хранилище состояния (размеры из кэша HEAD запросов)
+    """
+
+    def __init__(self, base_dir="xml", workers=4, compression=None, retry_queue=None, negative_cache=None, store=None):
+        self.base_dir = base_dir
+        self.workers = workers
+        self.compression = compression
+        self.retry_queue = retry_queue if retry_queue is not None else RetryQueue()
+        self.negative_cache = negative_cache
+        self.store = store
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.outstanding = 0
+        self.resolver = UrlResolver()
+        self.tasks = {}  # URL -> {'item', 'refs', 'status'}
+        self.claimed = {}  # Путь на диске -> URL, который туда сохраняется
+        self.manifests = {dataset: {} for dataset in DATASETS}
+        self.integrity = IntegrityCache()
+        self.parsed = {}  # Путь к XML -> (размер, mtime, ссылки), чтобы не парсить XML повторно
+        self.local = threading.local()
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.in_flight = 0
+        self.pbar = None
+        self.stats = {'downloaded': 0, 'existing': 0, 'failed': 0, 'retried': 0, 'shared': 0}
+        QUEUE_DEPTH.set_function(self.queue.qsize, queue='scheduler')
+
+    def get_dirs(self, dataset):
+        """Каталоги data и xsd набора"""
+        xml_dir = os.path.join(self.base_dir, dataset)
+        return os.path.join(xml_dir, "data"), os.path.join(xml_dir, "xsd")
+
+    def get_known_size(self, url):
+        """Размер файла из кэша HEAD запросов plan_sync, если он есть"""
+        if self.store is None:
+            return None
+        cached = self.store.get(HEAD_NAMESPACE, url)
+        return cached['size'] if cached and cached.get('size') else None
+
+    def put(self, item):
+        self.queue.put((item.get_priority(), next(self.counter), item))
+        QUEUE_DEPTH.set(self.queue.qsize(), queue='scheduler')
+
+    def submit(self, item, ref):
+        """Ставит файл в очередь; повторный URL только добавляет еще одно место назначения
+
+        Args:
+            item (WorkItem): Файл
+            ref (tuple): (набор, имя месячного XML, путь на диске) - куда и для чего нужен файл
+        """
+        with self.lock:
+            record = self.manifests[ref[0]].get(ref[1])
+            if record is not None and item.kind != 'xml':
+                record['pending'] += 1
+            task = self.tasks.get(item.url)
+            if task is None:
+                self.tasks[item.url] = {'item': item, 'refs': [ref], 'status': None}
+                self.outstanding += 1
+                if self.pbar is not None:
+                    self.pbar.total += 1
+                    self.pbar.refresh()
+            elif task['status'] is None:
+                task['refs'].append(ref)
+                return
+            elif item.kind == 'xml' and record is not None and record['pending']:
+                # Файлы этого XML еще обрабатываются, их итог и так попадет в статус
+                return
+        if task is None:
+            self.put(item)
+        else:
+            # Файл уже обработан для другого XML или набора
+            self.finish_ref(task, ref)
+            if item.kind == 'xml' and task['status'] == 'exists':
+                # Месячный XML уже скачан: разворачиваем его заново, чтобы статус собрался из файлов
+                self.expand_manifest(task['item'], ref[0], ref[1])
+
+    def get_target(self, dataset, link, date):
+        """Путь для ZIP/XSD; если имя уже занято другим URL, файл кладется в подкаталог YYYY-MM"""
+        data_dir, xsd_dir = self.get_dirs(dataset)
+        folder = xsd_dir if link.filename.lower().endswith('.xsd') else data_dir
+        filename = os.path.join(folder, link.filename)
+        with self.lock:
+            if self.claimed.setdefault(filename, link.url) == link.url:
+                return filename
+            year = link.year or f"{date.year}"
+            month = link.month or f"{date.month:02d}"
+            filename = os.path.join(folder, f"{year}-{month}", link.filename)
+            self.claimed.setdefault(filename, link.url)
+            return filename
+
+    def load_status(self, dataset):
+        """Читает processing_status.json набора"""
+        status_file = os.path.join(self.get_dirs(dataset)[0], "processing_status.json")
+        if os.path.exists(status_file):
+            try:
+                with open(status_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except json.JSONDecodeError:
+                print(f"Ошибка при чтении файла статуса {status_file}, создаем новый")
+        return {}
+
+    def load_lists(self):
+        """Ставит в очередь месячные XML из обоих list.xml, кроме уже обработанных полностью
+
+        Returns:
+            int: Сколько месячных XML поставлено в очередь
+        """
+        total = 0
+        for dataset in DATASETS:
+            list_xml_path = os.path.join(self.base_dir, dataset, "list.xml")
+            if not os.path.exists(list_xml_path):
+                continue
+            try:
+                root = ET.parse(list_xml_path).getroot()
+            except ET.ParseError as e:
+                print(f"\n✗ Ошибка при парсинге {list_xml_path}: {str(e)}")
+                continue
+
+            data_dir, xsd_dir = self.get_dirs(dataset)
+            os.makedirs(data_dir, exist_ok=True)
+            os.makedirs(xsd_dir, exist_ok=True)
+            processing_status = self.load_status(dataset)
+            count = 0
+            for item in root.findall(".//item"):
+                link = item.get('link')
+                if not link or not link.endswith('.xml'):
+                    continue
+                xml_basename = normalize_filename(os.path.basename(link))
+                if processing_status.get(xml_basename, {}).get('status') == 'completed':
+                    continue
+                self.submit_manifest(dataset, link)
+                count += 1
+            print(f"{list_xml_path}: месячных XML к обработке - {count}")
+            total += count
+        return total
+
+    def submit_manifest(self, dataset, link):
+        """Ставит в очередь месячный XML из list.xml набора"""
+        data_dir = self.get_dirs(dataset)[0]
+        xml_basename = normalize_filename(os.path.basename(link))
+        work = WorkItem('xml', link, os.path.join(data_dir, xml_basename),
+                        extract_date_from_filename(xml_basename), self.get_known_size(link))
+        self.submit(work, (dataset, xml_basename, work.filename))
+
+    def forget(self, url):
+        """Забывает обработанный URL, чтобы его можно было поставить в очередь заново"""
+        with self.lock:
+            task = self.tasks.get(url)
+            if task is not None and task['status'] is not None:
+                del self.tasks[url]
+
+    def forget_failed(self):
+        """Забывает все неудавшиеся URL, чтобы следующий проход попробовал их снова"""
+        with self.lock:
+            for url in [url for url, task in self.tasks.items() if task['status'] == 'failed']:
+                del self.tasks[url]
+
+    def get_manifest_links(self, manifest):
+        """Ссылки на ZIP и XSD из месячного XML; XML, не менявшийся на диске, повторно не парсится"""
+        file_stat = os.stat(manifest)
+        cached = self.parsed.get(manifest)
+        if cached and cached[:2] == (file_stat.st_size, file_stat.st_mtime_ns):
+            record_cache('manifest', True)
+            return cached[2]
+        record_cache('manifest', False)
+        with StageTimer('parse'), open_manifest(manifest) as xml_stream:
+            xml_root = ET.parse(xml_stream).getroot()
+        zip_links, xsd_links = extract_links_from_xml(xml_root)
+        self.parsed[manifest] = (file_stat.st_size, file_stat.st_mtime_ns, zip_links | xsd_links)
+        return zip_links | xsd_links
+
+    def expand_manifest(self, item, dataset, xml_basename):
+        """Ставит в очередь ZIP и XSD из скачанного месячного XML
+
+        Пока ссылки ставятся в очередь, статус месячного XML держит одну
+        незавершенную позицию (см. finish_ref), чтобы сохраненный в это время
+        статус не оказался completed без файлов.
+        """
+        try:
+            self.submit_links(item, dataset, xml_basename)
+        finally:
+            with self.lock:
+                self.manifests[dataset][xml_basename]['pending'] -= 1
+
+    def submit_links(self, item, dataset, xml_basename):
+        manifest = get_manifest_path(item.filename, self.compression)
+        try:
+            links = self.get_manifest_links(manifest)
+        except ET.ParseError as e:
+            print(f"\n✗ Ошибка при парсинге XML файла {os.path.basename(manifest)}: {str(e)}")
+            with self.lock:
+                self.manifests[dataset][xml_basename]['errors'].append(f"Ошибка парсинга XML: {str(e)}")
+            return
+
+        for link in sorted(links):
+            # Ссылка разрешается относительно адреса своего XML
+            with self.lock:
+                resolved = self.resolver.add_link(manifest, item.url, link)
+            kind = 'xsd' if resolved.filename.lower().endswith('.xsd') else 'zip'
+            date = extract_date_from_filename(resolved.filename)
+            if date == datetime.min:
+                date = item.date
+            filename = self.get_target(dataset, resolved, item.date)
+            self.submit(WorkItem(kind, resolved.url, filename, date, self.get_known_size(resolved.url)),
+                        (dataset, xml_basename, filename))
+
+    def finish_ref(self, task, ref):
+        """Отражает результат файла в статусе месячного XML, которому он нужен"""
+        item, status = task['item'], task['status']
+        dataset, xml_basename, filename = ref
+        if item.kind == 'xml':
+            # Скачанный XML будет развернут (expand_manifest), до этого статус не может быть завершенным
+            with self.lock:
+                self.manifests[dataset][xml_basename] = {
+                    'status': 'in_progress',
+                    'xml_downloaded': status == 'exists',
+                    'zip_files': [],
+                    'xsd_files': [],
+                    'errors': [] if status == 'exists' else [f"XML файл не скачан: {xml_basename}"],
+                    'pending': 1 if status == 'exists' else 0,
+                }
+            return
+
+        # Тот же файл нужен во втором наборе: не скачиваем его повторно
+        if status == 'exists' and filename != item.filename and not os.path.exists(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            try:
+                os.link(item.filename, filename)
+            except OSError:
+                shutil.copy2(item.filename, filename)
+            with self.lock:
+                self.stats['shared'] += 1
+
+        folder = self.get_dirs(dataset)[1 if item.kind == 'xsd' else 0]
+        name = os.path.relpath(filename, folder)
+        with self.lock:
+            record = self.manifests[dataset].get(xml_basename)
+            if record is None:
+                return
+            record['pending'] -= 1
+            record[f"{item.kind}_files"].append({'filename': name, 'status': status})
+            if status != 'exists':
+                record['errors'].append(f"{item.kind.upper()} файл не скачан: {name}")
+
+    def complete(self, task, status):
+        """Запоминает итог файла и раздает его всем ссылкам на этот URL"""
+        with self.lock:
+            task['status'] = status
+            refs = list(task['refs'])
+        for ref in refs:
+            self.finish_ref(task, ref)
+
+    def is_present(self, item):
+        """Проверяет, что ZIP/XSD уже есть на диске и цел"""
+        if not os.path.exists(item.filename):
+            return False
+        if self.integrity.is_verified(item.filename):
+            return True
+        is_valid = check_file_integrity(item.filename)
+        self.integrity.record(item.filename, is_valid)
+        if is_valid:
+            return True
+        print(f"\nФайл поврежден, будет перескачан: {os.path.basename(item.filename)}")
+        os.remove(item.filename)
+        return False
+
+    def process(self, item):
+        """Обрабатывает один файл из очереди
+
+        Returns:
+            bool: False, если файл снова поставлен в очередь на повтор
+        """
+        task = self.tasks[item.url]
+        if self.negative_cache is not None and self.negative_cache.is_blocked(item.url):
+            self.complete(task, 'failed')
+            return True
+        if item.kind != 'xml' and self.is_present(item):
+            with self.lock:
+                self.stats['existing'] += 1
+            self.complete(task, 'exists')
+            return True
+
+        if not hasattr(self.local, 'session'):
+            self.local.session = create_session()
+        compression = self.compression if item.kind == 'xml' else None
+        result = download_file(item.url, item.filename, self.local.session, compression, self.negative_cache,
+                               self.stop_event)
+        if result == "skip" and self.stop_event.is_set():
+            # Остановка: недокачанная часть сохранена, файл будет докачан при следующем запуске
+            return False
+        if result is True and item.kind != 'xml':
+            is_valid = check_file_integrity(item.filename)
+            self.integrity.record(item.filename, is_valid)
+            if not is_valid:
+                print(f"✗ Скачанный файл поврежден: {os.path.basename(item.filename)}")
+                os.remove(item.filename)
+                result = "skip"
+
+        if result == "skip":
+            item.attempts += 1
+            if item.attempts < self.retry_queue.max_attempts:
+                delay = self.retry_queue.get_delay(item.attempts)
+                print(f"Файл будет повторен через {delay:.1f} с: {os.path.basename(item.filename)}")
+                with self.lock:
+                    self.stats['retried'] += 1
+                # Пока ждем повтора, поток берет из очереди следующий файл
+                timer = threading.Timer(delay, self.put, [item])
+                timer.daemon = True
+                timer.start()
+                return False
+            self.retry_queue.mark_dead(item.url, (item.url, item.filename), item.attempts)
+            result = False
+
+        if not result:
+            with self.lock:
+                self.stats['failed'] += 1
+            self.complete(task, 'failed')
+            return True
+
+        self.retry_queue.resolve(item.url)
+        with self.lock:
+            self.stats['downloaded'] += 1
+        self.complete(task, 'exists')
+        if item.kind == 'xml':
+            for dataset, xml_basename, _ in list(task['refs']):
+                self.expand_manifest(item, dataset, xml_basename)
+        return True
+
+    def worker(self):
+        while True:
+            _, _, item = self.queue.get()
+            if item is None or self.stop_event.is_set():
+                return
+            with self.lock:
+                self.in_flight += 1
+            try:
+                finished = self.process(item)
+            except Exception as e:
+                print(f"\n✗ Неожиданная ошибка при обработке {item.url}: {str(e)}")
+                self.complete(self.tasks[item.url], 'failed')
+                finished = True
+            with self.lock:
+                self.in_flight -= 1
+                if finished:
+                    self.outstanding -= 1
+                self.idle.notify_all()
+            if finished and self.pbar is not None:
+                self.pbar.update(1)
+
+    def start(self):
+        """Запускает потоки пула"""
+        self.threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def wait(self, timeout=None):
+        """Ждет, пока очередь опустеет
+
+        Returns:
+            bool: True, если вся работа выполнена
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.lock:
+            while self.outstanding and not self.stop_event.is_set():
+                remaining = deadline - time.monotonic() if deadline is not None else 1
+                if remaining <= 0:
+                    break
+                self.idle.wait(timeout=min(remaining, 1))
+            return not self.outstanding
+
+    def shutdown(self, interrupt=False, timeout=60):
+        """Останавливает потоки пула
+
+        Args:
+            interrupt (bool): Прервать текущие скачивания, сохранив недокачанные части
+            timeout (float): Сколько ждать завершения потоков, с
+        """
+        if interrupt:
+            self.stop_event.set()
+        for _ in self.threads:
+            self.queue.put(STOP)
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def run(self):
+        """Скачивает все файлы из обоих list.xml общим пулом потоков"""
+        if not self.load_lists():
+            print("Не найдено файлов для обработки")
+            return
+
+        with tqdm(total=self.outstanding, desc="Общий прогресс") as self.pbar:
+            self.start()
+            try:
+                self.wait()
+                self.shutdown()
+            except KeyboardInterrupt:
+                print("\n\nСкачивание прервано пользователем, сохраняем недокачанные файлы и статус обработки")
+                self.shutdown(interrupt=True)
+        self.pbar = None
+
+        self.save_status()
+        self.print_summary()
+
+    def save_status(self):
+        """Обновляет processing_status.json обоих наборов и кэш проверки целостности"""
+        self.integrity.save()
+        for dataset, records in self.manifests.items():
+            if not records:
+                continue
+            status_file = os.path.join(self.get_dirs(dataset)[0], "processing_status.json")
+            processing_status = self.load_status(dataset)
+            with self.lock:
+                for xml_basename, record in records.items():
+                    record = dict(record)
+                    pending = record.pop('pending')
+                    done = record['xml_downloaded'] and not pending and not record['errors']
+                    record['status'] = 'completed' if done else 'incomplete'
+                    processing_status[xml_basename] = record
+            with open(status_file, 'w', encoding='utf-8') as f:
+                json.dump(processing_status, f, indent=2, ensure_ascii=False)
+
+    def print_summary(self):
+        """Выводит итоги запуска"""
+        print("\n" + "=" * 50)
+        print("Скачивание завершено!")
+        print(f"Скачано файлов: {self.stats['downloaded']}")
+        print(f"Уже были на диске: {self.stats['existing']}")
+        print(f"Общих для обоих наборов (скопировано без скачивания): {self.stats['shared']}")
+        print(f"Отложенных повторов: {self.stats['retried']}")
+        print(f"Не удалось скачать: {self.stats['failed']}")
+        print(f"Повторных ссылок на те же файлы: {self.resolver.duplicates}")
+        for dataset, records in self.manifests.items():
+            completed = sum(1 for record in records.values()
+                            if record['xml_downloaded'] and not record['pending'] and not record['errors'])
+            if records:
+                print(f"Набор {dataset}: обработано полностью {completed} из {len(records)} месячных XML")
+        print("=" * 50)
+
+def main():
+    parser = argparse.ArgumentParser(description='Скачивание файлов из xml/248 и xml/no248 единой очередью с приоритетами')
+    parser.add_argument('--base-dir', default='xml', help='Каталог с 248/list.xml и no248/list.xml')
+    parser.add_argument('--workers', type=int, default=4, help='Количество параллельных скачиваний')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'], default=None,
+                        help='Хранить месячные XML файлы сжатыми')
+    parser.add_argument('--max-attempts', type=int, default=4, help='Попыток на файл при сетевых ошибках')
+    parser.add_argument('--state-db', default=DEFAULT_STATE_DB, help='Файл хранилища состояния')
+    parser.add_argument('--negative-ttl-hours', type=float, default=7 * 24,
+                        help='Сколько не запрашивать URL, ответившие 404/410, ч')
+    parser.add_argument('--server-error-ttl-hours', type=float, default=1,
+                        help='Сколько не запрашивать URL, несколько раз подряд ответившие 5xx, ч')
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_from_args(args)
+    profiling.start_from_args(args)
+
+    with StateStore(args.state_db) as store:
+        retry_queue = RetryQueue(args.max_attempts, store=store)
+        negative_cache = NegativeCache(store, args.negative_ttl_hours * 3600, args.server_error_ttl_hours * 3600)
+        scheduler = DownloadScheduler(args.base_dir, args.workers, args.compress, retry_queue, negative_cache, store)
+        scheduler.run()
+        retry_queue.print_summary()
+        negative_cache.print_summary()
+
+if __name__ == "__main__":
+    main()
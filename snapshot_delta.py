@@ -0,0 +1,158 @@
+import json
+import argparse
+from collections import defaultdict
+from repack_zstd import open_archive
+from xml_records import find_archives, iter_records, get_record_key, get_record_hash, extract_snapshot_date
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+def get_member_crcs(archive_path):
+    """Возвращает {имя XML файла в архиве: CRC}"""
+    with open_archive(archive_path) as zip_ref:
+        return {
+            info.filename: info.CRC
+            for info in zip_ref.infolist()
+            if not info.is_dir() and info.filename.lower().endswith('.xml')
+        }
+
+def iter_member_records(archive_path, member_names, record_tag=None):
+    """Потоково возвращает записи указанных файлов архива
+
+    Yields:
+        tuple: (имя файла в архиве, порядковый номер записи, запись)
+    """
+    with open_archive(archive_path) as zip_ref:
+        for member_name in sorted(member_names):
+            with zip_ref.open(member_name) as member:
+                for offset, record in enumerate(iter_records(member, record_tag)):
+                    yield member_name, offset, record
+
+def iter_changes(old_archive, new_archive, record_tag=None, stats=None):
+    """Сравнивает две выгрузки на уровне записей
+
+    Файлы с одинаковым именем и CRC пропускаются без распаковки. Для остальных
+    записи сопоставляются по естественному ключу и сравниваются по хешу содержимого.
+
+    Yields:
+        dict: Изменение {'op': added|changed|removed, 'key', 'member', 'offset', 'record'}
+    """
+    stats = stats if stats is not None else defaultdict(int)
+    old_crcs = get_member_crcs(old_archive)
+    new_crcs = get_member_crcs(new_archive)
+
+    unchanged = {name for name, crc in new_crcs.items() if old_crcs.get(name) == crc}
+    stats['unchanged_members'] = len(unchanged)
+    stats['changed_members'] = len(set(new_crcs) - unchanged)
+    stats['removed_members'] = len(set(old_crcs) - set(new_crcs))
+
+    # Ключи и хеши записей старой выгрузки из измененных и удаленных файлов
+    old_records = {}
+    for member_name, offset, record in iter_member_records(old_archive, set(old_crcs) - unchanged, record_tag):
+        old_records[get_record_key(record)] = (get_record_hash(record), member_name, offset)
+
+    for member_name, offset, record in iter_member_records(new_archive, set(new_crcs) - unchanged, record_tag):
+        key = get_record_key(record)
+        old = old_records.pop(key, None)
+        if old is None:
+            stats['added'] += 1
+            yield {'op': 'added', 'key': key, 'member': member_name, 'offset': offset, 'record': record}
+        elif old[0] != get_record_hash(record):
+            stats['changed'] += 1
+            yield {'op': 'changed', 'key': key, 'member': member_name, 'offset': offset, 'record': record}
+        else:
+            stats['same'] += 1
+
+    for key, (record_hash, member_name, offset) in old_records.items():
+        stats['removed'] += 1
+        yield {'op': 'removed', 'key': key, 'member': member_name, 'offset': offset, 'record': None}
+
+def write_jsonl(changes, output_file, context):
+    """Записывает ленту изменений в JSONL"""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for change in changes:
+            change.update(context)
+            f.write(json.dumps(change, ensure_ascii=False) + '\n')
+
+def write_parquet(changes, output_file, context, batch_size=10000):
+    """Записывает ленту изменений в Parquet (запись хранится как JSON строка)"""
+    schema = pa.schema([
+        ('op', pa.string()), ('key', pa.string()), ('member', pa.string()), ('offset', pa.int64()),
+        ('record', pa.string()), ('old_snapshot', pa.string()), ('new_snapshot', pa.string()),
+    ])
+    with pq.ParquetWriter(output_file, schema, compression='zstd') as writer:
+        batch = []
+
+        def flush():
+            if batch:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch.clear()
+
+        for change in changes:
+            change.update(context)
+            if change['record'] is not None:
+                change['record'] = json.dumps(change['record'], ensure_ascii=False)
+            batch.append(change)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+
+def find_latest_pair(directory):
+    """Находит две последние выгрузки в директории месяца (включая поддиректории)"""
+    archives = find_archives(directory)
+    archives.sort(key=lambda path: extract_snapshot_date(path) or '')
+    if len(archives) < 2:
+        return None
+    return archives[-2], archives[-1]
+
+def main():
+    parser = argparse.ArgumentParser(description='Лента изменений между двумя выгрузками на уровне записей')
+    parser.add_argument('archives', nargs='*', help='Старый и новый архивы')
+    parser.add_argument('--latest', metavar='DIR', help='Сравнить две последние выгрузки в директории месяца')
+    parser.add_argument('--output', '-o', default='changes.jsonl', help='Файл ленты изменений (.jsonl или .parquet)')
+    parser.add_argument('--record-tag', default=None, help='Имя тега записи')
+    args = parser.parse_args()
+
+    if args.latest:
+        pair = find_latest_pair(args.latest)
+        if pair is None:
+            print(f"В директории {args.latest} меньше двух выгрузок")
+            return
+    elif len(args.archives) == 2:
+        pair = tuple(args.archives)
+    else:
+        parser.error("Укажите два архива или --latest DIR")
+
+    old_archive, new_archive = pair
+    print(f"Старая выгрузка: {old_archive}")
+    print(f"Новая выгрузка: {new_archive}")
+
+    stats = defaultdict(int)
+    context = {
+        'old_snapshot': extract_snapshot_date(old_archive),
+        'new_snapshot': extract_snapshot_date(new_archive),
+    }
+    changes = iter_changes(old_archive, new_archive, args.record_tag, stats)
+    if args.output.endswith('.parquet'):
+        if pa is None:
+            print("Для записи в Parquet требуется пакет pyarrow")
+            return
+        write_parquet(changes, args.output, context)
+    else:
+        write_jsonl(changes, args.output, context)
+
+    print(f"\nФайлов в архиве без изменений (пропущено по CRC): {stats['unchanged_members']}")
+    print(f"Измененных файлов: {stats['changed_members']}")
+    print(f"Удаленных файлов: {stats['removed_members']}")
+    print(f"Записей добавлено: {stats['added']}")
+    print(f"Записей изменено: {stats['changed']}")
+    print(f"Записей удалено: {stats['removed']}")
+    print(f"Записей без изменений: {stats['same']}")
+    print(f"\nЛента изменений сохранена в файл: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import json
+import time
+import sqlite3
+import argparse
+from threading import Lock
+
+DEFAULT_STATE_DB = "state.db"
+
+SCHEMA_SQL = """CREATE TABLE IF NOT EXISTS state (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID"""
+
+class StateStore:
+    """Общее хранилище состояния скачивания (ключ-значение по пространствам имен с TTL)
+
+    Значения хранятся как JSON. Запись с истекшим сроком считается отсутствующей.
+    Одно соединение используется всеми потоками под общей блокировкой.
+    """
+
+    def __init__(self, db_path=DEFAULT_STATE_DB):
+        self.db_path = db_path
+        self.lock = Lock()
+        self.connection = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(SCHEMA_SQL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get(self, namespace, key, default=None):
+        """Возвращает значение или default, если записи нет или ее срок истек"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, namespace, key, value, ttl=None):
+        """Сохраняет значение; ttl в секундах, None - бессрочно"""
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False), now, expires_at)
+            )
+
+    def delete(self, namespace, key):
+        """Удаляет запись"""
+        with self.lock:
+            self.connection.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def items(self, namespace, limit=None):
+        """Возвращает действующие записи пространства имен, от новых к старым
+
+        Returns:
+            list: [(ключ, значение, время обновления)]
+        """
+        query = ("SELECT key, value, updated_at FROM state WHERE namespace = ? "
+                 "AND (expires_at IS NULL OR expires_at > ?) ORDER BY updated_at DESC")
+        params = [namespace, time.time()]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [(key, json.loads(value), updated_at) for key, value, updated_at in rows]
+
+    def purge_expired(self):
+        """Удаляет записи с истекшим сроком; возвращает их количество"""
+        with self.lock:
+            cursor = self.connection.execute(
+                "DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            )
+        return cursor.rowcount
+
+    def trim(self, namespace, keep):
+        """Оставляет в пространстве имен только keep самых свежих записей"""
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM state WHERE namespace = ? AND key NOT IN "
+                "(SELECT key FROM state WHERE namespace = ? ORDER BY updated_at DESC LIMIT ?)",
+                (namespace, namespace, keep)
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description='Просмотр и очистка хранилища состояния')
+    parser.add_argument('--db', default=DEFAULT_STATE_DB, help='Файл хранилища состояния')
+    parser.add_argument('--purge', action='store_true', help='Удалить записи с истекшим сроком')
+    args = parser.parse_args()
+
+    with StateStore(args.db) as store:
+        if args.purge:
+            print(f"Удалено записей с истекшим сроком: {store.purge_expired()}")
+        with store.lock:
+            rows = store.connection.execute(
+                "SELECT namespace, COUNT(*) FROM state GROUP BY namespace ORDER BY namespace"
+            ).fetchall()
+        print("\nЗаписей по пространствам имен:")
+        for namespace, count in rows:
+            print(f"- {namespace}: {count}")
+
+if __name__ == "__main__":
+    main()
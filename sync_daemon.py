@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import signal
+import hashlib
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from download_xml_data import create_session, normalize_filename
+from scheduler import DownloadScheduler, DATASETS
+from retry_queue import RetryQueue
+from negative_cache import NegativeCache
+from state_store import StateStore, DEFAULT_STATE_DB
+import metrics
+import profiling
+
+LIST_NAMESPACE = 'list_xml'
+LIST_ITEMS_NAMESPACE = 'list_items'
+
+def get_item_fingerprint(item):
+    """Отпечаток записи list.xml: меняется, если у месячного XML поменялись атрибуты или текст"""
+    return hashlib.sha1(ET.tostring(item, encoding='utf-8')).hexdigest()
+
+class SyncDaemon:
+    """Долгоживущий процесс, который следит за list.xml и докачивает только новое
+
+    Хранилище состояния, пул соединений, потоки скачивания и кэш разобранных
+    месячных XML живут все время работы. Раз в interval секунд list.xml каждого
+    набора запрашивается условным запросом (If-None-Match/If-Modified-Since);
+    если он изменился, в очередь планировщика попадают только новые месячные XML
+    и XML, запись о которых в list.xml поменялась, а за ними - их архивы.
+    Без адреса list.xml отслеживается локальный файл по времени изменения.
+
+    Args:
+        scheduler (DownloadScheduler): Планировщик с общим пулом скачивания
+        store (StateStore): Хранилище состояния
+        list_urls (dict): Набор -> адрес list.xml (None - только локальный файл)
+        interval (float): Период опроса list.xml, с
+    """
+
+    def __init__(self, scheduler, store, list_urls, interval=1800):
+        self.scheduler = scheduler
+        self.store = store
+        self.list_urls = list_urls
+        self.interval = interval
+        self.session = create_session()
+        self.stop_event = threading.Event()
+        self.started_at = datetime.now()
+        self.last_poll = None
+        self.last_changes = 0
+        self.polls = 0
+        self.errors = 0
+        self.local_mtimes = {}
+
+    def get_list_path(self, dataset):
+        return os.path.join(self.scheduler.base_dir, dataset, "list.xml")
+
+    def fetch_list(self, dataset):
+        """Скачивает list.xml, если он изменился
+
+        Returns:
+            bool: True, если на диске новая версия list.xml
+        """
+        url = self.list_urls.get(dataset)
+        list_path = self.get_list_path(dataset)
+        if not url:
+            # Адрес не задан: list.xml обновляет кто-то другой, следим за временем изменения
+            if not os.path.exists(list_path):
+                return False
+            mtime = os.path.getmtime(list_path)
+            changed = self.local_mtimes.get(dataset) != mtime
+            self.local_mtimes[dataset] = mtime
+            return changed
+
+        cached = self.store.get(LIST_NAMESPACE, dataset) or {}
+        headers = {}
+        # Валидаторы отправляем, только если прошлая версия еще лежит на диске
+        if os.path.exists(list_path):
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        response = self.session.get(url, headers=headers, timeout=30)
+        if response.status_code == 304:
+            return False
+        response.raise_for_status()
+
+        os.makedirs(os.path.dirname(list_path), exist_ok=True)
+        tmp_path = f"{list_path}.part"
+        with open(tmp_path, 'wb') as f:
+            f.write(response.content)
+        os.replace(tmp_path, list_path)
+        self.store.set(LIST_NAMESPACE, dataset, {
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+            'fetched_at': datetime.now().isoformat(),
+        })
+        return True
+
+    def enqueue_changes(self, dataset):
+        """Ставит в очередь новые и изменившиеся месячные XML набора
+
+        Returns:
+            int: Сколько месячных XML поставлено в очередь
+        """
+        try:
+            root = ET.parse(self.get_list_path(dataset)).getroot()
+        except ET.ParseError as e:
+            print(f"✗ Ошибка при парсинге {self.get_list_path(dataset)}: {str(e)}")
+            return 0
+
+        processing_status = self.scheduler.load_status(dataset)
+        count = 0
+        for item in root.findall(".//item"):
+            link = item.get('link')
+            if not link or not link.endswith('.xml'):
+                continue
+            key = f"{dataset} {link}"
+            fingerprint = get_item_fingerprint(item)
+            previous = self.store.get(LIST_ITEMS_NAMESPACE, key)
+            xml_basename = normalize_filename(os.path.basename(link))
+            completed = processing_status.get(xml_basename, {}).get('status') == 'completed'
+            if previous == fingerprint and completed:
+                continue
+            if previous is not None and previous != fingerprint:
+                print(f"Месячный XML изменился: {xml_basename}")
+                self.scheduler.forget(link)
+            elif completed:
+                # Первое знакомство с уже обработанным XML: только запоминаем отпечаток
+                self.store.set(LIST_ITEMS_NAMESPACE, key, fingerprint)
+                continue
+            self.scheduler.submit_manifest(dataset, link)
+            self.store.set(LIST_ITEMS_NAMESPACE, key, fingerprint)
+            count += 1
+        return count
+
+    def poll(self):
+        """Один проход: проверяет list.xml обоих наборов и ставит изменения в очередь"""
+        self.polls += 1
+        self.last_poll = datetime.now()
+        # Неудавшиеся в прошлых проходах файлы пробуем снова (негативный кэш отсеет 404)
+        self.scheduler.forget_failed()
+        changes = 0
+        for dataset in DATASETS:
+            try:
+                changed = self.fetch_list(dataset)
+            except requests.exceptions.RequestException as e:
+                self.errors += 1
+                print(f"✗ Не удалось запросить list.xml ({dataset}): {str(e)}")
+                continue
+            # При первом проходе сверяем list.xml с отпечатками, даже если он не менялся
+            if (changed or self.polls == 1) and os.path.exists(self.get_list_path(dataset)):
+                changes += self.enqueue_changes(dataset)
+        self.last_changes = changes
+        if changes:
+            print(f"[{self.last_poll.isoformat(timespec='seconds')}] В очередь поставлено месячных XML: {changes}")
+
+    def get_health(self):
+        """Состояние процесса для /health"""
+        scheduler = self.scheduler
+        with scheduler.lock:
+            return {
+                'status': 'stopping' if self.stop_event.is_set() else 'ok',
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'uptime_seconds': int((datetime.now() - self.started_at).total_seconds()),
+                'last_poll': self.last_poll.isoformat(timespec='seconds') if self.last_poll else None,
+                'polls': self.polls,
+                'poll_errors': self.errors,
+                'last_changes': self.last_changes,
+                'queued': scheduler.queue.qsize(),
+                'outstanding': scheduler.outstanding,
+                'in_flight': scheduler.in_flight,
+                'stats': dict(scheduler.stats),
+                'dead_letters': len(scheduler.retry_queue.dead),
+            }
+
+    def get_progress(self):
+        """Прогресс по месячным XML для /progress"""
+        progress = {}
+        with self.scheduler.lock:
+            for dataset, records in self.scheduler.manifests.items():
+                progress[dataset] = {
+                    xml_basename: {
+                        'xml_downloaded': record['xml_downloaded'],
+                        'pending': record['pending'],
+                        'zip_files': len(record['zip_files']),
+                        'xsd_files': len(record['xsd_files']),
+                        'errors': len(record['errors']),
+                    }
+                    for xml_basename, record in records.items()
+                }
+        return progress
+
+    def serve_health(self, port):
+        """Запускает HTTP сервер с /health, /progress и /metrics (формат Prometheus) в отдельном потоке"""
+        daemon = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                routes = {'/health': daemon.get_health, '/progress': daemon.get_progress}
+                handler = routes.get(path)
+                if path == '/metrics':
+                    body = metrics.metrics.render().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif handler is not None:
+                    body = json.dumps(handler(), ensure_ascii=False, indent=2).encode('utf-8')
+                    content_type = 'application/json; charset=utf-8'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), HealthHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Состояние: http://127.0.0.1:{port}/health, прогресс: http://127.0.0.1:{port}/progress, "
+              f"метрики: http://127.0.0.1:{port}/metrics")
+        return server
+
+    def stop(self, signum=None, frame=None):
+        """Обработчик SIGTERM/SIGINT: завершение после сохранения недокачанных файлов"""
+        if not self.stop_event.is_set():
+            print("\nПолучен сигнал остановки, сохраняем недокачанные файлы...")
+        self.stop_event.set()
+
+    def run(self, health_port=None):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        server = self.serve_health(health_port) if health_port else None
+        self.scheduler.start()
+        try:
+            while not self.stop_event.is_set():
+                self.poll()
+                next_poll = time.monotonic() + self.interval
+                # Пока ждем следующего опроса, сохраняем статус обработки, когда что-то скачалось
+                saved_stats = None
+                while not self.stop_event.is_set() and time.monotonic() < next_poll:
+                    self.scheduler.wait(timeout=min(60, max(0, next_poll - time.monotonic())))
+                    if self.scheduler.stats != saved_stats:
+                        saved_stats = dict(self.scheduler.stats)
+                        self.scheduler.save_status()
+                    self.stop_event.wait(timeout=min(5, max(0, next_poll - time.monotonic())))
+        finally:
+            self.scheduler.shutdown(interrupt=True)
+            self.scheduler.save_status()
+            if server is not None:
+                server.shutdown()
+            self.scheduler.print_summary()
+
+def main():
+    parser = argparse.ArgumentParser(description='Фоновая синхронизация: опрос list.xml и докачка новых файлов')
+    parser.add_argument('--base-dir', default='xml', help='Каталог с 248/list.xml и no248/list.xml')
+    parser.add_argument('--list-248-url', default=None, help='Адрес list.xml по 248-ФЗ (без него - следить за локальным файлом)')
+    parser.add_argument('--list-no248-url', default=None, help='Адрес обычного list.xml (без него - следить за локальным файлом)')
+    parser.add_argument('--interval', type=float, default=30, help='Период опроса list.xml, мин')
+    parser.add_argument('--health-port', type=int, default=8780, help='Порт /health и /progress (0 - не запускать)')
+    parser.add_argument('--workers', type=int, default=4, help='Количество параллельных скачиваний')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'], default=None,
+                        help='Хранить месячные XML файлы сжатыми')
+    parser.add_argument('--max-attempts', type=int, default=4, help='Попыток на файл при сетевых ошибках')
+    parser.add_argument('--state-db', default=DEFAULT_STATE_DB, help='Файл хранилища состояния')
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_from_args(args)
+    profiling.start_from_args(args)
+
+    with StateStore(args.state_db) as store:
+        retry_queue = RetryQueue(args.max_attempts, store=store)
+        negative_cache = NegativeCache(store)
+        scheduler = DownloadScheduler(args.base_dir, args.workers, args.compress, retry_queue, negative_cache, store)
+        list_urls = {'248': args.list_248_url, 'no248': args.list_no248_url}
+        daemon = SyncDaemon(scheduler, store, list_urls, args.interval * 60)
+        daemon.run(args.health_port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import os
+import re
+import posixpath
+from collections import defaultdict
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def extract_year_month_from_url(url):
+    """Извлекает год и месяц из URL"""
+    # Проверяем оба формата URL: /erknm-plan/YYYY/MM/ и /erknm-opendata/YYYY/MM/
+    match = re.search(r'/erknm-(?:plan|opendata)/(\d{4})/(\d{1,2})/', url)
+    if match:
+        year = match.group(1)
+        month = match.group(2).zfill(2)  # Добавляем ведущий ноль для месяцев < 10
+        return year, month
+    return None, None
+
+def canonicalize_url(url):
+    """Приводит URL к каноническому виду для сравнения
+
+    Схема и хост в нижнем регистре, порт по умолчанию убран, сегменты "."/".."
+    и повторные "/" в пути схлопнуты, фрагмент отброшен.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    netloc = host
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{parts.port}"
+    if parts.username:
+        netloc = f"{parts.username}@{netloc}"
+    path = posixpath.normpath(re.sub(r'/{2,}', '/', parts.path)) if parts.path else '/'
+    # normpath убирает завершающий "/", который для директорий значим
+    if parts.path.endswith('/') and not path.endswith('/'):
+        path += '/'
+    return urlunsplit((scheme, netloc, path, parts.query, ''))
+
+class ResolvedLink:
+    """Ссылка на файл с абсолютным адресом и месячным XML, из которого она получена"""
+
+    def __init__(self, url, manifest, manifest_url):
+        self.url = url
+        self.manifest = manifest
+        self.manifest_url = manifest_url
+        self.filename = posixpath.basename(urlsplit(url).path)
+        self.year, self.month = extract_year_month_from_url(url)
+        self.name = self.filename
+
+class UrlResolver:
+    """Разрешает ссылки из месячных XML в абсолютные URL относительно каждого XML
+
+    Каждая ссылка разрешается через urljoin от адреса того XML, в котором она
+    встретилась, и дедуплицируется по каноническому URL, поэтому каждый
+    реально существующий файл запрашивается ровно один раз и из своей директории.
+    """
+
+    def __init__(self):
+        self.links = {}
+        self.duplicates = 0
+
+    def add_manifest(self, manifest, manifest_url, links):
+        """Добавляет ссылки из одного месячного XML
+
+        Args:
+            manifest (str): Локальный путь к XML
+            manifest_url (str): Адрес, с которого XML был скачан
+            links (iterable): Ссылки из XML (абсолютные или относительные)
+        """
+        for link in links:
+            self.add_link(manifest, manifest_url, link)
+
+    def add_link(self, manifest, manifest_url, link):
+        """Добавляет одну ссылку и возвращает ее ResolvedLink (для повторного URL - уже известный)"""
+        url = canonicalize_url(urljoin(manifest_url, link.strip()))
+        if url in self.links:
+            self.duplicates += 1
+        else:
+            self.links[url] = ResolvedLink(url, manifest, manifest_url)
+        return self.links[url]
+
+    def get_links(self, extension):
+        """Возвращает {имя файла: ResolvedLink} для файлов с указанным расширением
+
+        Имя файла - это basename URL. Если одинаковый basename встречается у разных
+        URL (например, выгрузки из разных месяцев с одной датой), такие файлы
+        получают имя YYYY-MM/basename, чтобы не затирать друг друга на диске.
+        """
+        by_filename = defaultdict(list)
+        for link in self.links.values():
+            if link.filename.lower().endswith(extension):
+                by_filename[link.filename].append(link)
+
+        resolved = {}
+        for filename, links in by_filename.items():
+            if len(links) == 1:
+                resolved[filename] = links[0]
+                continue
+            for link in links:
+                if link.year:
+                    link.name = os.path.join(f"{link.year}-{link.month}", filename)
+                else:
+                    # Без года и месяца в пути различаем по директории источника
+                    link.name = os.path.join(posixpath.basename(posixpath.dirname(urlsplit(link.url).path)), filename)
+                resolved[link.name] = link
+        return resolved
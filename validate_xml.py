@@ -0,0 +1,348 @@
+import os
+import re
+import glob
+import json
+import argparse
+import threading
+from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from repack_zstd import open_archive, is_repacked
+from xml_records import find_archives, extract_structure_version, get_archive_partition
+from manifest_storage import is_manifest, open_manifest
+import metrics
+import profiling
+from metrics import StageTimer, record_cache
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Скомпилированные схемы кэшируются в каждом процессе-обработчике отдельно
+_compiled_schemas = {}
+
+def find_xsd_dirs(base_dir="."):
+    """Возвращает директории со скачанными XSD файлами"""
+    dirs = glob.glob(os.path.join(base_dir, 'xml', '*', 'xsd'))
+    dirs.append(os.path.join(base_dir, 'xsd'))
+    return [d for d in dirs if os.path.isdir(d)]
+
+def find_xsd_for_archive(archive_path, xsd_dirs):
+    """Подбирает XSD по токену structure-YYYYMMDD из имени архива"""
+    version = extract_structure_version(archive_path)
+    if not version:
+        return None
+    candidates = []
+    for xsd_dir in xsd_dirs:
+        candidates.extend(glob.glob(os.path.join(xsd_dir, f"*{version}*.xsd")))
+    if not candidates:
+        return None
+
+    # Если для одной версии есть схемы и проверок, и планов, выбираем по типу архива
+    partition = get_archive_partition(archive_path)
+    if partition and len(candidates) > 1:
+        file_type = partition[1]
+        preferred = [c for c in candidates if ('plan' in os.path.basename(c).lower()) == (file_type == 'plan')]
+        if preferred:
+            candidates = preferred
+    return sorted(candidates)[0]
+
+def find_xsd_by_hint(xml_path, xsd_dirs):
+    """Ищет локальную копию XSD, указанной в xsi:schemaLocation корневого элемента"""
+    try:
+        with open_manifest(xml_path) as f:
+            head = f.read(4096).decode('utf-8', errors='ignore')
+    except OSError:
+        return None
+    match = re.search(r'(?:noNamespaceSchemaLocation|schemaLocation)="([^"]+)"', head)
+    if not match:
+        return None
+    xsd_name = os.path.basename(match.group(1).split()[-1])
+    for xsd_dir in xsd_dirs:
+        candidate = os.path.join(xsd_dir, xsd_name)
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def get_compiled_schema(xsd_path):
+    """Компилирует XSD один раз на процесс и возвращает схему из кэша"""
+    xsd_stat = os.stat(xsd_path)
+    key = (os.path.abspath(xsd_path), xsd_stat.st_mtime_ns)
+    schema = _compiled_schemas.get(key)
+    if schema is None:
+        schema = etree.XMLSchema(etree.parse(xsd_path))
+        _compiled_schemas[key] = schema
+    return schema
+
+def is_archive(file_path):
+    """Архив выгрузки (ZIP или перепакованный), а не месячный XML, сохраненный в .xml.zst"""
+    return file_path.endswith('.zip') or (is_repacked(file_path) and not is_manifest(file_path))
+
+def validate_stream(stream, schema):
+    """Потоково проверяет XML по схеме; возвращает None или текст первой ошибки"""
+    try:
+        for event, elem in etree.iterparse(stream, events=('end',), schema=schema, huge_tree=True):
+            # Очищаем обработанные элементы, чтобы память не росла на больших файлах
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        return None
+    except etree.XMLSyntaxError as e:
+        return str(e)
+
+def validate_file(file_path, xsd_path):
+    """Проверяет архив (все XML внутри) или отдельный XML файл по схеме
+
+    Returns:
+        dict: {'valid': bool, 'xsd': путь к схеме, 'members': {имя: ошибка или None}}
+    """
+    schema = get_compiled_schema(xsd_path)
+    members = {}
+    if is_archive(file_path):
+        with open_archive(file_path) as zip_ref:
+            for info in zip_ref.infolist():
+                if info.is_dir() or not info.filename.lower().endswith('.xml'):
+                    continue
+                with zip_ref.open(info) as member:
+                    members[info.filename] = validate_stream(member, schema)
+    else:
+        with open_manifest(file_path) as f:
+            members[os.path.basename(file_path)] = validate_stream(f, schema)
+
+    return {
+        'valid': bool(members) and all(error is None for error in members.values()),
+        'xsd': xsd_path,
+        'members': members,
+    }
+
+def get_dataset_dir(file_path):
+    """Каталог xml/<тип>, если файл лежит в xml/<тип>/data или xml/<тип>/xsd (в том числе в подкаталогах)"""
+    parts = os.path.abspath(file_path).split(os.sep)
+    for i in range(len(parts) - 3, 0, -1):
+        if parts[i - 1] == 'xml' and parts[i + 1] in ('data', 'xsd'):
+            return os.sep.join(parts[:i + 1])
+    return None
+
+def get_integrity_key(file_path, base_dir="."):
+    """Ключ файла в кэше целостности: путь относительно каталога с xml/ (как его пишет download_xml_data.py)
+    или, для остальных файлов, относительно base_dir"""
+    dataset_dir = get_dataset_dir(file_path)
+    root = os.path.dirname(os.path.dirname(dataset_dir)) if dataset_dir else os.path.abspath(base_dir)
+    return os.path.relpath(os.path.abspath(file_path), root)
+
+def get_integrity_cache_file(file_path, base_dir="."):
+    """Возвращает кэш проверки целостности, в котором хранится вердикт для файла"""
+    dataset_dir = get_dataset_dir(file_path)
+    # Файлы из xml/<тип>/data и xml/<тип>/xsd используют кэш download_xml_data.py
+    if dataset_dir:
+        return os.path.join(dataset_dir, "data", "integrity_cache.json")
+    return os.path.join(os.path.abspath(base_dir), "data", "integrity_cache.json")
+
+def load_integrity_cache(cache_file):
+    """Загружает кэш проверки целостности"""
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            print(f"Ошибка при чтении кэша {cache_file}, создаем новый")
+    return {}
+
+class IntegrityCache:
+    """Вердикты проверки целостности в формате check_files_integrity (download_xml_data.py)
+
+    Файлы из разных каталогов хранятся в своих integrity_cache.json (см.
+    get_integrity_cache_file); вердикт действителен, пока не изменились размер
+    и mtime файла. При сохранении записи объединяются с тем, что за это время
+    записали в файл кэша другие процессы.
+
+    Args:
+        base_dir (str): Базовая директория для файлов вне xml/<тип>
+        save_every (int): Сохранять кэши после стольких новых вердиктов
+    """
+
+    def __init__(self, base_dir=".", save_every=100):
+        self.base_dir = base_dir
+        self.save_every = save_every
+        self.caches = {}
+        self.updates = defaultdict(dict)  # Файл кэша -> новые записи с прошлого сохранения
+        self.lock = threading.Lock()
+
+    def get_entry(self, file_path):
+        cache_file = get_integrity_cache_file(file_path, self.base_dir)
+        if cache_file not in self.caches:
+            self.caches[cache_file] = load_integrity_cache(cache_file)
+        return cache_file, get_integrity_key(file_path, self.base_dir)
+
+    def is_verified(self, file_path):
+        """Файл уже проверен, цел и не изменился после проверки"""
+        with self.lock:
+            cache_file, key = self.get_entry(file_path)
+            cached = self.caches[cache_file].get(key)
+        if not cached or not cached.get('is_valid'):
+            record_cache('integrity', False)
+            return False
+        file_stat = os.stat(file_path)
+        verified = cached.get('size') == file_stat.st_size and cached.get('mtime') == file_stat.st_mtime
+        record_cache('integrity', verified)
+        return verified
+
+    def get_schema(self, file_path):
+        """Вердикт проверки по XSD (validate_xml.py) или None"""
+        with self.lock:
+            cache_file, key = self.get_entry(file_path)
+            return self.caches[cache_file].get(key, {}).get('schema')
+
+    def record(self, file_path, is_valid):
+        """Запоминает результат проверки файла (проверку по XSD в той же записи не затирает)"""
+        if not os.path.exists(file_path):
+            with self.lock:
+                cache_file, key = self.get_entry(file_path)
+                self.caches[cache_file].pop(key, None)
+                self.updates[cache_file][key] = None
+            return
+        file_stat = os.stat(file_path)
+        self.update(file_path, {'size': file_stat.st_size, 'mtime': file_stat.st_mtime, 'is_valid': is_valid})
+
+    def record_schema(self, file_path, result):
+        """Запоминает результат проверки по XSD (вердикт целостности в той же записи не затирает)"""
+        self.update(file_path, {'schema': result})
+
+    def update(self, file_path, fields):
+        """Обновляет поля записи файла; при сохранении в файл кэша пишутся только эти поля"""
+        with self.lock:
+            cache_file, key = self.get_entry(file_path)
+            self.caches[cache_file].setdefault(key, {}).update(fields)
+            self.updates[cache_file][key] = {**(self.updates[cache_file].get(key) or {}), **fields}
+            pending = sum(len(updates) for updates in self.updates.values())
+        if pending >= self.save_every:
+            self.save()
+
+    def save(self):
+        """Записывает новые вердикты в файлы кэша
+
+        Файл кэша перечитывается и заменяется атомарно через os.replace, так что
+        вердикты других процессов не теряются, а при сбое файл не обрезается.
+        """
+        with self.lock:
+            for cache_file, updates in self.updates.items():
+                cache = load_integrity_cache(cache_file)
+                for key, entry in updates.items():
+                    if entry is None:
+                        cache.pop(key, None)
+                    else:
+                        cache.setdefault(key, {}).update(entry)
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(cache, f, indent=2, ensure_ascii=False)
+                os.replace(tmp_file, cache_file)
+                self.caches[cache_file] = cache
+            self.updates.clear()
+
+def collect_files(base_dir="."):
+    """Собирает месячные XML файлы и архивы для проверки"""
+    files = [f for f in glob.glob(os.path.join(base_dir, 'xml', '*', 'data', '*.xml*')) if is_manifest(f)]
+    # Архивы одинаковых имен из разных месяцев лежат в data/YYYY-MM, поэтому ищем рекурсивно
+    files.extend(glob.glob(os.path.join(base_dir, 'xml', '*', 'data', '**', '*.zip'), recursive=True))
+    files.extend(find_archives(os.path.join(base_dir, 'data')))
+    return sorted(set(files))
+
+def validate_files(files, xsd_dirs, max_workers=None, force=False, base_dir="."):
+    """Проверяет файлы по XSD в пуле процессов и сохраняет результаты в кэш целостности
+
+    Вердикты хранятся под теми же ключами (путь относительно base_dir), что
+    и вердикты проверки целостности download_xml_data.py.
+    """
+    if etree is None:
+        print("Для проверки по XSD требуется пакет lxml")
+        return {}
+
+    integrity = IntegrityCache(base_dir)
+    tasks = []
+    skipped = 0
+    no_schema = []
+    for file_path in files:
+        file_stat = os.stat(file_path)
+        cached = integrity.get_schema(file_path)
+        if (not force and cached and cached.get('size') == file_stat.st_size
+                and cached.get('mtime') == file_stat.st_mtime):
+            skipped += 1
+            record_cache('schema', True)
+            continue
+        record_cache('schema', False)
+
+        if is_archive(file_path):
+            xsd_path = find_xsd_for_archive(file_path, xsd_dirs)
+        else:
+            xsd_path = find_xsd_by_hint(file_path, xsd_dirs)
+        if xsd_path is None:
+            no_schema.append(file_path)
+            continue
+        tasks.append((file_path, xsd_path))
+
+    print(f"\nСтатистика проверки по XSD:")
+    print(f"- Всего файлов: {len(files)}")
+    print(f"- Пропущено (из кэша): {skipped}")
+    print(f"- Без схемы: {len(no_schema)}")
+    print(f"- Требует проверки: {len(tasks)}")
+
+    # Группируем задачи по схеме, чтобы каждый процесс чаще попадал в свой кэш
+    tasks.sort(key=lambda task: task[1])
+    results = defaultdict(int)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        future_to_task = {
+            executor.submit(validate_file, file_path, xsd_path): (file_path, xsd_path)
+            for file_path, xsd_path in tasks
+        }
+        with tqdm(total=len(tasks), desc="Проверка по XSD") as pbar:
+            for future in as_completed(future_to_task):
+                file_path, xsd_path = future_to_task[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'valid': False, 'xsd': xsd_path, 'members': {}, 'error': str(e)}
+
+                file_stat = os.stat(file_path)
+                result.update({
+                    'size': file_stat.st_size,
+                    'mtime': file_stat.st_mtime,
+                    'checked_at': datetime.now().isoformat()
+                })
+                # Вердикт по схеме хранится рядом с вердиктом целостности
+                integrity.record_schema(file_path, result)
+                results['valid' if result['valid'] else 'invalid'] += 1
+                if not result['valid']:
+                    pbar.write(f"✗ {os.path.basename(file_path)} не соответствует {os.path.basename(xsd_path)}")
+                pbar.update(1)
+
+    integrity.save()
+
+    print(f"\nИтоговая статистика проверки по XSD:")
+    print(f"- Соответствуют схеме: {results['valid']}")
+    print(f"- Не соответствуют схеме: {results['invalid']}")
+    return dict(results)
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка XML файлов и архивов по XSD схемам')
+    parser.add_argument('files', nargs='*', help='Файлы для проверки (по умолчанию - все скачанные)')
+    parser.add_argument('--base-dir', default='.', help='Базовая директория')
+    parser.add_argument('--workers', type=int, default=None, help='Количество процессов')
+    parser.add_argument('--force', action='store_true', help='Проверить заново все файлы')
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_from_args(args)
+    profiling.start_from_args(args)
+
+    files = args.files or collect_files(args.base_dir)
+    if not files:
+        print("Не найдено файлов для проверки")
+        return
+    with StageTimer('validate'):
+        validate_files(files, find_xsd_dirs(args.base_dir), args.workers, args.force, args.base_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import os
+import re
+import json
+import hashlib
+import xml.etree.ElementTree as ET
+from repack_zstd import open_archive, REPACKED_EXTENSION
+
+# Путь к архиву внутри data/: <248|no248>/<inspections|plan>/<YYYY-MM>/data-*.zip
+ARCHIVE_PARTITION_RE = re.compile(r'(?:^|[\\/])(248|no248)[\\/](inspections|plan)[\\/](\d{4}-\d{2})(?:[\\/]|$)')
+
+# Поля, которые считаются естественным ключом записи (в порядке приоритета)
+RECORD_KEY_FIELDS = ('@ERPID', '@ERKNMID', '@ID', '@GUID', 'ERPID', 'ERKNMID', 'ID', 'GUID')
+
+def find_archives(data_dir):
+    """Рекурсивно находит все архивы data-*.zip (и перепакованные data-*.zst) в директории"""
+    archives = []
+    for root, dirs, files in os.walk(data_dir):
+        for file in files:
+            if file.startswith('data-') and file.endswith(('.zip', REPACKED_EXTENSION)):
+                archives.append(os.path.join(root, file))
+    return sorted(archives)
+
+def get_archive_partition(archive_path):
+    """Определяет (248|no248, inspections|plan, YYYY-MM) по пути к архиву"""
+    match = ARCHIVE_PARTITION_RE.search(os.path.dirname(os.path.abspath(archive_path)))
+    if match:
+        return match.group(1), match.group(2), match.group(3)
+    return None
+
+def extract_snapshot_date(archive_path):
+    """Извлекает дату выгрузки YYYYMMDD из имени архива data-YYYYMMDD-structure-YYYYMMDD.zip"""
+    match = re.search(r'data-(\d{8})', os.path.basename(archive_path))
+    if match:
+        return match.group(1)
+    return None
+
+def extract_structure_version(archive_path):
+    """Извлекает версию структуры YYYYMMDD из токена structure-YYYYMMDD"""
+    match = re.search(r'structure-(\d{8})', os.path.basename(archive_path))
+    if match:
+        return match.group(1)
+    return None
+
+def iter_archive_members(archive_path):
+    """Последовательно открывает XML файлы внутри архива, не распаковывая их на диск
+
+    Yields:
+        tuple: (имя файла в архиве, файловый объект для потокового чтения)
+    """
+    with open_archive(archive_path) as zip_ref:
+        for info in zip_ref.infolist():
+            if info.is_dir() or not info.filename.lower().endswith('.xml'):
+                continue
+            with zip_ref.open(info) as member:
+                yield info.filename, member
+
+def strip_namespace(tag):
+    """Убирает пространство имен из имени тега"""
+    if tag.startswith('{'):
+        return tag.split('}', 1)[1]
+    return tag
+
+def flatten_element(element):
+    """Преобразует элемент XML в плоский словарь {путь: значение}
+
+    Вложенные элементы записываются через "/", атрибуты через "@",
+    повторяющиеся элементы получают суффикс [n].
+    """
+    record = {}
+
+    def add_value(key, value):
+        if key in record:
+            index = 2
+            while f"{key}[{index}]" in record:
+                index += 1
+            key = f"{key}[{index}]"
+        record[key] = value
+
+    def process_element(elem, path):
+        for attr_name, attr_value in elem.attrib.items():
+            add_value(f"{path}@{strip_namespace(attr_name)}" if path else f"@{strip_namespace(attr_name)}", attr_value)
+        text = elem.text.strip() if elem.text else ''
+        if text and path:
+            add_value(path, text)
+        for child in elem:
+            child_tag = strip_namespace(child.tag)
+            process_element(child, f"{path}/{child_tag}" if path else child_tag)
+
+    process_element(element, '')
+    return record
+
+def iter_record_elements(stream, record_tag=None, record_depth=1):
+    """Потоково разбирает XML и возвращает элементы записей по одному
+
+    Записью считается элемент с именем record_tag (самый внешний), а если имя
+    не задано - каждый элемент на глубине record_depth от корня. После обработки
+    элемент очищается, поэтому память ограничена размером одной записи.
+    """
+    stack = []
+    record_level = None
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            if record_level is None:
+                depth = len(stack) - 1
+                if record_tag is not None:
+                    if strip_namespace(elem.tag) == record_tag:
+                        record_level = depth
+                elif depth == record_depth:
+                    record_level = depth
+            continue
+
+        stack.pop()
+        if record_level is not None and len(stack) == record_level:
+            yield elem
+            record_level = None
+            elem.clear()
+            # Убираем обработанную запись из родителя, чтобы дерево не росло
+            if stack:
+                stack[-1].remove(elem)
+
+def iter_records(stream, record_tag=None, record_depth=1, decoder=None):
+    """Потоково возвращает записи XML в виде плоских словарей
+
+    Если передан decoder (функция decode из модуля generate_decoders), записи
+    возвращаются типизированными объектами, преобразованными один раз при разборе.
+    """
+    for elem in iter_record_elements(stream, record_tag, record_depth):
+        if decoder is not None:
+            yield decoder(elem)
+        else:
+            yield flatten_element(elem)
+
+def iter_archive_records(archive_path, record_tag=None, record_depth=1, decoder=None):
+    """Возвращает все записи архива с их положением
+
+    Yields:
+        tuple: (имя файла в архиве, порядковый номер записи в файле, запись)
+    """
+    for member_name, member in iter_archive_members(archive_path):
+        for offset, record in enumerate(iter_records(member, record_tag, record_depth, decoder)):
+            yield member_name, offset, record
+
+def get_record_key(record, key_fields=RECORD_KEY_FIELDS):
+    """Возвращает естественный ключ записи или хеш ее содержимого, если ключ не найден"""
+    for field in key_fields:
+        value = record.get(field)
+        if value:
+            return value
+    return get_record_hash(record)
+
+def get_record_hash(record):
+    """Вычисляет хеш содержимого записи без служебных полей"""
+    content = {key: value for key, value in record.items() if not key.startswith('_')}
+    serialized = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(serialized.encode('utf-8'), digest_size=16).hexdigest()